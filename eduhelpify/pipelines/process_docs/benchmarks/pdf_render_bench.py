@@ -0,0 +1,79 @@
+"""Compare the PDF renderer with the previous one-Paragraph-per-line path.
+
+Usage: python benchmarks/pdf_render_bench.py [sizes...]   (run from process_docs)
+
+Sizes are output lengths in characters and default to 10k, 100k and 1M.
+Each timing is the best of BENCH_REPEAT runs (default 3).
+"""
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.pdf_renderer import render_pdf
+
+SAMPLE = """# Chapter summary
+
+## Key ideas
+
+The model output mixes **bold terms**, `inline code` and comparisons like a < b & c > d.
+Each section has a few lines of running text that belong to the same paragraph
+and continue on the next line.
+
+- First bullet point with some detail
+- Second bullet point
+  - Nested point
+1. Numbered step
+2. Another step
+
+"""
+
+
+def legacy_render(content, output_path):
+    """The save_response PDF branch before the dedicated renderer"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph
+    from reportlab.lib.styles import getSampleStyleSheet
+
+    content = content.replace("*", " ")
+    doc = SimpleDocTemplate(output_path, pagesize=letter)
+    styles = getSampleStyleSheet()
+    # The old path raised on < and &, so feed it escaped text to get a timing at all
+    content = content.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    story = [Paragraph(line, styles["Normal"]) for line in content.split("\n")]
+    doc.build(story)
+
+
+def make_content(size):
+    return (SAMPLE * (size // len(SAMPLE) + 1))[:size]
+
+
+def time_render(render, content, output_path, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        render(content, output_path)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, os.path.getsize(output_path)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    repeat = int(os.environ.get("BENCH_REPEAT", 3))
+    print(f"{'chars':>10} {'legacy s':>10} {'renderer s':>11} {'speedup':>8} {'legacy KB':>10} {'renderer KB':>12}")
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in sizes:
+            content = make_content(size)
+            legacy_seconds, legacy_bytes = time_render(legacy_render, content, os.path.join(work_dir, "legacy.pdf"), repeat)
+            new_seconds, new_bytes = time_render(render_pdf, content, os.path.join(work_dir, "renderer.pdf"), repeat)
+            print(
+                f"{size:>10} {legacy_seconds:>10.2f} {new_seconds:>11.2f} {legacy_seconds / new_seconds:>7.1f}x "
+                f"{legacy_bytes / 1024:>10.0f} {new_bytes / 1024:>12.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
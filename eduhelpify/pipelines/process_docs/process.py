@@ -1,140 +1,89 @@
 import os
-import json
-import requests
-from urllib.parse import urlparse
+import socket
+import atexit
+from functools import partial
 from flask import Flask, request, jsonify
 from utils.logger import Logger
 from utils.database_service import DatabaseService
 from utils.ai_services import AiServices
+from utils.gemini_files import GeminiFileRegistry
+from utils.response_cache import ResponseCache
 from utils.email_service import EmailService
+from utils.notification_outbox import OutboxSender
+from utils.file_downloader import FileDownloader
+from utils.file_cache import FileCache
+from utils.text_extraction import TextExtractor
+from utils.text_store import TextStore
+from utils.lexical_index import FocusRetriever
+from utils.token_accounting import TokenBudget, TokenLedger, estimate_request_tokens
+from utils.storage_service import StorageService
+from utils.write_buffer import WriteBehindBuffer
+from utils.task_queue import TaskQueue, TaskWorkerPool, TaskLeaseKeeper, drain_tasks, PROCESS_QUEUE_MAX_WORKERS
+from utils.resilience import CircuitOpenError
+from utils.model_router import ModelRouter
 import dotenv
-import base64
 
 dotenv.load_dotenv(override=True)
 STORE_LOCATION = os.getenv("STORE_LOCATION")
 SUPABASE_URL = os.getenv("NEXT_PUBLIC_SUPABASE_URL")
 SUPABASE_SERVICE_ROLE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+WORKER_ID = os.getenv("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+PROCESS_QUEUE_BATCH_SIZE = int(os.getenv("PROCESS_QUEUE_BATCH_SIZE", 10))
 app = Flask(__name__)
 
 # Initialize shared services
 logger = Logger(log_file="eduhelpify.log")
+# Fork the extraction workers first, while this process has no other threads
+text_extractor = TextExtractor(logger, text_store=TextStore(logger), retriever=FocusRetriever(logger))
+text_extractor.start()
 db_service = DatabaseService(logger)
-email_service = EmailService(logger, db_service)
-
-def download_file(url, task_id, file_name):
-    """Download file from URL and save to local path"""
-    try:
-        # Create input directory if it doesn't exist
-        input_dir = os.path.join(STORE_LOCATION, 'input')
-        os.makedirs(input_dir, exist_ok=True)
-        
-        # Check if URL is actually a local path
-        if not url.startswith('http'):
-            # It's a local path, just return it
-            logger.info(f"Using local file path: {url}")
-            return url
-
-        # Parse URL to extract storage path
-        parsed_url = urlparse(url)
-        path_parts = parsed_url.path.split('/')
-        
-        # Find the part after 'eduhelpify/' in the path
-        storage_path = None
-        for i, part in enumerate(path_parts):
-            if part == 'eduhelpify' and i < len(path_parts) - 1:
-                storage_path = '/'.join(path_parts[i+1:])
-                break
-        
-        if not storage_path:
-            logger.error(f"Could not parse storage path from URL: {url}")
-            raise ValueError(f"Invalid storage URL format: {url}")
-            
-        logger.info(f"Extracted storage path: {storage_path}")
-        
-        # Create local file path
-        local_path = os.path.join(input_dir, file_name)
-        
-        # Try to download directly first
-        try:
-            logger.info(f"Attempting direct download from URL: {url}")
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            
-            # Save file
-            with open(local_path, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                    
-            logger.info(f"Downloaded file directly from {url} to {local_path}")
-            return local_path
-        except Exception as direct_error:
-            logger.warning(f"Direct download failed: {str(direct_error)}. Trying with service role key.")
-            
-            # Use service role key to get signed URL if direct download fails
-            if SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY:
-                try:
-                    # Construct API endpoint for downloading with service role
-                    api_endpoint = f"{SUPABASE_URL}/storage/v1/object/eduhelpify/{storage_path}"
-                    
-                    headers = {
-                        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-                        "apikey": SUPABASE_SERVICE_ROLE_KEY
-                    }
-                    
-                    logger.info(f"Requesting file with service role key: {api_endpoint}")
-                    response = requests.get(api_endpoint, headers=headers, stream=True)
-                    response.raise_for_status()
-                    
-                    # Save file
-                    with open(local_path, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                    
-                    logger.info(f"Downloaded file with service role from {api_endpoint} to {local_path}")
-                    return local_path
-                except Exception as service_error:
-                    logger.error(f"Service role download failed: {str(service_error)}")
-                    raise
-            else:
-                logger.error("Service role key not available for authenticated download")
-                raise direct_error
-        
-    except Exception as e:
-        logger.error(f"Error downloading file {url}: {str(e)}")
-        raise
+write_buffer = WriteBehindBuffer(logger, db_service)
+atexit.register(write_buffer.close)
+input_cache = FileCache(logger)
+gemini_files = GeminiFileRegistry(logger)
+response_cache = ResponseCache(logger)
+# Shared by every task: one breaker and one per-minute budget per Gemini model
+model_router = ModelRouter(logger)
+file_downloader = FileDownloader(logger, STORE_LOCATION, file_cache=input_cache)
+storage_service = StorageService(logger)
+email_service = EmailService(logger, db_service, storage_service)
+outbox_sender = OutboxSender(logger, db_service, worker_id=WORKER_ID)
+token_budget = TokenBudget(logger, db_service)
+task_queue = TaskQueue(logger)
+lease_keeper = TaskLeaseKeeper(logger, db_service, WORKER_ID)
 
 @app.route('/')
 def home():
     return jsonify({"status": "running", "service": "EduHelpify Document Processing API"})
 
-@app.route('/process/<task_id>', methods=['POST'])
-def process_task_by_id(task_id):
-    """Process a specific task by ID"""
+def run_task(task_id):
+    """Run the full processing pipeline for a task.
+
+    Returns:
+        tuple: (response payload dict, HTTP status code)
+    """
     try:
-        # Initialize a fresh AI service instance for this task
-        ai_service = AiServices(logger=logger)
-        logger.info(f"Initialized new AI service instance for task: {task_id}")
+        # Token usage of every model call made for this task
+        ledger = TokenLedger(task_id)
         
-        # Update task status to Processing
-        db_service.update_task_status(task_id, "INPROGRESS")
+        # The claim in run_claimed_task has already marked the task INPROGRESS
         logger.info(f"Processing task: {task_id}")
         
-        # Get task details
-        task_response = db_service.supabase.table("task").select("*").eq("id", task_id).execute()
-        if not task_response.data or len(task_response.data) == 0:
+        # Load the task with its config, content type, system prompt, input files and user in one query
+        context = db_service.load_task_context(task_id)
+        if not context:
             logger.error(f"Task not found: {task_id}")
-            return jsonify({"status": "error", "message": "Task not found"}), 404
+            return {"status": "error", "message": "Task not found"}, 404
         
-        task = task_response.data[0]
+        task = context.task
         output_content_type_id = task.get("output_content_type_id")
-        output_content_type_response = db_service.supabase.table("contenttype").select("*").eq("id", output_content_type_id).execute()
-        logger.info(f"Output content type response: {output_content_type_response}")
-        if not output_content_type_response.data or len(output_content_type_response.data) == 0:
+        output_content_type = context.output_content_type
+        logger.info(f"Output content type: {output_content_type}")
+        if not output_content_type:
             logger.error(f"Output content type not found: {output_content_type_id}")
-            db_service.update_task_status(task_id, "Failed")
-            return jsonify({"status": "error", "message": "Output content type not found"}), 400
+            write_buffer.update_task_status(task_id, "Failed")
+            return {"status": "error", "message": "Output content type not found"}, 400
         
-        output_content_type = output_content_type_response.data[0]
         output_content_type_extension = output_content_type.get("extensions")[0].replace(".", "")
         logger.info(f"Output content type: {output_content_type_extension}")
         
@@ -142,22 +91,22 @@ def process_task_by_id(task_id):
         task_config_id = task.get("task_config_id")
         if not task_config_id:
             logger.error(f"Task config ID not found for task: {task_id}")
-            db_service.update_task_status(task_id, "Failed")
-            return jsonify({"status": "error", "message": "Task config ID not found"}), 400
+            write_buffer.update_task_status(task_id, "Failed")
+            return {"status": "error", "message": "Task config ID not found"}, 400
         
         # 2. Get the task_config
-        task_config = db_service.get_task_config(task_id)
+        task_config = context.task_config
         if not task_config:
             logger.error(f"Task config not found for task: {task_id}")
-            db_service.update_task_status(task_id, "Failed")
-            return jsonify({"status": "error", "message": "Task config not found"}), 400
+            write_buffer.update_task_status(task_id, "Failed")
+            return {"status": "error", "message": "Task config not found"}, 400
         
         # 3. Get the system_prompt based on input and output content types
-        system_prompt = db_service.get_system_prompt(task["output_content_type_id"])
+        system_prompt = context.system_prompt
         if not system_prompt:
             logger.error(f"System prompt not found for task: {task_id}")
-            db_service.update_task_status(task_id, "Failed")
-            return jsonify({"status": "error", "message": "System prompt not found"}), 400
+            write_buffer.update_task_status(task_id, "Failed")
+            return {"status": "error", "message": "System prompt not found"}, 400
         
         # Add focus area from task config if available
         focus_area = task_config.get("focus_area", "")
@@ -173,75 +122,79 @@ def process_task_by_id(task_id):
             prompt_text = f"{prompt_text}\nFocus on: {focus_area}"
         
         # 4. Get the task input files
-        input_files = db_service.get_files_by_task_and_type(task_id, "input")
+        input_files = context.input_files
         logger.info(f"Input files: {input_files}")
         if not input_files:
             logger.error(f"No input files found for task: {task_id}")
-            db_service.update_task_status(task_id, "Failed")
-            return jsonify({"status": "error", "message": "No input files found"}), 400
+            write_buffer.update_task_status(task_id, "Failed")
+            return {"status": "error", "message": "No input files found"}, 400
         
-        # Download files from URLs and get local paths
-        file_paths = []
-        successful_downloads = 0
-        total_files = len(input_files)
+        # User prompt - can be customized based on your needs
+        user_prompt = task.get("user_prompt", "")
         
-        for file in input_files:
-            try:
-                # Get the stored location which is now a URL
-                stored_location = file['stored_location']
-                file_name = file['file_name']
-                
-                logger.info(f"Attempting to download file: {file_name} from {stored_location}")
-                
-                # Download the file and get the local path
-                local_path = download_file(stored_location, task_id, file_name)
-                file_paths.append(local_path)
-                successful_downloads += 1
-                
-                logger.info(f"Successfully downloaded file: {file_name}")
-            except Exception as e:
-                logger.error(f"Error downloading file {file['file_name']}: {str(e)}")
-                # Continue with other files
+        # Download files from URLs in parallel and get local paths
+        downloaded_paths = file_downloader.download_all(input_files, task_id)
+        successful_downloads = sum(1 for path in downloaded_paths if path)
+        
+        # Send extracted text instead of the original files where that is cheaper
+        prepared_paths = text_extractor.prepare(input_files, downloaded_paths, os.path.join(STORE_LOCATION, "text", task_id), focus_area, user_prompt)
+        file_paths = [path for path in prepared_paths if path]
+        total_files = len(input_files)
         
         logger.info(f"Downloaded {successful_downloads} of {total_files} files")
         
         if not file_paths:
             logger.error(f"No valid input file paths found for task: {task_id}")
-            db_service.update_task_status(task_id, "Failed")
-            return jsonify({"status": "error", "message": "No valid input files found"}), 400
+            write_buffer.update_task_status(task_id, "Failed")
+            return {"status": "error", "message": "No valid input files found"}, 400
         
         logger.info(f"File paths: {file_paths}")
-        # User prompt - can be customized based on your needs
-        user_prompt = task.get("user_prompt", "")
         
         # Create output directory
         output_dir = os.path.join(STORE_LOCATION, 'output')
         os.makedirs(output_dir, exist_ok=True)
         output_path = os.path.join(output_dir, f"output_{task_id}.{output_content_type_extension}")
+        user_id = (context.user or {}).get("id") or task.get("user_id")
         
         try:
+            # Size the request locally and apply the user's token budget before anything is uploaded
+            estimated_tokens = estimate_request_tokens(file_paths, prompt_text, user_prompt)
+            decision = token_budget.check(context.user, estimated_tokens)
+            logger.info(f"Pre-flight estimate for task {task_id}: ~{estimated_tokens} prompt tokens ({decision.action})")
+            if decision.action == "REJECT":
+                logger.warning(f"Rejecting task {task_id}: {decision.reason}")
+                ledger.preflight(decision, None)
+                write_buffer.update_task_status(task_id, "Failed")
+                return {"status": "error", "message": decision.reason, "estimated_tokens": estimated_tokens}, 413
+            if decision.action == "DOWNGRADE":
+                logger.warning(f"Downgrading task {task_id} to {decision.model_name}: {decision.reason}")
+            
+            # Choose the model, falling back to another one when the preferred model is saturated
+            route = model_router.route(task_id, task_config, estimated_tokens, forced_model=decision.model_name)
+            if route is None:
+                raise CircuitOpenError(model_router.retry_in)
+            ledger.preflight(decision, route.model_name)
+            
+            # Initialize a fresh AI service instance for this task
+            ai_service = AiServices(model_name=route.model_name, logger=logger, file_registry=gemini_files,
+                                    response_cache=response_cache, caller=route.caller, ledger=ledger)
+            logger.info(f"Initialized new AI service instance for task: {task_id}")
+            
             # Process files with the AI service
             result = ai_service.process_mixed_files(
                 file_paths=file_paths,
                 system_prompt=prompt_text,
                 user_prompt=user_prompt,
-                output_path=output_path
+                output_path=output_path,
+                use_cache=task.get("use_cache") is not False,
+                progress_callback=lambda bytes_generated, chunks, tokens: write_buffer.update_task_progress(task_id, bytes_generated, chunks, tokens)
             )
             
             # Determine file extension based on output type
             file_extension = "txt"  # Default
-            output_type_response = db_service.supabase.table("contenttype").select("*").eq("id", task["output_content_type_id"]).execute()
-            if output_type_response.data and len(output_type_response.data) > 0:
-                output_type = output_type_response.data[0]
-                if output_type["name"]:
-                    if output_type["name"].lower() == "json":
-                        file_extension = "json"
-                    elif output_type["name"].lower() == "html":
-                        file_extension = "html"
-                    elif output_type["name"].lower() == "pdf":
-                        file_extension = "pdf"
-                    elif output_type["name"].lower() == "pptx":
-                        file_extension = "pptx"
+            output_type_name = (output_content_type.get("name") or "").lower()
+            if output_type_name in ("json", "html", "pdf", "pptx"):
+                file_extension = output_type_name
 
             # Save output file in database
             final_output_path = f"{output_dir}/output_{task_id}.{file_extension}"
@@ -250,31 +203,12 @@ def process_task_by_id(task_id):
             
             stored_location = final_output_path  # Default to local path
                 
-            # Upload the output file to Supabase Storage using service role
-            if SUPABASE_URL and SUPABASE_SERVICE_ROLE_KEY:
+            # Upload the output file to Supabase Storage using service role, streaming it from disk
+            if storage_service.configured:
                 try:
-                    # Construct API endpoint for uploads with service role
-                    api_endpoint = f"{SUPABASE_URL}/storage/v1/object/eduhelpify/task/output_{task_id}.{file_extension}"
-                    
-                    headers = {
-                        "Authorization": f"Bearer {SUPABASE_SERVICE_ROLE_KEY}",
-                        "apikey": SUPABASE_SERVICE_ROLE_KEY,
-                        "Content-Type": f"application/{file_extension}"
-                    }
-                    
-                    # Read file content
-                    with open(final_output_path, 'rb') as file_content:
-                        file_data = file_content.read()
-                    
-                    # Upload file
-                    logger.info(f"Uploading file to Supabase with service role: {api_endpoint}")
-                    response = requests.post(api_endpoint, data=file_data, headers=headers)
-                    response.raise_for_status()
-                    
-                    # Get the public URL
-                    public_url = f"{SUPABASE_URL}/storage/v1/object/public/eduhelpify/task/output_{task_id}.{file_extension}"
-                    stored_location = public_url
-                    logger.info(f"Uploaded file, public URL: {public_url}")
+                    upload_stats = storage_service.upload_file(final_output_path, f"task/output_{task_id}.{file_extension}")
+                    stored_location = upload_stats["public_url"]
+                    logger.info(f"Uploaded file, public URL: {stored_location}")
                 except Exception as e:
                     logger.error(f"Error uploading to Supabase: {str(e)}")
                     # Continue with local path
@@ -287,58 +221,194 @@ def process_task_by_id(task_id):
                 "file_type_id": task["output_content_type_id"],
                 "stored_location": stored_location,
                 "file_category": "output",
+                "file_size": os.path.getsize(final_output_path),
                 "need_ocr": False
             }
             
-            # Store file record in database
-            db_service.supabase.table("filestore").insert(output_data).execute()
+            # Store file record in database (buffered; flushed before the task is marked Completed)
+            write_buffer.insert_file(output_data)
             
-            # 5. Send email with the results
-            email_sent = email_service.send_task_output(task_id)
-            if not email_sent:
-                logger.warning(f"Email could not be sent for task: {task_id}")
+            # 5. Queue the results email; the outbox sender delivers it in the background
+            email_queued = email_service.queue_task_output(
+                task_id,
+                user_details=context.user_details,
+                output_files=[output_data],
+                local_paths={output_data["file_name"]: final_output_path}
+            )
+            if not email_queued:
+                logger.warning(f"Email could not be queued for task: {task_id}")
             
             # Update task status to Completed
-            db_service.update_task_status(task_id, "Completed")
+            write_buffer.update_task_status(task_id, "Completed")
             logger.info(f"Task {task_id} completed successfully")
             
-            return jsonify({
+            return {
                 "status": "success", 
                 "message": "Task processed successfully",
-                "email_sent": email_sent
-            })
+                "email_queued": email_queued,
+                "tokens": ledger.totals()
+            }, 200
             
+        except CircuitOpenError as e:
+            # The provider is down, not the task: give up the claim so it can be claimed again later
+            logger.warning(f"Requeueing task {task_id}: {str(e)}")
+            try:
+                db_service.release_task(task_id, WORKER_ID)
+            except Exception as release_error:
+                # The lease lapses on its own and the task becomes claimable again
+                logger.error(f"Error releasing task {task_id}: {str(release_error)}")
+            return {"status": "error", "message": str(e), "retry_in": round(e.retry_in)}, 503
         except Exception as e:
             logger.error(f"Error processing task {task_id}: {str(e)}")
-            db_service.update_task_status(task_id, "Failed")
-            return jsonify({"status": "error", "message": str(e)}), 500
+            write_buffer.update_task_status(task_id, "Failed")
+            return {"status": "error", "message": str(e)}, 500
+        finally:
+            # Calls are billed whether or not the task succeeded
+            write_buffer.insert_usage(ledger.rows(user_id))
             
     except Exception as e:
-        logger.error(f"Error in process_task_by_id: {str(e)}")
+        logger.error(f"Error in run_task: {str(e)}")
+        return {"status": "error", "message": str(e)}, 500
+
+def run_claimed_task(task_id, claimed=False):
+    """Claim a task in the database and run it while keeping its lease alive
+
+    Every path that runs a task goes through here, so a task is only ever run
+    by the worker holding its claim.
+
+    Args:
+        task_id: The task to run
+        claimed: True when the caller already claimed the task (e.g. through claim_tasks)
+    """
+    if not claimed and not db_service.claim_task(task_id, WORKER_ID, lease_keeper.lease_seconds):
+        logger.info(f"Skipping task {task_id}: it is not queued or another worker holds it")
+        return {"status": "skipped", "message": "Task is not queued or is claimed by another worker"}, 409
+    lease_keeper.add(task_id)
+    try:
+        return run_task(task_id)
+    finally:
+        lease_keeper.remove(task_id)
+
+def abandon_task(task_id):
+    """Give up on a task that ran past its timeout so another worker can claim it
+
+    The thread running it cannot be stopped; its lease is no longer renewed and
+    the task is put back in the queue.
+    """
+    lease_keeper.remove(task_id)
+    try:
+        db_service.release_task(task_id, WORKER_ID)
+    except Exception as e:
+        # The lease is no longer renewed, so it lapses and the task becomes claimable anyway
+        logger.error(f"Error releasing timed out task {task_id}: {str(e)}")
+
+# Background workers that run queued tasks outside the request cycle
+worker_pool = TaskWorkerPool(logger, task_queue, run_claimed_task, paused=lambda: model_router.is_open)
+
+def start_background_workers():
+    """Resume jobs left over from a previous run and start delivering queued emails"""
+    worker_pool.start()
+    outbox_sender.start()
+
+if __name__ != '__main__':
+    # Imported by a WSGI server (e.g. gunicorn): this process serves requests
+    start_background_workers()
+
+@app.route('/process/<task_id>', methods=['POST'])
+def process_task_by_id(task_id):
+    """Queue a specific task by ID for background processing"""
+    try:
+        job = task_queue.enqueue(task_id)
+        worker_pool.notify()
+        return jsonify({
+            "status": "accepted",
+            "message": "Task queued for processing",
+            "task_id": task_id,
+            "job_id": job["id"]
+        }), 202
+    except Exception as e:
+        logger.error(f"Error queueing task {task_id}: {str(e)}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/process/<task_id>', methods=['GET'])
+def get_task_job(task_id):
+    """Get the background job state for a task"""
+    job = task_queue.get_job(task_id)
+    if not job:
+        return jsonify({"status": "error", "message": "Task has not been queued"}), 404
+    return jsonify({"status": "success", "job": job})
+
+@app.route('/cache/usertype/invalidate', methods=['POST'])
+def invalidate_user_type_cache():
+    """Drop cached usertype rows so changed token budgets apply to the next task"""
+    removed = db_service.invalidate_reference_cache("usertype")
+    return jsonify({"status": "success", "message": f"Invalidated {removed} cached usertype rows"})
+
+@app.route('/outbox/drain', methods=['POST'])
+def drain_outbox():
+    """Deliver one batch of queued notification emails now"""
+    try:
+        stats = outbox_sender.drain()
+        return jsonify({"status": "success", **stats})
+    except Exception as e:
+        logger.error(f"Error draining outbox: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route('/process_queue', methods=['POST'])
 def process_queue():
-    """Process all queued tasks"""
+    """Claim a batch of queued tasks and process them in parallel with a bounded number in flight"""
     try:
-        # Get all queued tasks
-        queued_tasks = db_service.get_queued_tasks()
-        if not queued_tasks:
-            return jsonify({"status": "success", "message": "No queued tasks found"}), 200
+        batch_size = request.args.get("batch_size", PROCESS_QUEUE_BATCH_SIZE, type=int)
+        # Callers may ask for fewer workers than configured, never more
+        max_workers = min(max(request.args.get("max_workers", PROCESS_QUEUE_MAX_WORKERS, type=int), 1), PROCESS_QUEUE_MAX_WORKERS)
+        task_timeout = request.args.get("task_timeout", type=float)
         
-        results = []
-        for task in queued_tasks:
-            task_id = task["id"]
-            # Process each task (each will get its own AI service instance)
-            response = process_task_by_id(task_id)
-            results.append({
-                "task_id": task_id,
-                "status": "processed"
+        # Leave tasks in the queue while the model provider is failing
+        if model_router.is_open:
+            retry_in = round(model_router.retry_in)
+            response = jsonify({
+                "status": "paused",
+                "message": f"Model provider is unavailable, retry in {retry_in}s"
             })
+            response.headers["Retry-After"] = str(retry_in)
+            return response, 503
+        
+        # Atomically claim tasks so other replicas draining the queue skip them
+        claimed_tasks = db_service.claim_tasks(WORKER_ID, batch_size, lease_keeper.lease_seconds)
+        if not claimed_tasks:
+            return jsonify({"status": "success", "message": "No queued tasks found"}), 200
+        
+        # Renew every claimed lease from now on, not only once a worker starts the task:
+        # tasks waiting behind max_workers would otherwise lose their lease to another replica
+        task_ids = [task["id"] for task in claimed_tasks]
+        for task_id in task_ids:
+            lease_keeper.add(task_id)
+        
+        # Each task gets its own AI service instance inside run_task
+        try:
+            results = drain_tasks(logger, partial(run_claimed_task, claimed=True), task_ids, max_workers=max_workers,
+                                  task_timeout=task_timeout, on_timeout=abandon_task)
+        except Exception:
+            for task_id in task_ids:
+                lease_keeper.remove(task_id)
+            raise
+        
+        succeeded = sum(1 for result in results if result["status"] == "success")
+        failed = sum(1 for result in results if result["status"] == "error")
+        requeued = sum(1 for result in results if result["status"] == "requeued")
+        timed_out = sum(1 for result in results if result["status"] == "timeout")
+        logger.info(f"Queue drain finished: {succeeded} succeeded, {failed} failed, {requeued} requeued, {timed_out} timed out")
+        
+        # Drop Gemini uploads that are too old to be reused by the next drain
+        gemini_files.cleanup_expired()
         
         return jsonify({
-            "status": "success", 
+            "status": "success" if succeeded == len(results) else "partial",
             "message": f"Processed {len(results)} tasks",
+            "succeeded": succeeded,
+            "failed": failed,
+            "requeued": requeued,
+            "timed_out": timed_out,
             "tasks": results
         })
         
@@ -351,5 +421,11 @@ if __name__ == '__main__':
     port = int(os.environ.get("PORT", 5000))
     debug = os.environ.get("FLASK_DEBUG", "False").lower() == "true"
     
+    app.debug = True
+    
+    # The debug reloader's parent process only watches files; the child it starts serves requests
+    if not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_background_workers()
+    
     # Run the Flask app
-    app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=port, debug=app.debug)
\ No newline at end of file
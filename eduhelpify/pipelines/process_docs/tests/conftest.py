@@ -0,0 +1,8 @@
+import pytest
+from utils.logger import Logger
+
+
+@pytest.fixture(scope="session")
+def logger():
+    # Logger adds a handler to a shared logging.Logger, so create it once
+    return Logger()
@@ -0,0 +1,191 @@
+import os
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+
+class FakeGeminiFile:
+    """Stand-in for google.generativeai File objects"""
+
+    def __init__(self, path, mime_type=None, ttl_seconds=48 * 3600):
+        file_id = uuid.uuid4().hex[:12]
+        self.name = f"files/{file_id}"
+        self.uri = f"https://generativelanguage.googleapis.com/v1beta/files/{file_id}"
+        self.display_name = os.path.basename(path)
+        self.mime_type = mime_type
+        self.size_bytes = os.path.getsize(path)
+        self.expiration_time = datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)
+
+
+class FakeGeminiClient:
+    """Offline replacement for the genai file API (upload_file, get_file, delete_file, list_files)"""
+
+    def __init__(self, ttl_seconds=48 * 3600, upload_delay=0):
+        self.ttl_seconds = ttl_seconds
+        self.upload_delay = upload_delay
+        self.files = {}
+        self.upload_count = 0
+        self.deleted = []
+
+    def upload_file(self, path, mime_type=None, display_name=None):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        if self.upload_delay:
+            time.sleep(self.upload_delay)
+        file = FakeGeminiFile(path, mime_type, self.ttl_seconds)
+        if display_name:
+            file.display_name = display_name
+        self.files[file.name] = file
+        self.upload_count += 1
+        return file
+
+    def get_file(self, name):
+        file = self.files.get(name)
+        if file is None or file.expiration_time <= datetime.now(timezone.utc):
+            raise KeyError(f"File {name} not found")
+        return file
+
+    def delete_file(self, name):
+        if self.files.pop(name, None) is None:
+            raise KeyError(f"File {name} not found")
+        self.deleted.append(name)
+
+    def list_files(self):
+        return list(self.files.values())
+
+    def expire(self, name):
+        """Simulate Gemini dropping a file after its TTL"""
+        self.files.pop(name, None)
+
+
+class FakeResendServer:
+    """Local HTTP server that records Resend API calls and replays queued responses.
+
+    Queue responses with respond(status, body, headers); once the queue is empty
+    every request succeeds. Use ``url`` as the sender's api_url.
+    """
+
+    def __init__(self):
+        import json
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+        self.requests = []
+        self._responses = []
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"null")
+                with server._lock:
+                    server.requests.append({"path": self.path, "headers": dict(self.headers), "body": body})
+                    queued = server._responses.pop(0) if server._responses else None
+                if queued:
+                    status, payload, headers = queued
+                elif isinstance(body, list):
+                    status, payload, headers = 200, {"data": [{"id": uuid.uuid4().hex} for _ in body]}, {}
+                else:
+                    status, payload, headers = 200, {"id": uuid.uuid4().hex}, {}
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def respond(self, status, body=None, headers=None):
+        with self._lock:
+            self._responses.append((status, body or {}, headers or {}))
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FakeApiError(Exception):
+    """Provider error with an HTTP status code and optional Retry-After, like google.api_core errors"""
+
+    def __init__(self, code, message=None, retry_after=None):
+        super().__init__(message or f"{code} error from fake model")
+        self.code = code
+        self.retry_after = retry_after
+
+
+class FakeUsageMetadata:
+    """Token counts in the shape of Gemini's usage_metadata (about 4 characters per token)"""
+
+    def __init__(self, prompt_text, response_text):
+        self.prompt_token_count = len(prompt_text) // 4
+        self.candidates_token_count = len(response_text) // 4
+        self.cached_content_token_count = 0
+        self.total_token_count = self.prompt_token_count + self.candidates_token_count
+
+
+class FakeModelResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeGenerativeModel:
+    def __init__(self, client, model_name=None, generation_config=None, system_instruction=None):
+        self.client = client
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.system_instruction = system_instruction
+
+    def start_chat(self):
+        return self
+
+    def send_message(self, content, stream=False, request_options=None):
+        return self.client._respond(self, content, stream)
+
+    generate_content = send_message
+
+
+class FakeModelClient(FakeGeminiClient):
+    """Offline replacement for the genai module that can inject request failures.
+
+    fail_next(503, times=2) makes the next two model requests raise FakeApiError;
+    after that requests return response_text (split into chunks when streamed).
+    Every request is recorded in ``requests``.
+    """
+
+    def __init__(self, response_text="Fake model response", chunk_size=16, **kwargs):
+        super().__init__(**kwargs)
+        self.response_text = response_text
+        self.chunk_size = chunk_size
+        self.requests = []
+        self._failures = []
+
+    def GenerativeModel(self, model_name=None, generation_config=None, system_instruction=None):
+        return FakeGenerativeModel(self, model_name, generation_config, system_instruction)
+
+    def fail_next(self, code, times=1, retry_after=None):
+        self._failures.extend([(code, retry_after)] * times)
+
+    def _respond(self, model, content, stream):
+        self.requests.append({"model_name": model.model_name, "content": content, "stream": stream})
+        if self._failures:
+            code, retry_after = self._failures.pop(0)
+            raise FakeApiError(code, retry_after=retry_after)
+        usage = FakeUsageMetadata(str(content), self.response_text)
+        if not stream:
+            return FakeModelResponse(self.response_text, usage)
+        text = self.response_text
+        chunks = [FakeModelResponse(text[start:start + self.chunk_size]) for start in range(0, len(text), self.chunk_size)]
+        # Like Gemini, the final chunk carries the usage of the whole response
+        chunks[-1].usage_metadata = usage
+        return chunks
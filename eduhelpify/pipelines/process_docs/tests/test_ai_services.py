@@ -0,0 +1,25 @@
+from utils.ai_services import AiServices
+from utils.resilience import CircuitBreaker, ResilientCaller
+from tests.fakes import FakeModelClient
+
+
+def test_streamed_generation_retries_rate_limited_request(logger, tmp_path):
+    document = tmp_path / "notes.txt"
+    document.write_text("Mitochondria are the powerhouse of the cell.")
+    output_path = tmp_path / "output.txt"
+    client = FakeModelClient(response_text="Summary of the notes. " * 20, chunk_size=32)
+    breaker = CircuitBreaker(logger, failure_threshold=5, reset_timeout=60)
+    caller = ResilientCaller(logger, breaker=breaker, max_attempts=3, base_delay=0.01)
+    service = AiServices(logger=logger, client=client, caller=caller)
+    client.fail_next(429, times=1, retry_after=0)
+    progress = []
+
+    service.process_mixed_files([str(document)], "Summarize", "Summarize the notes", output_path=str(output_path),
+                                stream=True, progress_callback=lambda *args: progress.append(args))
+
+    assert output_path.read_text() == client.response_text
+    assert [request["stream"] for request in client.requests] == [True, True]
+    assert client.upload_count == 1
+    assert not breaker.is_open
+    assert progress[-1][0] == len(client.response_text)
+    assert list(tmp_path.glob("*.part")) == []
@@ -0,0 +1,61 @@
+import pytest
+from utils.gemini_files import GeminiFileRegistry
+from tests.fakes import FakeGeminiClient
+
+
+@pytest.fixture
+def document(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("Photosynthesis converts light into chemical energy.")
+    return path
+
+
+def test_reuses_upload_for_identical_content(logger, tmp_path, document):
+    client = FakeGeminiClient()
+    registry = GeminiFileRegistry(logger, client=client, db_path=str(tmp_path / "gemini_files.db"))
+    copy = tmp_path / "copy.txt"
+    copy.write_bytes(document.read_bytes())
+
+    first = registry.get_or_upload(document, "text/plain")
+    second = registry.get_or_upload(copy, "text/plain")
+
+    assert second.name == first.name
+    assert client.upload_count == 1
+
+
+def test_registry_is_shared_across_instances(logger, tmp_path, document):
+    client = FakeGeminiClient()
+    db_path = str(tmp_path / "gemini_files.db")
+
+    first = GeminiFileRegistry(logger, client=client, db_path=db_path).get_or_upload(document)
+    second = GeminiFileRegistry(logger, client=client, db_path=db_path).get_or_upload(document)
+
+    assert second.name == first.name
+    assert client.upload_count == 1
+
+
+def test_uploads_again_when_remote_file_is_gone(logger, tmp_path, document):
+    client = FakeGeminiClient()
+    registry = GeminiFileRegistry(logger, client=client, db_path=str(tmp_path / "gemini_files.db"))
+
+    first = registry.get_or_upload(document)
+    client.expire(first.name)
+    second = registry.get_or_upload(document)
+
+    assert second.name != first.name
+    assert client.upload_count == 2
+    assert registry.get_or_upload(document).name == second.name
+
+
+def test_replaces_files_close_to_expiry(logger, tmp_path, document):
+    client = FakeGeminiClient(ttl_seconds=600)
+    registry = GeminiFileRegistry(logger, client=client, db_path=str(tmp_path / "gemini_files.db"),
+                                  expiry_margin_seconds=3600)
+
+    first = registry.get_or_upload(document)
+    second = registry.get_or_upload(document)
+
+    assert second.name != first.name
+    assert client.deleted == [first.name]
+    assert registry.cleanup_expired() == 1
+    assert client.deleted == [first.name, second.name]
@@ -0,0 +1,103 @@
+import pytest
+from utils.notification_outbox import OutboxSender
+from tests.fakes import FakeResendServer
+
+
+class FakeOutboxDb:
+    """In-memory stand-in for the notification_outbox methods of DatabaseService"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.sent = []
+        self.rescheduled = []
+
+    def claim_notifications(self, worker_id, batch_size, lease_seconds):
+        rows, self.rows = self.rows[:batch_size], self.rows[batch_size:]
+        return rows
+
+    def mark_notifications_sent(self, notification_ids):
+        self.sent.extend(notification_ids)
+
+    def reschedule_notification(self, notification_id, error, delay_seconds=None):
+        self.rescheduled.append((notification_id, error, delay_seconds))
+
+
+def outbox_row(number, attempts=1, attachments=None):
+    payload = {"to": [f"user{number}@example.com"], "subject": "Your document is ready", "html": "<p>Done</p>"}
+    if attachments:
+        payload["attachments"] = attachments
+    return {"id": number, "task_id": f"task-{number}", "payload": payload, "attempts": attempts}
+
+
+@pytest.fixture
+def resend():
+    server = FakeResendServer()
+    yield server
+    server.close()
+
+
+def make_sender(logger, db, resend, **kwargs):
+    return OutboxSender(logger, db, worker_id="test-outbox", api_key="re_test", api_url=resend.url, **kwargs)
+
+
+def test_rate_limited_email_is_rescheduled_after_retry_after(logger, resend):
+    db = FakeOutboxDb([outbox_row(1)])
+    resend.respond(429, {"message": "Too many requests"}, {"Retry-After": "7"})
+
+    stats = make_sender(logger, db, resend).drain()
+
+    assert stats == {"claimed": 1, "sent": 0, "retried": 1, "failed": 0}
+    assert db.sent == []
+    notification_id, error, delay = db.rescheduled[0]
+    assert notification_id == 1
+    assert "429" in error
+    assert delay == 7.0
+
+
+def test_retry_reuses_the_idempotency_key(logger, resend):
+    db = FakeOutboxDb([outbox_row(1)])
+    sender = make_sender(logger, db, resend)
+    resend.respond(429, headers={"Retry-After": "1"})
+
+    sender.drain()
+    db.rows = [outbox_row(1, attempts=2)]
+    stats = sender.drain()
+
+    assert stats["sent"] == 1
+    assert db.sent == [1]
+    keys = [request["headers"]["Idempotency-Key"] for request in resend.requests]
+    assert keys == ["task-output/task-1", "task-output/task-1"]
+
+
+def test_rate_limit_on_last_attempt_fails_the_row(logger, resend):
+    db = FakeOutboxDb([outbox_row(1, attempts=3)])
+    resend.respond(429, headers={"Retry-After": "7"})
+
+    stats = make_sender(logger, db, resend, max_attempts=3).drain()
+
+    assert stats["failed"] == 1
+    assert db.rescheduled[0][2] is None
+
+
+def test_client_errors_are_not_retried(logger, resend):
+    db = FakeOutboxDb([outbox_row(1)])
+    resend.respond(422, {"message": "Invalid `to` field"})
+
+    stats = make_sender(logger, db, resend).drain()
+
+    assert stats["failed"] == 1
+    assert db.rescheduled[0][2] is None
+
+
+def test_plain_emails_go_through_the_batch_endpoint(logger, resend):
+    attachment = [{"filename": "output.pdf", "content": "JVBERi0="}]
+    db = FakeOutboxDb([outbox_row(1), outbox_row(2), outbox_row(3, attachments=attachment)])
+
+    stats = make_sender(logger, db, resend).drain()
+
+    assert stats["sent"] == 3
+    assert sorted(db.sent) == [1, 2, 3]
+    paths = sorted(request["path"] for request in resend.requests)
+    assert paths == ["/emails", "/emails/batch"]
+    batch = next(request for request in resend.requests if request["path"] == "/emails/batch")
+    assert len(batch["body"]) == 2
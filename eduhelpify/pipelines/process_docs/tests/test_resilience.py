@@ -0,0 +1,92 @@
+import time
+import pytest
+from utils.resilience import CircuitBreaker, CircuitOpenError, RateLimiter, ResilientCaller
+from tests.fakes import FakeApiError, FakeModelClient
+
+
+def generate(client, prompt="Summarize"):
+    return client.GenerativeModel(model_name="gemini-2.0-flash").generate_content(prompt)
+
+
+def test_retries_rate_limited_requests_after_retry_after(logger, tmp_path):
+    client = FakeModelClient(response_text="done")
+    limiter = RateLimiter(logger, requests_per_minute=600, db_path=str(tmp_path / "rate_limit.db"))
+    caller = ResilientCaller(logger, limiter=limiter, max_attempts=4, base_delay=30)
+    client.fail_next(429, times=2, retry_after=0)
+
+    started = time.monotonic()
+    response = caller.call("Fake request", lambda: generate(client))
+
+    assert response.text == "done"
+    assert len(client.requests) == 3
+    # Retry-After: 0 overrides the 30s backoff
+    assert time.monotonic() - started < 5
+
+
+def test_gives_up_after_max_attempts(logger):
+    client = FakeModelClient()
+    caller = ResilientCaller(logger, max_attempts=3, base_delay=0.01)
+    client.fail_next(503, times=3)
+
+    with pytest.raises(FakeApiError):
+        caller.call("Fake request", lambda: generate(client))
+    assert len(client.requests) == 3
+
+
+def test_does_not_retry_client_errors(logger):
+    client = FakeModelClient()
+    breaker = CircuitBreaker(logger, failure_threshold=1, reset_timeout=60)
+    caller = ResilientCaller(logger, breaker=breaker, max_attempts=3, base_delay=0.01)
+    client.fail_next(400)
+
+    with pytest.raises(FakeApiError):
+        caller.call("Fake request", lambda: generate(client))
+    assert len(client.requests) == 1
+    assert not breaker.is_open
+
+
+def test_rate_limiter_waits_for_a_free_slot(logger, tmp_path):
+    limiter = RateLimiter(logger, requests_per_minute=60, db_path=str(tmp_path / "rate_limit.db"))
+    for _ in range(60):
+        assert limiter.try_acquire()
+    assert limiter.saturated()
+
+    with pytest.raises(TimeoutError):
+        limiter.acquire(timeout=0.1)
+    assert limiter.acquire(timeout=5) > 0
+
+
+def test_circuit_opens_then_half_open_trial_closes_it(logger):
+    client = FakeModelClient(response_text="back")
+    breaker = CircuitBreaker(logger, failure_threshold=2, reset_timeout=0.2)
+    caller = ResilientCaller(logger, breaker=breaker, max_attempts=2, base_delay=0.01)
+    client.fail_next(503, times=2)
+
+    with pytest.raises(FakeApiError):
+        caller.call("Fake request", lambda: generate(client))
+    assert breaker.is_open
+
+    # While open, calls are refused without reaching the provider
+    with pytest.raises(CircuitOpenError):
+        caller.call("Fake request", lambda: generate(client))
+    assert len(client.requests) == 2
+
+    time.sleep(0.25)
+    assert not breaker.is_open
+    assert caller.call("Fake request", lambda: generate(client)).text == "back"
+    assert breaker.allow()
+
+
+def test_failed_half_open_trial_reopens_circuit(logger):
+    breaker = CircuitBreaker(logger, failure_threshold=1, reset_timeout=0.2)
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    time.sleep(0.25)
+    assert breaker.allow()
+    # Only one trial call at a time
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.allow()
@@ -1,27 +1,56 @@
-from typing import Any
 import google.generativeai as genai
 import os
 import mimetypes
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from .file_cache import file_sha256
+from .output_writers import create_stream_writer
+from .document_chunker import DocumentChunker
+from .presentation_builder import PresentationBuilder, Slide
 from .logger import Logger
-from pydantic import BaseModel
-
-
-class Slide(BaseModel):
-    title: str
-    content: list[str]
 
 
 class AiServices:
-    def __init__(self, api_key=None, model_name="gemini-2.0-flash", logger=None,):
-        """Initialize AiServices with API key and default model"""
+    def __init__(self, api_key=None, model_name="gemini-2.0-flash", logger=None, file_registry=None, response_cache=None,
+                 caller=None, client=None, ledger=None):
+        """Initialize AiServices with API key and default model
+        
+        caller is an optional ResilientCaller that wraps every Gemini request with
+        rate limiting, retries and the circuit breaker; client replaces the genai
+        module (e.g. with tests.fakes.FakeModelClient); ledger is an optional
+        TokenLedger that receives the token usage and latency of every call.
+        """
         self.api_key = api_key 
-        self.model_name = "gemini-2.0-flash"
+        self.model_name = model_name
+        self.client = client or genai
+        self.caller = caller
+        self.ledger = ledger
+        self.request_timeout = float(os.environ.get("GEMINI_REQUEST_TIMEOUT", 1000))
+        
+        # Optional GeminiFileRegistry so identical documents are uploaded once across tasks
+        self.file_registry = file_registry
+        self.upload_concurrency = int(os.environ.get("GEMINI_UPLOAD_CONCURRENCY", 4))
+        
+        # Optional ResponseCache so identical generation requests skip the model call
+        self.response_cache = response_cache
+        
+        # Stream model output straight into the output file instead of waiting for the full response
+        self.streaming = os.environ.get("GEMINI_STREAMING", "true").lower() == "true"
+        self.progress_interval = float(os.environ.get("STREAM_PROGRESS_INTERVAL", 2))
+        
+        # Map-reduce settings for inputs too large for a single model call
+        self.map_concurrency = int(os.environ.get("MAP_REDUCE_CONCURRENCY", 4))
+        self.map_max_output_tokens = int(os.environ.get("MAP_REDUCE_MAP_MAX_TOKENS", 4096))
       
         # Configure Gemini API
         genai.configure(api_key=self.api_key)
         
         # Initialize logger
         self.logger = logger
+        self.chunker = DocumentChunker(self.logger)
+        self.presentation_builder = PresentationBuilder(self.logger)
         
         # Default generation config
         self.generation_config = {
@@ -34,6 +63,18 @@ class AiServices:
         
         self.logger.info(f"AiServices initialized with model: {self.model_name}")
 
+    def _call(self, description, operation):
+        """Run a Gemini request through the resilient caller when one is configured"""
+        if self.caller:
+            return self.caller.call(description, operation)
+        return operation()
+
+    def _record_usage(self, call_type, model_name, usage_metadata=None, started=None):
+        """Pass a call's token usage and latency to the ledger, if there is one"""
+        if self.ledger:
+            latency = time.monotonic() - started if started is not None else None
+            self.ledger.record(call_type, model_name, usage_metadata, latency)
+
     def upload_to_gemini(self, path: str, mime_type: str = None):
         """Uploads the given file to Gemini with automatic mime type detection if not provided."""
         self.logger.info(f"Started uploading: {path}")
@@ -52,7 +93,9 @@ class AiServices:
                 self.logger.warning(f"Could not detect mime type for {path}. Gemini will attempt to determine the type.")
 
         try:
-            file = genai.upload_file(str(path), mime_type=mime_type)
+            if self.file_registry:
+                return self._call(f"Upload of {path}", lambda: self.file_registry.get_or_upload(path, mime_type))
+            file = self._call(f"Upload of {path}", lambda: self.client.upload_file(str(path), mime_type=mime_type))
             self.logger.info(f"Uploaded file '{file.display_name}' as: {file.uri} (type: {mime_type or 'auto-detected'})")
             return file
         except Exception as e:
@@ -60,6 +103,31 @@ class AiServices:
             self.logger.error(error_msg)
             raise
 
+    def upload_files(self, file_paths: list):
+        """Upload several files to Gemini concurrently.
+
+        Returns the uploaded files in the same order as file_paths. The first
+        failed upload cancels the ones that have not started yet and is re-raised.
+        """
+        if len(file_paths) <= 1:
+            return [self.upload_to_gemini(file_path) for file_path in file_paths]
+
+        executor = ThreadPoolExecutor(
+            max_workers=min(self.upload_concurrency, len(file_paths)),
+            thread_name_prefix="gemini-upload"
+        )
+        try:
+            futures = [executor.submit(self.upload_to_gemini, file_path) for file_path in file_paths]
+            done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+            for future in futures:
+                if future in done and future.exception() is not None:
+                    for pending in not_done:
+                        pending.cancel()
+                    raise future.exception()
+            return [future.result() for future in futures]
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def save_response(self, content, output_path, output_type=None):
         """
         Save response content in the appropriate format based on output_type or file extension
@@ -85,16 +153,8 @@ class AiServices:
             
             elif output_type == "pdf":
                 try:
-                    content = content.replace("*", " ")
-
-                    from reportlab.lib.pagesizes import letter
-                    from reportlab.platypus import SimpleDocTemplate, Paragraph
-                    from reportlab.lib.styles import getSampleStyleSheet
-                    
-                    doc = SimpleDocTemplate(output_path, pagesize=letter)
-                    styles = getSampleStyleSheet()
-                    story = [Paragraph(line, styles["Normal"]) for line in content.split('\n')]
-                    doc.build(story)
+                    from .pdf_renderer import render_pdf
+                    render_pdf(content, output_path)
                 except ImportError:
                     self.logger.error("reportlab library not found. Install with: pip install reportlab")
                     raise
@@ -127,11 +187,26 @@ class AiServices:
         except Exception as e:
             error_msg = f"Error saving {output_type} file: {str(e)}"
             self.logger.error(error_msg)
+            # Do not leave a half-written output behind
+            if os.path.exists(output_path):
+                os.remove(output_path)
             raise
 
     def process_mixed_files(self, file_paths: list, system_prompt: str, user_prompt: str, 
-                           output_path: str = "response.txt", model_name: str = None, output_type: str = None):
-        """Process multiple files of mixed types with Gemini using chat mode"""
+                           output_path: str = "response.txt", model_name: str = None, output_type: str = None,
+                           use_cache: bool = True, stream: bool = None, progress_callback=None):
+        """Process multiple files of mixed types with Gemini using chat mode
+        
+        When a response cache is configured and use_cache is True, an identical earlier
+        request (same input contents, prompts, model and generation config) is answered
+        from the cache without uploading anything or calling the model.
+        
+        In streaming mode (txt, docx, pdf and pptx outputs) the response is written to
+        output_path as it arrives and progress_callback(bytes, chunks, tokens) is
+        called at most every STREAM_PROGRESS_INTERVAL seconds. The full text is only
+        kept in memory when it has to be stored in the response cache; otherwise None
+        is returned.
+        """
         
         # Determine the output type from path extension if not explicitly provided
         if output_type is None:
@@ -143,48 +218,82 @@ class AiServices:
         
         # Set up specific configuration for pptx output
         if output_type == "pptx":
-            # Use JSON response format for presentations
-            temp_config = self.generation_config.copy()
-            temp_config["response_mime_type"] = "application/json"
-            
-            # Use client for schema-based generation
-            client = genai.GenerativeModel(
-                model_name=model_name,
-                generation_config=temp_config,
-                system_instruction="List slides from the attached content in JSON FORMAT with title and content for each slide."
-            )
+            # Constrain generation to a JSON array of Slide objects
+            generation_config = self.generation_config.copy()
+            generation_config["response_mime_type"] = "application/json"
+            generation_config["response_schema"] = list[Slide]
+            system_instruction = "List slides from the attached content. Give each slide a title and its content as a list of short bullet points."
+            user_message = "Create a presentation from the content in the uploaded files."
         else:
-            # Initialize model with system prompt for non-pptx outputs
-            client = genai.GenerativeModel(
-                model_name=model_name,
-                generation_config=self.generation_config,
-                system_instruction=system_prompt
-            )
+            # Use the task's system prompt for non-pptx outputs
+            generation_config = self.generation_config
+            system_instruction = system_prompt
+            user_message = user_prompt
         
         try:
-            # Upload all files to Gemini
-            uploaded_files = []
-            for file_path in file_paths:
-                self.logger.info(f"UPLOADING: {file_path}")
-                uploaded_file = self.upload_to_gemini(file_path)
-                uploaded_files.append(uploaded_file)
+            cache_key = None
+            if self.response_cache and use_cache:
+                cache_key = self.response_cache.make_key(
+                    [file_sha256(file_path) for file_path in file_paths],
+                    system_instruction,
+                    user_message,
+                    model_name,
+                    generation_config,
+                    output_type
+                )
+                cached_text = self.response_cache.get(cache_key)
+                if cached_text is not None:
+                    self.logger.info(f"Response cache hit ({cache_key[:12]}), skipping model call")
+                    self._record_usage("CACHED", model_name)
+                    self.save_response(cached_text, output_path, output_type)
+                    return cached_text
+            
+            client = self.client.GenerativeModel(
+                model_name=model_name,
+                generation_config=generation_config,
+                system_instruction=system_instruction
+            )
+            
+            if self.chunker.needs_map_reduce(file_paths):
+                # Map: process chunks in parallel; reduce: the final call below merges the partial results
+                partial_results = self.map_chunks(file_paths, system_prompt, user_prompt, model_name)
+                message_content = [
+                    f"Partial result {index} of {len(partial_results)}:\n{partial}"
+                    for index, partial in enumerate(partial_results, start=1)
+                ] + [
+                    "The source material was too large for one request, so it was processed in parts. "
+                    "The partial results above cover all of it in order. Combine them into one complete answer.\n\n"
+                    + user_message
+                ]
+            else:
+                # Upload all files to Gemini in parallel, keeping the order the prompt expects
+                self.logger.info(f"UPLOADING {len(file_paths)} files: {file_paths}")
+                uploaded_files = self.upload_files(file_paths)
+                
+                # Create message content with all files and the prompt
+                message_content = uploaded_files + [user_message]
             
             # Start chat session
             chat = client.start_chat()
             
-            # Create message content with all files and the prompt
-            if output_type == "pptx":
-                user_message = "Create a presentation from the content in the uploaded files. Format the response as JSON with slides object containing key-value pairs for each slide."
-                message_content = uploaded_files + [user_message]
-            else:
-                message_content = uploaded_files + [user_prompt]
+            stream = self.streaming if stream is None else stream
+            writer = create_stream_writer(output_type, output_path, self.presentation_builder) if stream else None
+            if writer:
+                self.logger.info("Streaming message to Gemini with files and prompt")
+                response_text = self._stream_response(chat, message_content, writer, progress_callback, keep_text=bool(cache_key),
+                                                      model_name=model_name)
+                if cache_key:
+                    self.response_cache.put(cache_key, response_text, model_name)
+                return response_text
             
             # Send message with files and prompt
             self.logger.info("Sending message to Gemini with files and prompt")
-            response = chat.send_message(
+            started = time.monotonic()
+            response = self._call("Gemini request", lambda: chat.send_message(
                 message_content,
-                request_options={"timeout": 1000},
-            )
+                request_options={"timeout": self.request_timeout},
+            ))
+            self._record_usage("GENERATE", model_name, getattr(response, "usage_metadata", None), started)
             
             self.logger.info("Received response from Gemini")
             self.logger.info(response.text)
@@ -192,6 +301,10 @@ class AiServices:
             # Save response in the appropriate format
             self.save_response(response.text, output_path, output_type)
             
+            # Only cache responses that rendered successfully
+            if cache_key:
+                self.response_cache.put(cache_key, response.text, model_name)
+            
             return response.text
             
         except Exception as e:
@@ -199,6 +312,116 @@ class AiServices:
             self.logger.error(error_msg)
             raise
     
+    def map_chunks(self, file_paths: list, system_prompt: str, user_prompt: str, model_name: str = None):
+        """Map step of map-reduce: split large inputs and process each chunk in parallel
+        
+        Returns:
+            list: Partial result text per chunk, in document order
+        """
+        model_name = model_name or self.model_name
+        store_location = os.environ.get("STORE_LOCATION") or None
+        work_dir = tempfile.mkdtemp(prefix="chunks-", dir=store_location)
+        
+        map_config = self.generation_config.copy()
+        map_config["response_mime_type"] = "text/plain"
+        map_config["max_output_tokens"] = min(map_config["max_output_tokens"], self.map_max_output_tokens)
+        
+        try:
+            chunk_paths = self.chunker.split(file_paths, work_dir)
+            
+            def _process_chunk(args):
+                index, chunk_path = args
+                client = self.client.GenerativeModel(
+                    model_name=model_name,
+                    generation_config=map_config,
+                    system_instruction=(
+                        f"{system_prompt}\n\nYou are given part {index} of {len(chunk_paths)} of the source material. "
+                        "Extract and condense everything from this part that is needed to follow the instructions. "
+                        "Your output will be merged with the other parts afterwards, so do not add introductions or conclusions."
+                    )
+                )
+                uploaded_file = self.upload_to_gemini(chunk_path)
+                started = time.monotonic()
+                response = self._call(f"Map request for chunk {index}", lambda: client.generate_content(
+                    [uploaded_file, user_prompt],
+                    request_options={"timeout": self.request_timeout},
+                ))
+                self._record_usage("MAP", model_name, getattr(response, "usage_metadata", None), started)
+                self.logger.info(f"Mapped chunk {index} of {len(chunk_paths)} ({len(response.text)} chars)")
+                return response.text
+            
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=min(self.map_concurrency, len(chunk_paths)), thread_name_prefix="map-chunk") as executor:
+                partial_results = list(executor.map(_process_chunk, enumerate(chunk_paths, start=1)))
+            self.logger.info(f"Map step processed {len(chunk_paths)} chunks in {time.monotonic() - started:.1f}s")
+            return partial_results
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _stream_response(self, chat, message_content, writer, progress_callback=None, keep_text=False, model_name=None):
+        """Consume a streamed model response chunk by chunk into writer"""
+        started = time.monotonic()
+        first_chunk_at = None
+        last_progress = 0
+        chunks = 0
+        tokens = 0
+        last_usage = None
+        parts = [] if keep_text else None
+        
+        completed = False
+        try:
+            # Errors before the first chunk are retried; once output is written the stream cannot be restarted
+            response = self._call("Gemini streaming request", lambda: chat.send_message(
+                message_content,
+                stream=True,
+                request_options={"timeout": self.request_timeout},
+            ))
+            for chunk in response:
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # Chunks without text parts (e.g. the final finish_reason chunk)
+                    text = ""
+                
+                usage = getattr(chunk, "usage_metadata", None)
+                if usage:
+                    last_usage = usage
+                if usage and getattr(usage, "candidates_token_count", None):
+                    tokens = usage.candidates_token_count
+                if not text:
+                    continue
+                
+                if first_chunk_at is None:
+                    first_chunk_at = time.monotonic()
+                    self.logger.info(f"First chunk from Gemini after {first_chunk_at - started:.2f}s")
+                
+                chunks += 1
+                writer.write(text)
+                if parts is not None:
+                    parts.append(text)
+                
+                if progress_callback and time.monotonic() - last_progress >= self.progress_interval:
+                    last_progress = time.monotonic()
+                    progress_callback(writer.bytes_written, chunks, tokens)
+            completed = True
+        finally:
+            # Only a finished stream reaches output_path; a failed one leaves no partial file
+            if completed:
+                writer.close()
+            else:
+                writer.abort()
+            # The last chunk's usage metadata covers the whole response (or what was billed before a failure)
+            if chunks or last_usage:
+                self._record_usage("STREAM", model_name or self.model_name, last_usage, started)
+        
+        if progress_callback:
+            progress_callback(writer.bytes_written, chunks, tokens)
+        self.logger.info(
+            f"Streamed {chunks} chunks ({writer.bytes_written} bytes) from Gemini to {writer.output_path} "
+            f"in {time.monotonic() - started:.2f}s"
+        )
+        return "".join(parts) if parts is not None else None
+
     def set_generation_config(self, temperature=None, top_p=None, top_k=None, 
                              max_output_tokens=None, response_mime_type=None):
         """Update generation configuration parameters"""
@@ -221,84 +444,12 @@ class AiServices:
         Create a PowerPoint presentation from JSON slide data.
         
         Args:
-            slide_data (dict or str): Dictionary or JSON string containing slide data
+            slide_data (list, dict or str): Slides in any of the accepted shapes, or a JSON string of them
             output_path (str): Path to save the presentation
         """
-        import json
-        from pptx import Presentation
-        from pptx.util import Inches
-        
-        # Handle string input (parse JSON)
-        if isinstance(slide_data, str):
-            try:
-                slide_data = json.loads(slide_data)
-            except json.JSONDecodeError as e:
-                self.logger.error(f"Failed to parse JSON: {e}")
-                raise
-        
-        # Create a presentation object
-        prs = Presentation()
-        self.logger.info(f"Slide data: {slide_data}")
-        # Check if slides is a list (new format) or dict (old format)
-        if isinstance(slide_data, list):
-            # Process direct list of slides format
-            for slide_info in slide_data:
-                title = slide_info.get("title", "")
-                content = slide_info.get("content", "")
-                
-                # Use title and content slide layout
-                content_slide_layout = prs.slide_layouts[1]
-                slide = prs.slides.add_slide(content_slide_layout)
-                
-                # Set the title
-                title_shape = slide.shapes.title
-                title_shape.text = title
-                
-                # Set the content
-                body_shape = slide.placeholders[1]
-                tf = body_shape.text_frame
-                tf.text = content
-        elif isinstance(slide_data.get("slides"), list):
-            # Process list-based slides format
-            for slide_info in slide_data["slides"]:
-                title = slide_info.get("title", "")
-                content = slide_info.get("content", "")
-                
-                # Use title and content slide layout
-                content_slide_layout = prs.slide_layouts[1]
-                slide = prs.slides.add_slide(content_slide_layout)
-                
-                # Set the title
-                title_shape = slide.shapes.title
-                title_shape.text = title
-                
-                # Set the content
-                body_shape = slide.placeholders[1]
-                tf = body_shape.text_frame
-                tf.text = content
-
-        elif isinstance(slide_data.get("slides"), dict):
-            # Process original dict-based slides format
-            for slide_id, slide_info in slide_data["slides"].items():
-                title = slide_info.get("title", "")
-                content = slide_info.get("content", "")
-                
-                # Use title and content slide layout
-                content_slide_layout = prs.slide_layouts[1]
-                slide = prs.slides.add_slide(content_slide_layout)
-                
-                # Set the title
-                title_shape = slide.shapes.title
-                title_shape.text = title
-                
-                # Set the content
-                body_shape = slide.placeholders[1]
-                tf = body_shape.text_frame
-                tf.text = content
-        else:
-            self.logger.error(f"Invalid slide data format: {slide_data}")
-            raise ValueError("Slide data missing or in incorrect format")
-            
-        # Save the presentation
-        prs.save(output_path)
+        try:
+            self.presentation_builder.build(slide_data, output_path)
+        except ValueError as e:
+            self.logger.error(f"Invalid slide data: {e}")
+            raise
         return output_path
\ No newline at end of file
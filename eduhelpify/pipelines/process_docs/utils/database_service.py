@@ -1,10 +1,47 @@
 import os
+import threading
+from dataclasses import dataclass, field
+from typing import Optional
+from datetime import datetime, timedelta, timezone
+from cachetools import TTLCache
 from supabase import create_client
 from .logger import Logger
 import dotenv
 
 dotenv.load_dotenv(override=True)
 
+# Embedded select that loads everything a task needs in one PostgREST round trip
+TASK_CONTEXT_SELECT = (
+    "*, "
+    "task_config:taskconfig(*, ai_model:aimodel(id, model_name)), "
+    "output_content_type:contenttype!task_output_content_type_id_fkey("
+    "*, system_prompts:systemprompts!systemprompts_output_content_type_id_fkey(*)), "
+    "files:filestore(*), "
+    "user:User(id, email, username, user_type_id)"
+)
+
+
+@dataclass
+class TaskContext:
+    """Everything the pipeline needs about one task, loaded together by load_task_context"""
+    task: dict
+    task_config: Optional[dict] = None
+    output_content_type: Optional[dict] = None
+    system_prompt: Optional[dict] = None
+    input_files: list = field(default_factory=list)
+    user: Optional[dict] = None
+
+    @property
+    def user_details(self):
+        """The user's email and username, in the shape returned by get_user_details"""
+        if not self.user or not self.user.get("email"):
+            return None
+        return {
+            "email": self.user["email"],
+            "username": self.user.get("username", None)
+        }
+
+
 class DatabaseService:
     def __init__(self,logger):
         # Initialize Supabase client
@@ -12,7 +49,43 @@ class DatabaseService:
         self.url = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
         self.key = os.environ.get("NEXT_PUBLIC_SUPABASE_ANON_KEY")
         self.supabase = create_client(self.url, self.key)
+        
+        # usertype rows (token budgets) rarely change and are read for every task, so lookups
+        # are cached in-process for REFERENCE_CACHE_TTL seconds. taskconfig, contenttype and
+        # systemprompts need no cache: load_task_context embeds them in the task query.
+        self._reference_cache = TTLCache(
+            maxsize=int(os.environ.get("REFERENCE_CACHE_MAX_ENTRIES", 1024)),
+            ttl=int(os.environ.get("REFERENCE_CACHE_TTL", 300))
+        )
+        self._reference_lock = threading.Lock()
         self.logger.info("DatabaseService initialized with Supabase client")
+
+    def _cached_lookup(self, table, key, loader):
+        """Return a cached reference row, calling loader() on a miss. Missing rows are not cached."""
+        cache_key = (table, key)
+        with self._reference_lock:
+            if cache_key in self._reference_cache:
+                return self._reference_cache[cache_key]
+        
+        value = loader()
+        if value is not None:
+            with self._reference_lock:
+                self._reference_cache[cache_key] = value
+        return value
+
+    def invalidate_reference_cache(self, table=None):
+        """Drop cached reference rows, either for one table or all of them
+        
+        Returns:
+            int: Number of cache entries removed
+        """
+        with self._reference_lock:
+            keys = [key for key in self._reference_cache.keys() if table is None or key[0] == table]
+            for key in keys:
+                self._reference_cache.pop(key, None)
+        self.logger.info(f"Invalidated {len(keys)} cached reference rows ({table or 'all tables'})")
+        return len(keys)
+
     def get_queued_tasks(self):
         """Get tasks with 'Queued' status from Supabase"""
         self.logger.info("Fetching queued tasks")
@@ -24,27 +97,108 @@ class DatabaseService:
         self.logger.info("No queued tasks found")
         return []
 
-    def get_task_config(self, task_id):
-        """Get the task configuration for a given task_id"""
-        response = self.supabase.table("task").select("task_config_id").eq("id", task_id).execute()
+    def claim_tasks(self, worker_id, batch_size, lease_seconds):
+        """Atomically claim a batch of queued (or lease-expired) tasks for a worker
+        
+        Args:
+            worker_id: Identifier of the claiming worker
+            batch_size: Maximum number of tasks to claim
+            lease_seconds: How long the claim is valid before other workers may take over
+            
+        Returns:
+            list: The claimed task rows, already marked INPROGRESS
+        """
+        self.logger.info(f"Worker {worker_id} claiming up to {batch_size} tasks")
+        response = self.supabase.rpc("claim_tasks", {
+            "p_worker_id": worker_id,
+            "p_batch_size": batch_size,
+            "p_lease_seconds": lease_seconds
+        }).execute()
         
         if response.data and len(response.data) > 0:
-            task_config_id = response.data[0]["task_config_id"]
-            config_response = self.supabase.table("taskconfig").select("*").eq("id", task_config_id).execute()
-            if config_response.data and len(config_response.data) > 0:
-                return config_response.data[0]
-        return None
+            self.logger.info(f"Worker {worker_id} claimed {len(response.data)} tasks")
+            return response.data
+        self.logger.info("No claimable tasks found")
+        return []
 
+    def claim_task(self, task_id, worker_id, lease_seconds):
+        """Atomically claim one task for a worker
+
+        Returns:
+            dict: The claimed task row, already marked INPROGRESS, or None if another worker holds it
+        """
+        response = self.supabase.rpc("claim_task", {
+            "p_task_id": task_id,
+            "p_worker_id": worker_id,
+            "p_lease_seconds": lease_seconds
+        }).execute()
 
-    def get_system_prompt(self, output_file_type):
-        """Get the appropriate system prompt based on output file type"""
-        response = self.supabase.table("systemprompts").select("*")\
-            .eq("output_content_type_id", output_file_type)\
-            .execute()
         if response.data and len(response.data) > 0:
+            self.logger.info(f"Worker {worker_id} claimed task {task_id}")
             return response.data[0]
+        self.logger.info(f"Task {task_id} could not be claimed by worker {worker_id}")
         return None
 
+    def release_task(self, task_id, worker_id):
+        """Put a task claimed by the worker back to QUEUED and drop its lease
+
+        Returns:
+            bool: True if the worker still held the task
+        """
+        response = self.supabase.rpc("release_task", {
+            "p_task_id": task_id,
+            "p_worker_id": worker_id
+        }).execute()
+        return bool(response.data)
+
+    def renew_task_leases(self, worker_id, task_ids, lease_seconds):
+        """Extend the lease on tasks the worker is still processing
+        
+        Returns:
+            list: The task ids still owned by the worker
+        """
+        response = self.supabase.rpc("renew_task_leases", {
+            "p_worker_id": worker_id,
+            "p_task_ids": list(task_ids),
+            "p_lease_seconds": lease_seconds
+        }).execute()
+        return response.data or []
+
+    def load_task_context(self, task_id):
+        """Load a task with its config, output content type, system prompt, input files and user
+        
+        Args:
+            task_id: The UUID of the task
+            
+        Returns:
+            TaskContext: The loaded context, or None if the task does not exist
+        """
+        response = self.supabase.table("task").select(TASK_CONTEXT_SELECT).eq("id", task_id).execute()
+        if not response.data or len(response.data) == 0:
+            self.logger.warning(f"No task found with ID: {task_id}")
+            return None
+        
+        task = dict(response.data[0])
+        task_config = task.pop("task_config", None)
+        output_content_type = task.pop("output_content_type", None)
+        files = task.pop("files", None) or []
+        user = task.pop("user", None)
+        
+        system_prompt = None
+        if output_content_type:
+            output_content_type = dict(output_content_type)
+            system_prompts = output_content_type.pop("system_prompts", None) or []
+            system_prompt = system_prompts[0] if system_prompts else None
+        
+        return TaskContext(
+            task=task,
+            task_config=task_config,
+            output_content_type=output_content_type,
+            system_prompt=system_prompt,
+            input_files=[file for file in files if file.get("file_category") == "input"],
+            user=user
+        )
+
     def get_files_by_task_and_type(self, task_id, file_type):
         """Get all FileStore rows for a given task_id and file_type"""
         response = self.supabase.table("filestore").select("*")\
@@ -61,6 +215,116 @@ class DatabaseService:
         self.supabase.table("task").update({"status": status}).eq("id", task_id).execute()
         return True
 
+    def update_task_progress(self, task_id, bytes_generated, chunks, tokens=None):
+        """Record how much output a streaming generation has produced so far"""
+        progress = {
+            "progress_bytes": bytes_generated,
+            "progress_chunks": chunks,
+            "progress_updated_at": datetime.now(timezone.utc).isoformat()
+        }
+        if tokens:
+            progress["progress_tokens"] = tokens
+        try:
+            self.supabase.table("task").update(progress).eq("id", task_id).execute()
+        except Exception as e:
+            # Progress is informational; never fail the task over it
+            self.logger.warning(f"Could not update progress for task {task_id}: {str(e)}")
+        return True
+
+    def apply_task_status_updates(self, updates):
+        """Apply many status updates in one round trip
+        
+        Args:
+            updates: List of {"id": task_id, "status": status} dicts
+        """
+        updates = [{"id": update["id"], "status": update["status"].upper()} for update in updates]
+        self.supabase.rpc("apply_task_status_updates", {"p_updates": updates}).execute()
+        return True
+
+    def insert_files(self, files):
+        """Insert several FileStore rows in one request"""
+        response = self.supabase.table("filestore").insert(files).execute()
+        return response.data or []
+
+    def get_user_type(self, user_type_id):
+        """Get a usertype row (with its token budgets) by id"""
+        def _load():
+            response = self.supabase.table("usertype").select("*").eq("id", user_type_id).execute()
+            if response.data and len(response.data) > 0:
+                return response.data[0]
+            return None
+        return self._cached_lookup("usertype", user_type_id, _load)
+
+    def get_user_tokens_today(self, user_id):
+        """Tokens billed for a user's tasks since midnight UTC"""
+        today = datetime.now(timezone.utc).date().isoformat()
+        response = self.supabase.table("user_token_usage_daily").select("total_tokens")\
+            .eq("user_id", user_id)\
+            .eq("usage_date", today)\
+            .execute()
+        if response.data and len(response.data) > 0:
+            return response.data[0]["total_tokens"] or 0
+        return 0
+
+    def insert_token_usage(self, rows):
+        """Insert several token_usage rows in one request"""
+        response = self.supabase.table("token_usage").insert(rows).execute()
+        return response.data or []
+
+    def enqueue_notification(self, task_id, payload):
+        """Add a task's output email to the notification outbox
+        
+        A task has at most one outbox row, so re-running a task does not email the user twice.
+        """
+        self.supabase.table("notification_outbox").upsert(
+            {"task_id": task_id, "payload": payload},
+            on_conflict="task_id",
+            ignore_duplicates=True
+        ).execute()
+        return True
+
+    def claim_notifications(self, worker_id, batch_size, lease_seconds):
+        """Atomically claim a batch of due outbox rows for a sender
+        
+        Returns:
+            list: The claimed outbox rows, already marked SENDING
+        """
+        response = self.supabase.rpc("claim_outbox_batch", {
+            "p_worker_id": worker_id,
+            "p_batch_size": batch_size,
+            "p_lease_seconds": lease_seconds
+        }).execute()
+        return response.data or []
+
+    def mark_notifications_sent(self, notification_ids):
+        """Mark outbox rows as delivered"""
+        now = datetime.now(timezone.utc).isoformat()
+        self.supabase.table("notification_outbox").update({
+            "status": "SENT",
+            "sent_at": now,
+            "updated_at": now,
+            "last_error": None
+        }).in_("id", list(notification_ids)).execute()
+        return True
+
+    def reschedule_notification(self, notification_id, error, delay_seconds=None):
+        """Record a failed delivery attempt
+        
+        Args:
+            notification_id: The outbox row
+            error: Description of the failure
+            delay_seconds: When to try again; None marks the row FAILED for good
+        """
+        now = datetime.now(timezone.utc)
+        update = {"last_error": error, "updated_at": now.isoformat(), "claimed_by": None}
+        if delay_seconds is None:
+            update["status"] = "FAILED"
+        else:
+            update["status"] = "PENDING"
+            update["next_attempt_at"] = (now + timedelta(seconds=delay_seconds)).isoformat()
+        self.supabase.table("notification_outbox").update(update).eq("id", notification_id).execute()
+        return True
+
     def store_file(self, task_id, file_type, file_path, content):
         """Store a file in FileStore for a given task_id and file_type"""
         # Ensure directories exist
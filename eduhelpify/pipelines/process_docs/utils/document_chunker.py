@@ -0,0 +1,120 @@
+import os
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+# Extensions whose content can be split as plain text
+TEXT_EXTENSIONS = {".txt", ".md", ".markdown", ".csv", ".json", ".html", ".htm"}
+
+
+class DocumentChunker:
+    """Decides when inputs are too large for one model call and splits them into chunks.
+
+    PDFs are split by page ranges, text-like files by paragraphs. Other formats
+    (images, office files) cannot be split locally and are passed through whole.
+    """
+
+    def __init__(self, logger, max_pages=None, max_bytes=None, chunk_pages=None, chunk_chars=None, max_chunks=None):
+        self.logger = logger
+        self.max_pages = max_pages or int(os.environ.get("MAP_REDUCE_MAX_PAGES", 200))
+        self.max_bytes = max_bytes or int(os.environ.get("MAP_REDUCE_MAX_BYTES", 20 * 1024 * 1024))
+        self.chunk_pages = chunk_pages or int(os.environ.get("MAP_REDUCE_CHUNK_PAGES", 50))
+        self.chunk_chars = chunk_chars or int(os.environ.get("MAP_REDUCE_CHUNK_CHARS", 200000))
+        self.max_chunks = max_chunks or int(os.environ.get("MAP_REDUCE_MAX_CHUNKS", 64))
+
+    @staticmethod
+    def count_pages(path):
+        """Number of pages in a PDF, or 0 for other files"""
+        if os.path.splitext(path)[1].lower() != ".pdf":
+            return 0
+        from pypdf import PdfReader
+        return len(PdfReader(path).pages)
+
+    def needs_map_reduce(self, file_paths):
+        """True when the inputs together exceed what a single model call should receive"""
+        total_pages = sum(self.count_pages(path) for path in file_paths)
+        total_bytes = sum(os.path.getsize(path) for path in file_paths)
+        if total_pages > self.max_pages or total_bytes > self.max_bytes:
+            self.logger.info(f"Inputs exceed single-call limits ({total_pages} pages, {total_bytes} bytes)")
+            return True
+        return False
+
+    def split(self, file_paths, work_dir):
+        """Split every input into chunk files inside work_dir
+
+        Returns:
+            list: Chunk file paths, in document order
+
+        Raises:
+            ValueError: If the inputs produce more than max_chunks chunks
+        """
+        os.makedirs(work_dir, exist_ok=True)
+        chunks = []
+        for path in file_paths:
+            extension = os.path.splitext(path)[1].lower()
+            if extension == ".pdf":
+                chunks.extend(self._split_pdf(path, work_dir))
+            elif extension in TEXT_EXTENSIONS:
+                chunks.extend(self._split_text(path, work_dir))
+            else:
+                chunks.append(path)
+
+        if len(chunks) > self.max_chunks:
+            raise ValueError(f"Input is too large: {len(chunks)} chunks exceeds the limit of {self.max_chunks}")
+
+        self.logger.info(f"Split {len(file_paths)} inputs into {len(chunks)} chunks")
+        return chunks
+
+    def _split_pdf(self, path, work_dir):
+        from pypdf import PdfReader, PdfWriter
+
+        reader = PdfReader(path)
+        page_count = len(reader.pages)
+        if page_count <= self.chunk_pages:
+            return [path]
+
+        base_name = os.path.splitext(os.path.basename(path))[0]
+        chunk_paths = []
+        for start in range(0, page_count, self.chunk_pages):
+            end = min(start + self.chunk_pages, page_count)
+            writer = PdfWriter()
+            for page_number in range(start, end):
+                writer.add_page(reader.pages[page_number])
+            chunk_path = os.path.join(work_dir, f"{base_name}.pages-{start + 1}-{end}.pdf")
+            with open(chunk_path, "wb") as f:
+                writer.write(f)
+            chunk_paths.append(chunk_path)
+        return chunk_paths
+
+    def _split_text(self, path, work_dir):
+        if os.path.getsize(path) <= self.chunk_chars:
+            return [path]
+
+        base_name, extension = os.path.splitext(os.path.basename(path))
+        chunk_paths = []
+        current = []
+        current_size = 0
+
+        def _flush():
+            chunk_path = os.path.join(work_dir, f"{base_name}.part-{len(chunk_paths) + 1}{extension}")
+            with open(chunk_path, "w", encoding="utf-8") as f:
+                f.write("".join(current))
+            chunk_paths.append(chunk_path)
+
+        # Break on paragraph boundaries so sections are not cut mid-sentence
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if current_size + len(line) > self.chunk_chars and current and not line.strip():
+                    _flush()
+                    current = []
+                    current_size = 0
+                current.append(line)
+                current_size += len(line)
+                # Hard limit for text without blank lines
+                if current_size > self.chunk_chars * 2:
+                    _flush()
+                    current = []
+                    current_size = 0
+        if current:
+            _flush()
+        return chunk_paths
@@ -5,14 +5,20 @@ from urllib.parse import urlparse
 from datetime import datetime
 from .logger import Logger
 from .database_service import DatabaseService
+from .file_downloader import storage_path_from_url
 import dotenv
 dotenv.load_dotenv(override=True)    
 
 class EmailService:
-    def __init__(self, logger, db_service):
-        """Initialize the EmailService with logger and database connection"""
+    def __init__(self, logger, db_service, storage_service=None):
+        """Initialize the EmailService with logger, database connection and optional storage access for signed links"""
         self.logger = logger
         self.db_service = db_service
+        self.storage_service = storage_service
+        
+        # Files up to this size are attached inline; larger ones are sent as signed download links
+        self.inline_attachment_max_bytes = int(os.environ.get("EMAIL_INLINE_ATTACHMENT_MAX_BYTES", 2 * 1024 * 1024))
+        self.signed_url_expiry = int(os.environ.get("SIGNED_URL_EXPIRY", 7 * 24 * 3600))
         
         # Resend API configuration from environment variables
         self.resend_api_key = os.environ.get("RESEND_API_KEY")
@@ -76,47 +82,53 @@ class EmailService:
             # It's already a local path
             return stored_location
 
-    def send_task_output(self, task_id):
-        """Send the output file of a completed task to the user
+    def _signed_link(self, stored_location):
+        """Signed download URL for a file stored in Supabase Storage, or None if it cannot be signed"""
+        if not self.storage_service or not self.storage_service.configured or not stored_location.startswith('http'):
+            return None
+        # Public URLs look like .../object/public/eduhelpify/<path>; the path after the bucket is what gets signed
+        storage_path = storage_path_from_url(stored_location)
+        if not storage_path:
+            return None
+        try:
+            return self.storage_service.create_signed_url(storage_path, self.signed_url_expiry)
+        except Exception as e:
+            self.logger.error(f"Error creating signed URL for {stored_location}: {str(e)}")
+            return None
+
+    def build_task_email(self, task_id, user_details=None, output_files=None, local_paths=None):
+        """Build the Resend payload for the output of a completed task
         
         Args:
             task_id: The UUID of the task
+            user_details: Email and username already loaded with the task context, if available
+            output_files: FileStore rows of the task's outputs, if the caller already has them
+            local_paths: Map of file_name to the local copy the pipeline just wrote, to avoid re-downloading
             
         Returns:
-            bool: True if the email was sent successfully, False otherwise
+            dict: The email payload, or None if there is no recipient or nothing to deliver
         """
-        self.logger.info(f"Preparing to send output for task ID: {task_id}")
+        self.logger.info(f"Preparing output email for task ID: {task_id}")
         
-        # Get user details from database
-        user_details = self.db_service.get_user_details(task_id)
+        # Get user details from database unless the caller already has them
+        if not user_details:
+            user_details = self.db_service.get_user_details(task_id)
         if not user_details or not user_details.get("email"):
             self.logger.error(f"No user email found for task ID: {task_id}")
-            return False
+            return None
         
-        # Get output files for the task
-        output_files = self.db_service.get_files_by_task_and_type(task_id, "output")
+        # Get output files for the task unless the caller already has them
+        if not output_files:
+            output_files = self.db_service.get_files_by_task_and_type(task_id, "output")
         if not output_files:
             self.logger.error(f"No output files found for task ID: {task_id}")
-            return False
+            return None
         
-        # Create email message
-        username = user_details.get("username", "User")
-        email_body = f"""
-        <p>Hello {username},</p>
-        
-        <p>Your document processing task has been completed successfully.</p>
-        
-        <p>The processed file(s) are attached to this email.</p>
-        
-        <p>Thank you for using our service!</p>
-        
-        <p>Regards,<br>
-        EduHelpify Team</p>
-        """
-        
-        # Prepare attachments
+        # Prepare attachments: small files inline, large ones as time-limited links
         files_attached = 0
         attachments = []
+        links = []
+        local_paths = local_paths or {}
         
         for file_data in output_files:
             # Get stored location which could be URL or local path
@@ -125,16 +137,25 @@ class EmailService:
                 self.logger.warning(f"No stored location for file in task {task_id}")
                 continue
                 
-            # First try to use the local path directly for output_{task_id}.*
+            # Prefer the local copy the pipeline already has, then output_{task_id}.* in the output directory
             file_name = file_data.get("file_name", "")
             task_output_path = os.path.join(self.store_location, 'output', file_name)
+            file_path = local_paths.get(file_name)
+            if not file_path or not os.path.exists(file_path):
+                file_path = task_output_path if os.path.exists(task_output_path) else None
             
-            # If the task output path exists directly, use it
-            if os.path.exists(task_output_path):
-                self.logger.info(f"Using direct task output path: {task_output_path}")
-                file_path = task_output_path
-            else:
-                # Otherwise try to get the file from stored_location
+            # Known to be large (or not available locally): send a signed link instead of downloading and encoding it
+            file_size = os.path.getsize(file_path) if file_path else file_data.get("file_size")
+            if file_size is None or file_size > self.inline_attachment_max_bytes:
+                signed_url = self._signed_link(stored_location)
+                if signed_url:
+                    links.append({"filename": file_name, "url": signed_url})
+                    files_attached += 1
+                    self.logger.info(f"Added download link for {file_name} ({file_size or 'unknown'} bytes)")
+                    continue
+            
+            if not file_path:
+                # Last resort: get the file from stored_location
                 file_path = self._download_file_if_url(stored_location, task_id)
             
             if file_path and os.path.exists(file_path):
@@ -159,20 +180,77 @@ class EmailService:
         
         if files_attached == 0:
             self.logger.error(f"No attachable files found for task ID: {task_id}")
-            return False
+            return None
         
-        # Prepare Resend API request
-        headers = {
-            "Authorization": f"Bearer {self.resend_api_key}",
-            "Content-Type": "application/json"
-        }
+        # Create email message
+        username = user_details.get("username", "User")
+        delivery_text = ""
+        if attachments:
+            delivery_text += "<p>The processed file(s) are attached to this email.</p>"
+        if links:
+            expiry_days = max(1, self.signed_url_expiry // 86400)
+            link_items = "".join(f'<li><a href="{link["url"]}">{link["filename"]}</a></li>' for link in links)
+            delivery_text += f"<p>Download your processed file(s) here (links expire in {expiry_days} day(s)):</p><ul>{link_items}</ul>"
+        email_body = f"""
+        <p>Hello {username},</p>
+        
+        <p>Your document processing task has been completed successfully.</p>
+        
+        {delivery_text}
+        
+        <p>Thank you for using our service!</p>
+        
+        <p>Regards,<br>
+        EduHelpify Team</p>
+        """
         
         data = {
             "from": f"{self.sender_name} <{self.sender_email}>",
             "to": user_details["email"],
             "subject": "Your document processing task is complete",
-            "html": email_body,
-            "attachments": attachments
+            "html": email_body
+        }
+        if attachments:
+            data["attachments"] = attachments
+        return data
+
+    def queue_task_output(self, task_id, user_details=None, output_files=None, local_paths=None):
+        """Write the output email of a completed task to the notification outbox
+        
+        The email is delivered later by the outbox sender, so a slow or failing
+        email provider never holds up task processing. Takes the same arguments
+        as build_task_email.
+            
+        Returns:
+            bool: True if the email was queued, False otherwise
+        """
+        data = self.build_task_email(task_id, user_details, output_files, local_paths)
+        if not data:
+            return False
+        try:
+            self.db_service.enqueue_notification(task_id, data)
+            self.logger.info(f"Queued output email to {data['to']} for task ID: {task_id}")
+            return True
+        except Exception as e:
+            self.logger.error(f"Failed to queue email for task ID {task_id}: {str(e)}")
+            return False
+
+    def send_task_output(self, task_id, user_details=None, output_files=None, local_paths=None):
+        """Send the output file of a completed task to the user right away
+        
+        Takes the same arguments as build_task_email.
+            
+        Returns:
+            bool: True if the email was sent successfully, False otherwise
+        """
+        data = self.build_task_email(task_id, user_details, output_files, local_paths)
+        if not data:
+            return False
+        
+        # Prepare Resend API request
+        headers = {
+            "Authorization": f"Bearer {self.resend_api_key}",
+            "Content-Type": "application/json"
         }
             
         try:
@@ -181,7 +259,7 @@ class EmailService:
             
             # Check response status
             if response.status_code >= 200 and response.status_code < 300:
-                self.logger.info(f"Email sent successfully to {user_details['email']} for task ID: {task_id}")
+                self.logger.info(f"Email sent successfully to {data['to']} for task ID: {task_id}")
                 return True
             else:
                 self.logger.warning(f"Initial Resend API call failed for task ID: {task_id}. Status: {response.status_code}")
@@ -0,0 +1,165 @@
+import os
+import hashlib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from .logger import Logger
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Hash a file's content without loading it into memory"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class FileCache:
+    """Content-addressed on-disk cache of downloaded input documents.
+
+    Blobs are stored as ``blobs/<sha256><ext>`` so identical content is kept
+    once and two tasks can never overwrite each other's inputs. The URL each
+    blob came from is remembered together with its ETag/Last-Modified, so a
+    repeat download becomes a conditional request answered with 304.
+    """
+
+    def __init__(self, logger, cache_dir=None, max_bytes=None, min_age_seconds=None):
+        self.logger = logger
+        store_location = os.environ.get("STORE_LOCATION", ".")
+        self.cache_dir = cache_dir or os.environ.get("INPUT_CACHE_DIR", os.path.join(store_location, "cache", "input"))
+        self.max_bytes = max_bytes or int(os.environ.get("INPUT_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+        # Recently used blobs may still be read by a running task, so eviction leaves them alone
+        self.min_age_seconds = min_age_seconds if min_age_seconds is not None else int(os.environ.get("INPUT_CACHE_MIN_AGE", 3600))
+        self.blob_dir = os.path.join(self.cache_dir, "blobs")
+        self.db_path = os.path.join(self.cache_dir, "index.db")
+        self._lock = threading.Lock()
+        os.makedirs(self.blob_dir, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                create table if not exists blobs (
+                    sha256 text primary key,
+                    path text not null,
+                    size integer not null,
+                    last_used real not null
+                )
+                """
+            )
+            conn.execute(
+                """
+                create table if not exists sources (
+                    url text primary key,
+                    sha256 text not null,
+                    etag text,
+                    last_modified text
+                )
+                """
+            )
+            conn.execute("create index if not exists blobs_last_used_idx on blobs (last_used)")
+
+        self.logger.info(f"FileCache initialized at {self.cache_dir} (max {self.max_bytes} bytes)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lookup(self, url):
+        """Get the cached entry for a URL if its blob is still on disk
+
+        Returns:
+            dict: {'sha256', 'path', 'etag', 'last_modified'} or None
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "select s.sha256, s.etag, s.last_modified, b.path from sources s "
+                "join blobs b on b.sha256 = s.sha256 where s.url = ?",
+                (url,),
+            ).fetchone()
+        if not row or not os.path.exists(row["path"]):
+            return None
+        return dict(row)
+
+    def touch(self, sha256):
+        """Mark a blob as recently used"""
+        with self._connect() as conn:
+            conn.execute("update blobs set last_used = ? where sha256 = ?", (time.time(), sha256))
+
+    def store(self, tmp_path, url, extension="", etag=None, last_modified=None):
+        """Move a freshly downloaded file into the cache
+
+        Args:
+            tmp_path: Downloaded file; it is moved (or deleted if the content is already cached)
+            url: Source URL the file was fetched from
+            extension: File extension to keep on the blob so mime type detection still works
+            etag: ETag response header, if any
+            last_modified: Last-Modified response header, if any
+
+        Returns:
+            str: Path of the cached blob
+        """
+        sha256 = file_sha256(tmp_path)
+        blob_path = os.path.join(self.blob_dir, f"{sha256}{extension.lower()}")
+        size = os.path.getsize(tmp_path)
+
+        with self._lock:
+            if os.path.exists(blob_path):
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, blob_path)
+
+            with self._connect() as conn:
+                conn.execute(
+                    "insert into blobs (sha256, path, size, last_used) values (?, ?, ?, ?) "
+                    "on conflict(sha256) do update set last_used = excluded.last_used",
+                    (sha256, blob_path, size, time.time()),
+                )
+                conn.execute(
+                    "insert into sources (url, sha256, etag, last_modified) values (?, ?, ?, ?) "
+                    "on conflict(url) do update set sha256 = excluded.sha256, etag = excluded.etag, "
+                    "last_modified = excluded.last_modified",
+                    (url, sha256, etag, last_modified),
+                )
+
+        self.logger.info(f"Cached {url} as {blob_path} ({size} bytes)")
+        self.evict()
+        return blob_path
+
+    def evict(self):
+        """Delete least recently used blobs until the cache fits in max_bytes"""
+        with self._lock, self._connect() as conn:
+            total = conn.execute("select coalesce(sum(size), 0) from blobs").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+
+            cutoff = time.time() - self.min_age_seconds
+            candidates = conn.execute(
+                "select sha256, path, size from blobs where last_used < ? order by last_used",
+                (cutoff,),
+            ).fetchall()
+
+            evicted = 0
+            for row in candidates:
+                if total <= self.max_bytes:
+                    break
+                if os.path.exists(row["path"]):
+                    os.remove(row["path"])
+                conn.execute("delete from sources where sha256 = ?", (row["sha256"],))
+                conn.execute("delete from blobs where sha256 = ?", (row["sha256"],))
+                total -= row["size"]
+                evicted += 1
+
+        if evicted:
+            self.logger.info(f"Evicted {evicted} blobs from input cache")
+        return evicted
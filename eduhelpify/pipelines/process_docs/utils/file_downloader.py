@@ -0,0 +1,163 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from .logger import Logger
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+
+def storage_path_from_url(url):
+    """Extract the object path inside the 'eduhelpify' bucket from a Supabase Storage URL"""
+    path_parts = urlparse(url).path.split('/')
+    for i, part in enumerate(path_parts):
+        if part == 'eduhelpify' and i < len(path_parts) - 1:
+            return '/'.join(path_parts[i+1:])
+    return None
+
+
+class FileDownloader:
+    def __init__(self, logger, store_location=None, concurrency=None, chunk_size=None, file_cache=None):
+        """Initialize the downloader with a shared keep-alive HTTP session and optional input cache"""
+        self.logger = logger
+        self.store_location = store_location or os.environ.get("STORE_LOCATION", "")
+        self.supabase_url = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
+        self.service_role_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+        self.concurrency = concurrency or int(os.environ.get("DOWNLOAD_CONCURRENCY", 4))
+        self.chunk_size = chunk_size or int(os.environ.get("DOWNLOAD_CHUNK_SIZE", 1024 * 1024))
+        self.timeout = float(os.environ.get("DOWNLOAD_TIMEOUT", 120))
+        self.file_cache = file_cache
+
+        # One pooled session per process: connections to Supabase Storage are reused across files and tasks
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(self.concurrency, 10))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.logger.info(f"FileDownloader initialized (concurrency: {self.concurrency}, chunk size: {self.chunk_size})")
+
+    def _service_role_headers(self):
+        return {
+            "Authorization": f"Bearer {self.service_role_key}",
+            "apikey": self.service_role_key
+        }
+
+    def _fetch(self, url, local_path, headers=None):
+        """Stream a URL to local_path through the shared session
+
+        Returns:
+            dict: The response headers, or None if the server answered 304 Not Modified
+        """
+        tmp_path = f"{local_path}.part-{os.getpid()}-{threading.get_ident()}"
+        try:
+            with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+                if response.status_code == 304:
+                    return None
+                response.raise_for_status()
+                with open(tmp_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=self.chunk_size):
+                        f.write(chunk)
+                response_headers = dict(response.headers)
+            os.replace(tmp_path, local_path)
+            return response_headers
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def download_file(self, url, task_id, file_name):
+        """Download file from URL, serving it from the input cache when it has not changed"""
+        try:
+            # Check if URL is actually a local path
+            if not url.startswith('http'):
+                # It's a local path, just return it
+                self.logger.info(f"Using local file path: {url}")
+                return url
+
+            storage_path = storage_path_from_url(url)
+            if not storage_path:
+                self.logger.error(f"Could not parse storage path from URL: {url}")
+                raise ValueError(f"Invalid storage URL format: {url}")
+
+            self.logger.info(f"Extracted storage path: {storage_path}")
+
+            # Downloads land in the cache's staging area; without a cache, each task's inputs get
+            # their own directory so tasks uploading files with the same name never collide
+            if self.file_cache:
+                input_dir = os.path.join(self.file_cache.cache_dir, 'incoming')
+                local_path = os.path.join(input_dir, f"{task_id}-{file_name}")
+            else:
+                input_dir = os.path.join(self.store_location, 'input', str(task_id))
+                local_path = os.path.join(input_dir, file_name)
+            os.makedirs(input_dir, exist_ok=True)
+
+            # Revalidate a cached copy with a conditional request instead of downloading it again
+            cached = self.file_cache.lookup(url) if self.file_cache else None
+            conditional_headers = {}
+            if cached:
+                if cached.get("etag"):
+                    conditional_headers["If-None-Match"] = cached["etag"]
+                if cached.get("last_modified"):
+                    conditional_headers["If-Modified-Since"] = cached["last_modified"]
+
+            # With the service role key the authenticated endpoint always works, so try it first
+            # and only fall back to the plain URL; this avoids a failed round trip on private buckets
+            attempts = []
+            if self.supabase_url and self.service_role_key:
+                api_endpoint = f"{self.supabase_url}/storage/v1/object/eduhelpify/{storage_path}"
+                attempts.append((api_endpoint, {**self._service_role_headers(), **conditional_headers}))
+            attempts.append((url, conditional_headers or None))
+
+            last_error = None
+            for attempt_url, headers in attempts:
+                try:
+                    self.logger.info(f"Downloading {file_name} from {attempt_url}")
+                    response_headers = self._fetch(attempt_url, local_path, headers)
+                    if response_headers is None:
+                        self.file_cache.touch(cached["sha256"])
+                        self.logger.info(f"Input cache hit for {file_name}: {cached['path']}")
+                        return cached["path"]
+
+                    if self.file_cache:
+                        local_path = self.file_cache.store(
+                            local_path,
+                            url,
+                            extension=os.path.splitext(file_name)[1],
+                            etag=response_headers.get("ETag"),
+                            last_modified=response_headers.get("Last-Modified")
+                        )
+                    self.logger.info(f"Downloaded file from {attempt_url} to {local_path}")
+                    return local_path
+                except Exception as e:
+                    self.logger.warning(f"Download from {attempt_url} failed: {str(e)}")
+                    last_error = e
+            raise last_error
+
+        except Exception as e:
+            self.logger.error(f"Error downloading file {url}: {str(e)}")
+            raise
+
+    def download_all(self, input_files, task_id):
+        """Download all input files of a task in parallel
+
+        Args:
+            input_files: FileStore rows with 'stored_location' and 'file_name'
+            task_id: The UUID of the task
+
+        Returns:
+            list: Local paths in the same order as input_files, None for files that failed
+        """
+        def _download(file):
+            try:
+                return self.download_file(file['stored_location'], task_id, file['file_name'])
+            except Exception as e:
+                self.logger.error(f"Error downloading file {file['file_name']}: {str(e)}")
+                return None
+
+        if len(input_files) <= 1:
+            return [_download(file) for file in input_files]
+
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(input_files)), thread_name_prefix="download") as executor:
+            return list(executor.map(_download, input_files))
@@ -0,0 +1,133 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+import google.generativeai as genai
+from .file_cache import file_sha256
+from .logger import Logger
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+# Gemini keeps uploaded files for 48 hours
+DEFAULT_FILE_TTL_SECONDS = 48 * 3600
+
+
+class GeminiFileRegistry:
+    """Persistent map from content hash to an uploaded Gemini file.
+
+    Identical documents are uploaded once and reused by later tasks until the
+    remote copy is about to expire, at which point they are uploaded again.
+    ``client`` is anything with genai's upload_file/get_file/delete_file
+    functions, which lets tests swap in tests.fakes.FakeGeminiClient.
+    """
+
+    def __init__(self, logger, client=None, db_path=None, expiry_margin_seconds=None):
+        self.logger = logger
+        self.client = client or genai
+        store_location = os.environ.get("STORE_LOCATION", ".")
+        self.db_path = db_path or os.environ.get("GEMINI_FILE_REGISTRY_DB", os.path.join(store_location, "gemini_files.db"))
+        # Never hand out a file that could expire while a generation is still using it
+        self.expiry_margin_seconds = expiry_margin_seconds or int(os.environ.get("GEMINI_FILE_EXPIRY_MARGIN", 3600))
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                create table if not exists gemini_files (
+                    sha256 text primary key,
+                    name text not null,
+                    uri text not null,
+                    mime_type text,
+                    expires_at real not null,
+                    uploaded_at real not null
+                )
+                """
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _expiry_timestamp(file):
+        expiration_time = getattr(file, "expiration_time", None)
+        if expiration_time is not None and hasattr(expiration_time, "timestamp"):
+            return expiration_time.timestamp()
+        return time.time() + DEFAULT_FILE_TTL_SECONDS
+
+    def get_or_upload(self, path, mime_type=None):
+        """Return a live Gemini file for path, uploading it only if no reusable copy exists
+
+        Args:
+            path: Local file to upload
+            mime_type: Mime type passed to the upload
+
+        Returns:
+            The Gemini file object
+        """
+        sha256 = file_sha256(path)
+
+        with self._connect() as conn:
+            row = conn.execute("select * from gemini_files where sha256 = ?", (sha256,)).fetchone()
+
+        if row and row["expires_at"] - self.expiry_margin_seconds > time.time():
+            try:
+                file = self.client.get_file(row["name"])
+                self.logger.info(f"Reusing Gemini file {row['name']} for {path}")
+                return file
+            except Exception as e:
+                self.logger.warning(f"Registered Gemini file {row['name']} is no longer available: {str(e)}")
+        elif row:
+            self.logger.info(f"Gemini file {row['name']} is about to expire, uploading {path} again")
+            self._delete_remote(row["name"])
+
+        file = self.client.upload_file(str(path), mime_type=mime_type)
+        self.logger.info(f"Uploaded file '{file.display_name}' as: {file.uri} (type: {mime_type or 'auto-detected'})")
+
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "insert into gemini_files (sha256, name, uri, mime_type, expires_at, uploaded_at) values (?, ?, ?, ?, ?, ?) "
+                "on conflict(sha256) do update set name = excluded.name, uri = excluded.uri, "
+                "mime_type = excluded.mime_type, expires_at = excluded.expires_at, uploaded_at = excluded.uploaded_at",
+                (sha256, file.name, file.uri, mime_type, self._expiry_timestamp(file), time.time()),
+            )
+        return file
+
+    def _delete_remote(self, name):
+        try:
+            self.client.delete_file(name)
+            self.logger.info(f"Deleted stale Gemini file {name}")
+        except Exception as e:
+            self.logger.warning(f"Could not delete Gemini file {name}: {str(e)}")
+
+    def cleanup_expired(self):
+        """Forget (and delete remotely) files that have expired or are too close to expiry to reuse
+
+        Returns:
+            int: Number of registry entries removed
+        """
+        cutoff = time.time() + self.expiry_margin_seconds
+        with self._connect() as conn:
+            rows = conn.execute("select sha256, name from gemini_files where expires_at < ?", (cutoff,)).fetchall()
+
+        for row in rows:
+            self._delete_remote(row["name"])
+
+        with self._lock, self._connect() as conn:
+            conn.executemany("delete from gemini_files where sha256 = ?", [(row["sha256"],) for row in rows])
+
+        if rows:
+            self.logger.info(f"Removed {len(rows)} expired Gemini files from the registry")
+        return len(rows)
@@ -0,0 +1,158 @@
+import re
+import json
+
+CODE_FENCE_PATTERN = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+CLOSERS = {"{": "}", "[": "]"}
+
+# How many cut points repair_json tries before giving up
+MAX_REPAIR_ATTEMPTS = 50
+
+
+def repair_json(text):
+    """Turn near-valid JSON from a model into valid JSON text
+
+    Handles code fences, text before or after the JSON value, trailing commas
+    and output that was cut off (unterminated strings, unclosed brackets,
+    dangling keys). A truncated last element is dropped rather than guessed.
+
+    Raises:
+        ValueError: If no valid JSON can be recovered
+    """
+    text = CODE_FENCE_PATTERN.sub("", text)
+    starts = [index for index in (text.find("["), text.find("{")) if index >= 0]
+    if not starts:
+        raise ValueError("No JSON value found in model output")
+    text = text[min(starts):]
+
+    out = []
+    stack = []
+    # (length of out, open brackets) at each comma: cutting there drops an incomplete element
+    cut_points = []
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            out.append(char)
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in CLOSERS:
+            stack.append(char)
+        elif char in "]}":
+            if not stack:
+                break
+            # Drop a trailing comma before the closing bracket
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+            # A mismatched bracket is replaced by the one that closes the open value
+            out.append(CLOSERS[stack.pop()])
+            if not stack:
+                break
+            continue
+        elif char == ",":
+            cut_points.append((len(out), list(stack)))
+        out.append(char)
+
+    if in_string:
+        if escaped:
+            out.pop()
+        out.append('"')
+
+    candidates = [("".join(out), stack)]
+    candidates += [("".join(out[:length]), brackets) for length, brackets in reversed(cut_points[-MAX_REPAIR_ATTEMPTS:])]
+    for body, brackets in candidates:
+        body = body.rstrip()
+        if body.endswith(","):
+            body = body[:-1]
+        candidate = body + "".join(CLOSERS[bracket] for bracket in reversed(brackets))
+        try:
+            json.loads(candidate)
+            return candidate
+        except json.JSONDecodeError:
+            continue
+    raise ValueError("Model output is not valid JSON and could not be repaired")
+
+
+class StreamingArrayParser:
+    """Parses the objects of a JSON array while the array is still being streamed.
+
+    feed() returns every element object that was completed by the new text, so
+    callers can act on them before the response has finished. The first array
+    in the stream is used, which also covers {"slides": [...]} wrappers. Text
+    of elements already returned is discarded, so memory stays bounded by the
+    size of one element.
+    """
+
+    def __init__(self):
+        self.done = False
+        self.count = 0
+        self._buffer = ""
+        self._position = 0
+        self._depth = 0
+        self._array_depth = None
+        self._element_start = None
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, chunk):
+        completed = []
+        if self.done:
+            return completed
+        self._buffer += chunk
+
+        buffer = self._buffer
+        position = self._position
+        while position < len(buffer):
+            char = buffer[position]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in "[{":
+                self._depth += 1
+                if self._array_depth is None:
+                    if char == "[":
+                        self._array_depth = self._depth
+                elif char == "{" and self._depth == self._array_depth + 1:
+                    self._element_start = position
+            elif char in "]}":
+                if char == "}" and self._element_start is not None and self._depth == self._array_depth + 1:
+                    element = buffer[self._element_start:position + 1]
+                    self._element_start = None
+                    try:
+                        completed.append(json.loads(element))
+                    except json.JSONDecodeError:
+                        try:
+                            completed.append(json.loads(repair_json(element)))
+                        except ValueError:
+                            # Unrecoverable element; the caller sees a gap in count
+                            pass
+                    self.count += 1
+                elif char == "]" and self._depth == self._array_depth:
+                    self.done = True
+                    self._depth -= 1
+                    break
+                self._depth -= 1
+            position += 1
+
+        # Forget text that can no longer be part of an element
+        keep_from = self._element_start if self._element_start is not None else position
+        self._buffer = buffer[keep_from:]
+        self._position = position - keep_from
+        if self._element_start is not None:
+            self._element_start = 0
+        return completed
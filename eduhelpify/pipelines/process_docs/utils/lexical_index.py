@@ -0,0 +1,226 @@
+import os
+import re
+import time
+import threading
+from collections import Counter, OrderedDict
+import numpy as np
+from .logger import Logger
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+CHARS_PER_TOKEN = 4
+TOKEN_PATTERN = re.compile(r"\w+")
+PARAGRAPH_PATTERN = re.compile(r"\n\s*\n")
+STOPWORDS = {
+    "a", "about", "an", "and", "are", "as", "at", "be", "by", "can", "do", "for", "from", "how", "i", "in",
+    "is", "it", "its", "me", "my", "of", "on", "or", "please", "that", "the", "their", "this", "to", "was",
+    "what", "when", "which", "with", "you", "your", "focus", "make", "create", "give", "generate",
+}
+
+
+def tokenize(text):
+    """Lowercase index terms of a text"""
+    return [word for word in TOKEN_PATTERN.findall(text.lower()) if len(word) > 1 and word not in STOPWORDS]
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def chunk_pages(pages, chunk_tokens):
+    """Split numbered pages into chunks of about chunk_tokens, along paragraph breaks
+
+    Chunks never cross a page, so every chunk keeps the page it came from.
+
+    Args:
+        pages: (number, text) pairs
+
+    Returns:
+        list: (page number, chunk text) pairs, in document order
+    """
+    max_chars = chunk_tokens * CHARS_PER_TOKEN
+    chunks = []
+    for number, text in pages:
+        current = []
+        current_chars = 0
+        for paragraph in PARAGRAPH_PATTERN.split(text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            # Paragraphs longer than a chunk are cut at line breaks, or hard-cut as a last resort
+            pieces = [paragraph]
+            if len(paragraph) > max_chars:
+                pieces = []
+                for line in paragraph.splitlines():
+                    pieces.extend(line[start:start + max_chars] for start in range(0, len(line), max_chars))
+            for piece in pieces:
+                if current and current_chars + len(piece) > max_chars:
+                    chunks.append((number, "\n\n".join(current)))
+                    current = []
+                    current_chars = 0
+                current.append(piece)
+                current_chars += len(piece) + 2
+        if current:
+            chunks.append((number, "\n\n".join(current)))
+    return chunks
+
+
+class LexicalIndex:
+    """Okapi BM25 over a fixed list of text chunks.
+
+    Postings are kept as NumPy arrays grouped by term, each holding its final
+    BM25 weight, so scoring a query is one slice-and-add per query term and a
+    sort over the chunks that matched. This stays in the low milliseconds for
+    thousands of chunks; building the index is the expensive part.
+    """
+
+    def __init__(self, chunk_texts, k1=1.5, b=0.75):
+        self.chunk_count = len(chunk_texts)
+        self.vocabulary = {}
+        term_ids = []
+        chunk_ids = []
+        frequencies = []
+        lengths = np.zeros(self.chunk_count, dtype=np.float32)
+        for chunk_id, text in enumerate(chunk_texts):
+            counts = Counter(tokenize(text))
+            lengths[chunk_id] = sum(counts.values())
+            for term, count in counts.items():
+                term_ids.append(self.vocabulary.setdefault(term, len(self.vocabulary)))
+                chunk_ids.append(chunk_id)
+                frequencies.append(count)
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        self.posting_chunks = np.asarray(chunk_ids, dtype=np.int32)[order]
+        tf = np.asarray(frequencies, dtype=np.float32)[order]
+        document_frequency = np.bincount(term_ids, minlength=len(self.vocabulary))
+        self.posting_starts = np.concatenate(([0], np.cumsum(document_frequency)))
+
+        idf = np.log(1 + (self.chunk_count - document_frequency + 0.5) / (document_frequency + 0.5)).astype(np.float32)
+        average_length = float(lengths.mean()) if self.chunk_count else 0.0
+        norm = k1 * (1 - b + b * lengths[self.posting_chunks] / max(average_length, 1.0))
+        self.posting_weights = np.repeat(idf, document_frequency) * tf * (k1 + 1) / (tf + norm)
+
+    def scores(self, query):
+        """BM25 score of every chunk for a query"""
+        scores = np.zeros(self.chunk_count, dtype=np.float32)
+        for term, count in Counter(tokenize(query)).items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.posting_starts[term_id], self.posting_starts[term_id + 1]
+            scores[self.posting_chunks[start:end]] += count * self.posting_weights[start:end]
+        return scores
+
+    def top(self, query, token_counts, token_budget):
+        """Best-scoring chunks for a query that together fit in token_budget
+
+        Returns:
+            list: Chunk ids in document order (empty when nothing matches)
+        """
+        scores = self.scores(query)
+        matched = np.flatnonzero(scores > 0)
+        ranked = matched[np.argsort(-scores[matched], kind="stable")]
+        # Greedy fill: a chunk that does not fit is skipped so smaller ones can still use the budget
+        cumulative = np.cumsum(token_counts[ranked])
+        if cumulative.size and cumulative[-1] <= token_budget:
+            return sorted(ranked.tolist())
+        selected = []
+        used = 0
+        for chunk_id in ranked.tolist():
+            if used + token_counts[chunk_id] <= token_budget:
+                selected.append(chunk_id)
+                used += token_counts[chunk_id]
+        return sorted(selected)
+
+
+class FocusRetriever:
+    """Narrows large extracted inputs to the chunks a task's focus is about.
+
+    When a task has a focus_area and its extracted text is over min_tokens,
+    the text is cut into chunks, indexed with LexicalIndex and only the top
+    chunks for the focus area (plus the user prompt) are sent, up to
+    token_budget tokens. Indexes are kept for the last few document sets, so
+    a follow-up task on the same material with another focus only pays for
+    the query.
+    """
+
+    def __init__(self, logger, token_budget=None, min_tokens=None, chunk_tokens=None, cache_size=None):
+        self.logger = logger
+        self.enabled = os.environ.get("FOCUS_RETRIEVAL", "true").lower() == "true"
+        self.token_budget = token_budget or int(os.environ.get("RETRIEVAL_TOKEN_BUDGET", 60000))
+        self.min_tokens = min_tokens or int(os.environ.get("RETRIEVAL_MIN_TOKENS", 100000))
+        self.chunk_tokens = chunk_tokens or int(os.environ.get("RETRIEVAL_CHUNK_TOKENS", 400))
+        self.cache_size = cache_size or int(os.environ.get("RETRIEVAL_INDEX_CACHE", 8))
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _index(self, documents):
+        """(index, chunks, token counts) for documents, built once per document set"""
+        cache_key = tuple((key, len(pages)) for key, pages in documents)
+        with self._lock:
+            if cache_key in self._cache:
+                self._cache.move_to_end(cache_key)
+                return self._cache[cache_key]
+
+        started = time.perf_counter()
+        chunks = [
+            (key, number, text)
+            for key, pages in documents
+            for number, text in chunk_pages(pages, self.chunk_tokens)
+        ]
+        index = LexicalIndex([text for _, _, text in chunks])
+        token_counts = np.fromiter((estimate_tokens(text) for _, _, text in chunks), dtype=np.int64, count=len(chunks))
+        self.logger.info(
+            f"Indexed {len(chunks)} chunks ({len(index.vocabulary)} terms) in {(time.perf_counter() - started) * 1000:.0f} ms"
+        )
+
+        entry = (index, chunks, token_counts)
+        with self._lock:
+            self._cache[cache_key] = entry
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return entry
+
+    def select(self, documents, focus_area, user_prompt=""):
+        """Chunks of the documents that match the task focus
+
+        Args:
+            documents: (key, [(page number, text), ...]) per document; key identifies
+                the content (e.g. its sha256) and is used for index caching
+            focus_area: The task's focus area; without one nothing is selected
+            user_prompt: Extra query text
+
+        Returns:
+            dict: key -> [(page number, text)] with the selected chunks of each page
+            joined, for every document; None when the whole input should be sent
+        """
+        if not self.enabled or not focus_area or not focus_area.strip() or not documents:
+            return None
+        total_tokens = sum(estimate_tokens(text) for _, pages in documents for _, text in pages)
+        if total_tokens <= self.min_tokens:
+            return None
+
+        index, chunks, token_counts = self._index(documents)
+        started = time.perf_counter()
+        # Focus terms count double so a generic user prompt cannot outrank them
+        selected = index.top(f"{focus_area} {focus_area} {user_prompt or ''}", token_counts, self.token_budget)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if not selected:
+            self.logger.info(f"No chunks match focus '{focus_area}'; sending the whole input")
+            return None
+
+        pages_by_key = {key: OrderedDict() for key, _ in documents}
+        for chunk_id in selected:
+            key, number, text = chunks[chunk_id]
+            pages_by_key[key].setdefault(number, []).append(text)
+        selected_tokens = int(token_counts[selected].sum())
+        self.logger.info(
+            f"Selected {len(selected)} of {len(chunks)} chunks ({selected_tokens} of ~{total_tokens} tokens) "
+            f"for focus '{focus_area}' in {elapsed_ms:.1f} ms"
+        )
+        return {
+            key: [(number, "\n\n[...]\n\n".join(texts)) for number, texts in pages.items()]
+            for key, pages in pages_by_key.items()
+        }
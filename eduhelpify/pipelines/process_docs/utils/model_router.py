@@ -0,0 +1,171 @@
+import os
+import json
+import threading
+from dataclasses import dataclass, field
+from .resilience import CircuitBreaker, RateLimiter, ResilientCaller
+from .token_accounting import model_prices
+from .logger import Logger
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+# Tiers from most capable to cheapest and fastest; fallbacks only ever walk down this list
+TIER_ORDER = ("large", "standard", "fast")
+CONTENT_LENGTH_WEIGHT = {"short": 0, "medium": 1, "detailed": 2}
+DIFFICULTY_WEIGHT = {"beginner": 0, "intermediate": 1, "expert": 2}
+
+
+@dataclass
+class ModelRoute:
+    """The model chosen for a task and the caller to reach it through"""
+    model_name: str
+    caller: ResilientCaller
+    preferred: str
+    reason: str
+    skipped: list = field(default_factory=list)
+
+
+class ModelRouter:
+    """Chooses the Gemini model for each task.
+
+    The preferred model is the task config's AiModel when it has one.
+    Otherwise it is picked from three tiers (MODEL_FAST, MODEL_STANDARD,
+    MODEL_LARGE) by content_length, difficulty_level and the estimated input
+    size: short, easy tasks on small inputs go to the fast model, detailed
+    expert tasks to the large one unless their input would make it too slow.
+
+    Every model has its own circuit breaker and rate-limit bucket. When the
+    preferred model's circuit is open or its bucket is empty, the next model
+    in its fallback chain is used. Fallbacks are only ever cheaper tiers, so a
+    saturated model can never push a task (or a budget downgrade) onto a more
+    expensive one. Every decision is
+    logged with its inputs so routing can be tuned against latency and quality.
+    """
+
+    def __init__(self, logger, fast_model=None, standard_model=None, large_model=None,
+                 fast_max_tokens=None, large_max_tokens=None):
+        self.logger = logger
+        self.tiers = {
+            "fast": fast_model or os.environ.get("MODEL_FAST", "gemini-2.0-flash-lite"),
+            "standard": standard_model or os.environ.get("MODEL_STANDARD", "gemini-2.0-flash"),
+            "large": large_model or os.environ.get("MODEL_LARGE", "gemini-2.5-pro"),
+        }
+        # Inputs up to this size are small enough for the fast model
+        self.fast_max_tokens = fast_max_tokens or int(os.environ.get("ROUTER_FAST_MAX_TOKENS", 30000))
+        # Above this size the large model is too slow, so rules never pick it
+        self.large_max_tokens = large_max_tokens or int(os.environ.get("ROUTER_LARGE_MAX_TOKENS", 300000))
+        # Per-model requests per minute, e.g. {"gemini-2.5-pro": 150}; others use GEMINI_REQUESTS_PER_MINUTE
+        self.requests_per_minute = json.loads(os.environ.get("MODEL_REQUESTS_PER_MINUTE", "{}"))
+        self._models = {}
+        self._lock = threading.Lock()
+        for model_name in self.tiers.values():
+            self._model(model_name)
+
+    def _model(self, model_name):
+        """(breaker, limiter, caller) of a model, created on first use"""
+        with self._lock:
+            if model_name not in self._models:
+                breaker = CircuitBreaker(self.logger, name=model_name)
+                limiter = RateLimiter(self.logger, self.requests_per_minute.get(model_name), name=model_name)
+                self._models[model_name] = (breaker, limiter, ResilientCaller(self.logger, breaker, limiter))
+            return self._models[model_name]
+
+    @property
+    def is_open(self):
+        """True while every known model's circuit is open, i.e. nothing can be routed"""
+        with self._lock:
+            breakers = [breaker for breaker, _, _ in self._models.values()]
+        return all(breaker.is_open for breaker in breakers)
+
+    @property
+    def retry_in(self):
+        """Seconds until the first model's circuit lets a call through again"""
+        with self._lock:
+            breakers = [breaker for breaker, _, _ in self._models.values()]
+        return min(breaker.retry_in for breaker in breakers)
+
+    def preferred_model(self, task_config, estimated_tokens):
+        """The model a task should run on when nothing is saturated
+
+        Returns:
+            tuple: (model name, reason)
+        """
+        task_config = task_config or {}
+        ai_model = task_config.get("ai_model") or {}
+        if ai_model.get("model_name"):
+            return ai_model["model_name"], "task config AiModel"
+
+        content_length = task_config.get("content_length") or "medium"
+        difficulty = task_config.get("difficulty_level") or "intermediate"
+        weight = CONTENT_LENGTH_WEIGHT.get(content_length, 1) + DIFFICULTY_WEIGHT.get(difficulty, 1)
+        if weight >= 3 and estimated_tokens <= self.large_max_tokens:
+            return self.tiers["large"], f"{content_length}/{difficulty} task"
+        if weight <= 1 and estimated_tokens <= self.fast_max_tokens:
+            return self.tiers["fast"], f"{content_length}/{difficulty} task on a small input"
+        if weight >= 3:
+            return self.tiers["standard"], f"{content_length}/{difficulty} task, input too large for {self.tiers['large']}"
+        return self.tiers["standard"], f"{content_length}/{difficulty} task"
+
+    def fallback_chain(self, model_name):
+        """model_name followed by the models to try instead: only tiers at or below it"""
+        tier_models = [self.tiers[tier] for tier in TIER_ORDER]
+        if model_name in tier_models:
+            others = tier_models[tier_models.index(model_name) + 1:]
+        else:
+            # A model from the AiModel table that is not one of the tiers: only tiers
+            # that are known to cost no more than it; the fast tier when its price is unknown
+            prices = model_prices()
+            price = prices.get(model_name)
+            others = [
+                tier_model for tier_model in tier_models
+                if price is not None and tier_model in prices
+                and all(tier_price <= model_price for tier_price, model_price in zip(prices[tier_model], price))
+            ] or [self.tiers["fast"]]
+        return list(dict.fromkeys([model_name] + others))
+
+    def route(self, task_id, task_config, estimated_tokens, forced_model=None):
+        """Choose the model for a task
+
+        Args:
+            task_id: Only used for logging
+            task_config: The task's taskconfig row (with its embedded ai_model)
+            estimated_tokens: Pre-flight estimate of the prompt tokens
+            forced_model: A model the task must start from (e.g. a budget downgrade)
+
+        Returns:
+            ModelRoute, or None when every candidate's circuit is open
+        """
+        if forced_model:
+            preferred, reason = forced_model, "budget downgrade"
+        else:
+            preferred, reason = self.preferred_model(task_config, estimated_tokens)
+
+        skipped = []
+        waiting = None
+        for model_name in self.fallback_chain(preferred):
+            breaker, limiter, caller = self._model(model_name)
+            if breaker.is_open:
+                skipped.append(f"{model_name} (circuit open)")
+                continue
+            if limiter.saturated():
+                skipped.append(f"{model_name} (rate limited)")
+                waiting = waiting or model_name
+                continue
+            return self._log_route(task_id, task_config, estimated_tokens, ModelRoute(model_name, caller, preferred, reason, skipped))
+
+        if waiting:
+            # Every healthy model is at its rate limit: queue on the first one rather than fail
+            route = ModelRoute(waiting, self._model(waiting)[2], preferred, reason, skipped)
+            return self._log_route(task_id, task_config, estimated_tokens, route)
+        self.logger.warning(f"No model available for task {task_id}: skipped {', '.join(skipped)}")
+        return None
+
+    def _log_route(self, task_id, task_config, estimated_tokens, route):
+        task_config = task_config or {}
+        self.logger.info(
+            f"Model route for task {task_id}: {route.model_name} (preferred {route.preferred}: {route.reason}; "
+            f"~{estimated_tokens} input tokens, content_length={task_config.get('content_length')}, "
+            f"difficulty={task_config.get('difficulty_level')}"
+            + (f"; skipped {', '.join(route.skipped)}" if route.skipped else "") + ")"
+        )
+        return route
@@ -0,0 +1,166 @@
+import os
+import time
+import random
+import hashlib
+import threading
+import requests
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from .logger import Logger
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+# Resend accepts at most 100 emails per batch request, and none of them may have attachments
+RESEND_BATCH_LIMIT = 100
+
+
+class OutboxSender:
+    """Delivers queued task emails from the notification_outbox table through Resend.
+
+    Rows are claimed in batches with a lease so several senders can run side by
+    side. Emails without attachments go out through the batch endpoint, the rest
+    one by one. Every request carries an idempotency key derived from the task,
+    so a retry after a lost response does not email the user twice. Rate limits
+    (429) are retried after Retry-After, server and network errors with jittered
+    exponential backoff; other client errors fail the row immediately.
+    """
+
+    def __init__(self, logger, db_service, worker_id=None, api_key=None, api_url=None,
+                 batch_size=None, lease_seconds=None, max_attempts=None, backoff_seconds=None, poll_interval=None):
+        self.logger = logger
+        self.db_service = db_service
+        self.worker_id = worker_id or os.environ.get("WORKER_ID", f"outbox-{os.getpid()}")
+        self.api_key = api_key or os.environ.get("RESEND_API_KEY")
+        self.api_url = (api_url or os.environ.get("RESEND_API_URL", "https://api.resend.com")).rstrip("/")
+        self.batch_size = batch_size or int(os.environ.get("OUTBOX_BATCH_SIZE", 50))
+        self.lease_seconds = lease_seconds or int(os.environ.get("OUTBOX_LEASE_SECONDS", 120))
+        self.max_attempts = max_attempts or int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 5))
+        self.backoff_seconds = backoff_seconds or float(os.environ.get("OUTBOX_BACKOFF_SECONDS", 30))
+        self.poll_interval = poll_interval or float(os.environ.get("OUTBOX_POLL_INTERVAL", 10))
+        self.timeout = float(os.environ.get("RESEND_TIMEOUT", 30))
+        self.session = requests.Session()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _headers(self, idempotency_key):
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+            "Idempotency-Key": idempotency_key
+        }
+
+    def drain(self):
+        """Claim one batch of due notifications and try to deliver it
+
+        Returns:
+            dict: Counts of claimed, sent, retried and failed notifications
+        """
+        rows = self.db_service.claim_notifications(self.worker_id, self.batch_size, self.lease_seconds)
+        stats = {"claimed": len(rows), "sent": 0, "retried": 0, "failed": 0}
+        if not rows:
+            return stats
+
+        with_attachments = [row for row in rows if row["payload"].get("attachments")]
+        plain = [row for row in rows if not row["payload"].get("attachments")]
+
+        for row in with_attachments:
+            self._deliver([row], stats)
+        for start in range(0, len(plain), RESEND_BATCH_LIMIT):
+            self._deliver(plain[start:start + RESEND_BATCH_LIMIT], stats)
+
+        self.logger.info(
+            f"Outbox drain: {stats['sent']} sent, {stats['retried']} retried, {stats['failed']} failed "
+            f"of {stats['claimed']} claimed"
+        )
+        return stats
+
+    def _deliver(self, rows, stats):
+        if len(rows) == 1:
+            url = f"{self.api_url}/emails"
+            body = rows[0]["payload"]
+            idempotency_key = f"task-output/{rows[0]['task_id']}"
+        else:
+            url = f"{self.api_url}/emails/batch"
+            body = [row["payload"] for row in rows]
+            task_ids = ",".join(sorted(str(row["task_id"]) for row in rows))
+            idempotency_key = f"task-output-batch/{hashlib.sha256(task_ids.encode('utf-8')).hexdigest()}"
+
+        try:
+            response = self.session.post(url, json=body, headers=self._headers(idempotency_key), timeout=self.timeout)
+        except requests.RequestException as e:
+            self._record_failure(rows, f"Network error: {str(e)}", stats)
+            return
+
+        if 200 <= response.status_code < 300:
+            self.db_service.mark_notifications_sent([row["id"] for row in rows])
+            stats["sent"] += len(rows)
+            return
+
+        error = f"Resend returned {response.status_code}: {response.text[:500]}"
+        if response.status_code == 429:
+            self._record_failure(rows, error, stats, retry_after=self._retry_after(response))
+        elif response.status_code >= 500:
+            self._record_failure(rows, error, stats)
+        else:
+            self._record_failure(rows, error, stats, retryable=False)
+
+    def _record_failure(self, rows, error, stats, retry_after=None, retryable=True):
+        for row in rows:
+            attempts = row.get("attempts") or 1
+            if not retryable or attempts >= self.max_attempts:
+                self.logger.error(f"Giving up on email for task {row['task_id']} after {attempts} attempt(s): {error}")
+                self.db_service.reschedule_notification(row["id"], error)
+                stats["failed"] += 1
+            else:
+                delay = self._retry_delay(attempts, retry_after)
+                self.logger.warning(f"Email for task {row['task_id']} failed (attempt {attempts}), retrying in {delay:.0f}s: {error}")
+                self.db_service.reschedule_notification(row["id"], error, delay)
+                stats["retried"] += 1
+
+    def _retry_delay(self, attempts, retry_after=None):
+        """Retry-After when the server sent one, otherwise full-jitter exponential backoff"""
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, self.backoff_seconds * (2 ** (attempts - 1)))
+
+    @staticmethod
+    def _retry_after(response):
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+    def start(self):
+        """Drain the outbox in a background thread every poll_interval seconds"""
+        if self._thread and self._thread.is_alive():
+            return
+        if not self.api_key:
+            self.logger.warning("Outbox sender not started - missing Resend API key")
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-sender", daemon=True)
+        self._thread.start()
+        self.logger.info(f"Outbox sender {self.worker_id} started")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(self.poll_interval + self.timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                # Keep going while full batches come back, then wait for new work
+                while not self._stop.is_set() and self.drain()["claimed"] >= self.batch_size:
+                    pass
+            except Exception as e:
+                self.logger.error(f"Outbox drain failed: {str(e)}")
+            self._stop.wait(self.poll_interval)
@@ -0,0 +1,180 @@
+import os
+import json
+import threading
+
+
+class StreamWriter:
+    """Base class for writers that receive model output chunk by chunk.
+
+    Chunks are split into complete lines so subclasses only ever handle whole
+    lines; the trailing partial line is held back until more text arrives or
+    the writer is closed. Asterisks are stripped unless the writer renders
+    markdown itself (keep_markup).
+
+    Output goes to a temporary file next to output_path that is only renamed
+    to output_path by close(), so a failed or interrupted stream never leaves a
+    partial output file behind; abort() discards it.
+    """
+
+    keep_markup = False
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.temp_path = f"{output_path}.{os.getpid()}.{threading.get_ident()}.part"
+        self.bytes_written = 0
+        self._pending = ""
+
+    def write(self, chunk):
+        self.bytes_written += len(chunk.encode("utf-8"))
+        lines = (self._pending + chunk).split("\n")
+        self._pending = lines.pop()
+        for line in lines:
+            self._write_line(self._clean(line))
+
+    def close(self):
+        """Write what is left and move the finished file to output_path"""
+        try:
+            if self._pending:
+                self._write_line(self._clean(self._pending))
+                self._pending = ""
+            self._finish()
+        except Exception:
+            self.abort()
+            raise
+        os.replace(self.temp_path, self.output_path)
+        return self.output_path
+
+    def abort(self):
+        """Discard everything written so far"""
+        try:
+            self._discard()
+        finally:
+            if os.path.exists(self.temp_path):
+                os.remove(self.temp_path)
+
+    def _clean(self, line):
+        return line if self.keep_markup else line.replace("*", " ")
+
+    def _write_line(self, line):
+        raise NotImplementedError
+
+    def _finish(self):
+        pass
+
+    def _discard(self):
+        pass
+
+
+class TextStreamWriter(StreamWriter):
+    """Appends lines straight to a text file"""
+
+    def __init__(self, output_path):
+        super().__init__(output_path)
+        self._file = open(self.temp_path, "w", encoding="utf-8")
+        self._first_line = True
+
+    def _write_line(self, line):
+        if not self._first_line:
+            self._file.write("\n")
+        self._file.write(line)
+        self._first_line = False
+        self._file.flush()
+
+    def _finish(self):
+        self._file.close()
+
+    def _discard(self):
+        self._file.close()
+
+
+class DocxStreamWriter(StreamWriter):
+    """Adds a paragraph per non-empty line; the document is saved on close"""
+
+    def __init__(self, output_path):
+        super().__init__(output_path)
+        from docx import Document
+        self._document = Document()
+
+    def _write_line(self, line):
+        if line.strip():
+            self._document.add_paragraph(line)
+
+    def _finish(self):
+        self._document.save(self.temp_path)
+
+
+class PdfStreamWriter(StreamWriter):
+    """Feeds lines to a PdfRenderer as text arrives and lays out the PDF on close"""
+
+    keep_markup = True
+
+    def __init__(self, output_path):
+        super().__init__(output_path)
+        from .pdf_renderer import PdfRenderer
+        self._renderer = PdfRenderer()
+
+    def _write_line(self, line):
+        self._renderer.add_line(line)
+
+    def _finish(self):
+        self._renderer.render(self.temp_path)
+
+
+class SlideStreamWriter(StreamWriter):
+    """Renders each slide as soon as it is complete in the streamed JSON array.
+
+    If the stream does not end with a complete array (e.g. the output was cut
+    off), the full text is repaired on close and the remaining slides are added.
+    """
+
+    def __init__(self, output_path, presentation_builder):
+        super().__init__(output_path)
+        from .json_repair import StreamingArrayParser
+        self._builder = presentation_builder
+        self._deck = presentation_builder.new_deck()
+        self._parser = StreamingArrayParser()
+        self._parts = []
+
+    def write(self, chunk):
+        from .presentation_builder import normalize_slides
+        self.bytes_written += len(chunk.encode("utf-8"))
+        self._parts.append(chunk)
+        for slide in normalize_slides(self._parser.feed(chunk), skip_invalid=True):
+            self._deck.add(slide)
+
+    def _finish(self):
+        from .presentation_builder import normalize_slides, slide_items
+        if not self._parser.done or not self._parser.count:
+            from .json_repair import repair_json
+            text = "".join(self._parts)
+            self._builder.logger.warning(
+                f"Slide stream ended after {self._parser.count} complete slides, repairing the rest"
+            )
+            remaining = slide_items(json.loads(repair_json(text)))[self._parser.count:]
+            for slide in normalize_slides(remaining, skip_invalid=True):
+                self._deck.add(slide)
+        self._deck.save(self.temp_path)
+
+
+STREAM_WRITERS = {
+    "txt": TextStreamWriter,
+    "docx": DocxStreamWriter,
+    "pdf": PdfStreamWriter,
+}
+
+
+def create_stream_writer(output_type, output_path, presentation_builder=None):
+    """Get an incremental writer for output_type, or None if the type cannot be streamed
+
+    pptx output can only be streamed when a PresentationBuilder is given.
+    """
+    if output_type == "pptx" and presentation_builder is None:
+        return None
+    if output_type != "pptx" and output_type not in STREAM_WRITERS:
+        return None
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    if output_type == "pptx":
+        return SlideStreamWriter(output_path, presentation_builder)
+    return STREAM_WRITERS[output_type](output_path)
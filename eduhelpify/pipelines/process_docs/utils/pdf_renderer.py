@@ -0,0 +1,239 @@
+import os
+import re
+from functools import lru_cache
+from xml.sax.saxutils import escape
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Flowable
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*)$")
+BULLET_PATTERN = re.compile(r"^(\s*)[-*+]\s+(.*)$")
+NUMBERED_PATTERN = re.compile(r"^(\s*)(\d+)[.)]\s+(.*)$")
+BOLD_PATTERN = re.compile(r"\*\*(.+?)\*\*")
+CODE_PATTERN = re.compile(r"`([^`]+)`")
+
+# Consecutive plain lines are drawn as one block of at most this many lines
+MAX_BLOCK_LINES = 50
+
+
+@lru_cache(maxsize=1)
+def _font_names():
+    """Regular and bold font names, registering PDF_FONT_PATH (a TTF) once if set"""
+    font_path = os.environ.get("PDF_FONT_PATH")
+    if not font_path:
+        return "Helvetica", "Helvetica-Bold"
+
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    pdfmetrics.registerFont(TTFont("OutputFont", font_path))
+    bold_path = os.environ.get("PDF_BOLD_FONT_PATH")
+    if bold_path:
+        pdfmetrics.registerFont(TTFont("OutputFont-Bold", bold_path))
+        return "OutputFont", "OutputFont-Bold"
+    return "OutputFont", "OutputFont"
+
+
+@lru_cache(maxsize=1)
+def _styles():
+    """Paragraph styles, built once per process"""
+    regular, bold = _font_names()
+    sample = getSampleStyleSheet()
+    body = ParagraphStyle("OutputBody", parent=sample["Normal"], fontName=regular, spaceAfter=4)
+    styles = {
+        "body": body,
+        "bullet": ParagraphStyle("OutputBullet", parent=body, leftIndent=18, bulletIndent=6, spaceAfter=2),
+    }
+    for level, parent, size in ((1, "Heading1", 18), (2, "Heading2", 14), (3, "Heading3", 12)):
+        styles[f"h{level}"] = ParagraphStyle(
+            f"OutputHeading{level}", parent=sample[parent], fontName=bold, fontSize=size, leading=size * 1.2
+        )
+    return styles
+
+
+def has_inline_markup(text):
+    return "**" in text or "`" in text
+
+
+def format_inline(text):
+    """Escape text for reportlab markup and convert **bold** and `code` spans"""
+    text = escape(text)
+    text = BOLD_PATTERN.sub(r"<b>\1</b>", text)
+    text = CODE_PATTERN.sub(r'<font name="Courier">\1</font>', text)
+    # Leftover emphasis markers are dropped, as in the plain-text outputs
+    return text.replace("*", "")
+
+
+@lru_cache(maxsize=65536)
+def _word_width(word, font_name, font_size):
+    return stringWidth(word, font_name, font_size)
+
+
+def wrap_words(line, font_name, font_size, max_width):
+    """Greedy word wrap; word widths are cached since prose repeats the same words"""
+    words = line.split()
+    if not words:
+        return [""]
+    space = _word_width(" ", font_name, font_size)
+    lines = []
+    current = [words[0]]
+    current_width = _word_width(words[0], font_name, font_size)
+    for word in words[1:]:
+        word_width = _word_width(word, font_name, font_size)
+        if current_width + space + word_width <= max_width:
+            current.append(word)
+            current_width += space + word_width
+        else:
+            lines.append(" ".join(current))
+            current = [word]
+            current_width = word_width
+    lines.append(" ".join(current))
+    return lines
+
+
+class PlainTextBlock(Flowable):
+    """Lines without inline markup, word-wrapped and drawn straight onto the canvas.
+
+    Paragraph parses markup and breaks lines fragment by fragment; plain text
+    only needs a greedy word wrap, which is several times cheaper. Each source
+    line starts on a new output line.
+    """
+
+    def __init__(self, lines, style, bullet=None):
+        super().__init__()
+        self.lines = lines
+        self.style = style
+        self.bullet = bullet
+        self.spaceBefore = style.spaceBefore
+        self.spaceAfter = style.spaceAfter
+        self._wrapped = None
+        self.width = None
+
+    def wrap(self, availWidth, availHeight):
+        if self._wrapped is None or availWidth != self.width:
+            style = self.style
+            width = availWidth - style.leftIndent - style.rightIndent
+            self._wrapped = []
+            for line in self.lines:
+                self._wrapped.extend(wrap_words(line, style.fontName, style.fontSize, width))
+            self.width = availWidth
+        self.height = len(self._wrapped) * self.style.leading
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        if self._wrapped is None:
+            self.wrap(availWidth, availHeight)
+        fit = int(availHeight // self.style.leading)
+        if fit <= 0:
+            return []
+        if fit >= len(self._wrapped):
+            return [self]
+        first = PlainTextBlock(self._wrapped[:fit], self.style, self.bullet)
+        first.spaceAfter = 0
+        rest = PlainTextBlock(self._wrapped[fit:], self.style)
+        rest.spaceBefore = 0
+        return [first, rest]
+
+    def draw(self):
+        style = self.style
+        baseline = self.height - style.fontSize
+        text = self.canv.beginText(style.leftIndent, baseline)
+        text.setFont(style.fontName, style.fontSize, style.leading)
+        for line in self._wrapped:
+            text.textLine(line)
+        self.canv.drawText(text)
+        if self.bullet:
+            self.canv.setFont(style.fontName, style.fontSize)
+            self.canv.drawString(style.bulletIndent, baseline, self.bullet)
+
+
+class PdfRenderer:
+    """Turns markdown-ish model output into a PDF.
+
+    Lines can be added one at a time (for streaming) and the document is laid
+    out by render(). Headings (#, ##, ###...), bullet and numbered lists and
+    **bold**/`code` spans are recognised. Lines without inline markup take the
+    PlainTextBlock fast path; the rest are escaped and laid out by Paragraph.
+    """
+
+    def __init__(self):
+        self.styles = _styles()
+        self._story = []
+        self._block = []
+
+    def add_line(self, line):
+        stripped = line.strip()
+        if not stripped:
+            self._flush_block()
+            return
+
+        heading = HEADING_PATTERN.match(stripped)
+        if heading:
+            self._flush_block()
+            level = min(len(heading.group(1)), 3)
+            self._story.append(self._text_flowable([heading.group(2)], self.styles[f"h{level}"]))
+            return
+
+        bullet = BULLET_PATTERN.match(line)
+        numbered = None if bullet else NUMBERED_PATTERN.match(line)
+        if bullet or numbered:
+            self._flush_block()
+            if bullet:
+                indent, marker, text = bullet.group(1), "\u2022", bullet.group(2)
+            else:
+                indent, marker, text = numbered.group(1), f"{numbered.group(2)}.", numbered.group(3)
+            depth = len(indent.expandtabs(4)) // 2
+            style = self._bullet_style(depth)
+            self._story.append(self._text_flowable([text], style, marker))
+            return
+
+        if has_inline_markup(stripped):
+            self._flush_block()
+            self._story.append(Paragraph(format_inline(stripped), self.styles["body"]))
+            return
+
+        self._block.append(stripped.replace("*", ""))
+        if len(self._block) >= MAX_BLOCK_LINES:
+            self._flush_block()
+
+    def add_text(self, content):
+        for line in content.split("\n"):
+            self.add_line(line)
+
+    def render(self, output_path):
+        """Lay out everything added so far into output_path"""
+        self._flush_block()
+        SimpleDocTemplate(output_path, pagesize=letter).build(self._story)
+        return output_path
+
+    def _flush_block(self):
+        if self._block:
+            self._story.append(PlainTextBlock(self._block, self.styles["body"]))
+            self._block = []
+
+    @staticmethod
+    def _text_flowable(lines, style, bullet=None):
+        if any(has_inline_markup(line) for line in lines):
+            return Paragraph("<br/>".join(format_inline(line) for line in lines), style, bulletText=bullet)
+        return PlainTextBlock([line.replace("*", "") for line in lines], style, bullet)
+
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def _bullet_style(depth):
+        base = _styles()["bullet"]
+        if not depth:
+            return base
+        return ParagraphStyle(
+            f"OutputBullet{depth}", parent=base,
+            leftIndent=base.leftIndent + 14 * depth, bulletIndent=base.bulletIndent + 14 * depth
+        )
+
+
+def render_pdf(content, output_path):
+    """Render a whole response to a PDF file"""
+    renderer = PdfRenderer()
+    renderer.add_text(content)
+    return renderer.render(output_path)
@@ -0,0 +1,230 @@
+import os
+import re
+import json
+import time
+from io import BytesIO
+from functools import lru_cache
+from pydantic import BaseModel, ValidationError
+from .json_repair import repair_json
+from .logger import Logger
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+# Bullet markers the model sometimes leaves in front of content items
+BULLET_MARKER_PATTERN = re.compile(r"^([-*+•]|\d+[.)])\s+")
+
+
+class Slide(BaseModel):
+    title: str
+    content: list[str]
+
+
+def slide_items(slide_data):
+    """The raw slide entries of a parsed payload, in order
+
+    Accepts any of the shapes the model produces: a list of slides,
+    {"slides": [...]} or {"slides": {"1": {...}, ...}}.
+
+    Raises:
+        ValueError: If the payload has none of these shapes
+    """
+    if isinstance(slide_data, dict) and "slides" in slide_data:
+        slide_data = slide_data["slides"]
+    if isinstance(slide_data, dict):
+        slide_data = list(slide_data.values())
+    if not isinstance(slide_data, list):
+        raise ValueError("Slide data missing or in incorrect format")
+    return slide_data
+
+
+def normalize_slides(slide_data, skip_invalid=False):
+    """Validate a parsed presentation payload and return it as a list of Slide models
+
+    A string content is split into one item per line. With skip_invalid, slides
+    that do not validate (e.g. the cut-off last slide of a repaired response)
+    are dropped instead of failing the whole deck.
+
+    Raises:
+        ValueError: If the payload shape is wrong or a slide is invalid
+    """
+    slides = []
+    for index, item in enumerate(slide_items(slide_data)):
+        if isinstance(item, Slide):
+            slides.append(item)
+            continue
+        if isinstance(item, dict) and isinstance(item.get("content"), str):
+            item = {**item, "content": item["content"].splitlines()}
+        try:
+            slides.append(Slide.model_validate(item))
+        except ValidationError as e:
+            if not skip_invalid:
+                raise ValueError(f"Invalid slide {index + 1}: {e}") from e
+    return slides
+
+
+@lru_cache(maxsize=4)
+def _template_bytes(template_path):
+    """Read a .pptx template once per process; None means python-pptx's default template"""
+    if template_path is None:
+        from pptx import Presentation
+        buffer = BytesIO()
+        Presentation().save(buffer)
+        return buffer.getvalue()
+    with open(template_path, "rb") as f:
+        return f.read()
+
+
+class PresentationBuilder:
+    """Renders validated slides into a .pptx based on a cached template.
+
+    The template (PPTX_TEMPLATE_PATH, or python-pptx's default) is read from
+    disk once and every deck is opened from an in-memory copy of it. Slides that
+    ship with the template are removed. Content items become one bullet
+    paragraph each; slides with more than max_bullets items continue on extra
+    slides, and decks are capped at max_slides so huge payloads stay bounded.
+    """
+
+    def __init__(self, logger, template_path=None, max_slides=None, max_bullets=None):
+        self.logger = logger
+        self.template_path = template_path or os.environ.get("PPTX_TEMPLATE_PATH") or None
+        self.layout_name = os.environ.get("PPTX_CONTENT_LAYOUT", "Title and Content")
+        self.max_slides = max_slides or int(os.environ.get("PPTX_MAX_SLIDES", 300))
+        self.max_bullets = max_bullets or int(os.environ.get("PPTX_MAX_BULLETS_PER_SLIDE", 10))
+
+    def open_template(self):
+        """A fresh Presentation cloned from the cached template bytes"""
+        from pptx import Presentation
+        presentation = Presentation(BytesIO(_template_bytes(self.template_path)))
+        self._remove_slides(presentation)
+        return presentation
+
+    def load(self, slide_data):
+        """Parse (repairing near-valid JSON) and validate a payload
+
+        Returns:
+            list: Slide models
+        """
+        repaired = False
+        if isinstance(slide_data, str):
+            try:
+                slide_data = json.loads(slide_data)
+            except json.JSONDecodeError as e:
+                self.logger.warning(f"Slide JSON is invalid ({str(e)}), attempting repair")
+                slide_data = json.loads(repair_json(slide_data))
+                repaired = True
+        slides = normalize_slides(slide_data, skip_invalid=repaired)
+        if not slides:
+            raise ValueError("Slide data contains no slides")
+        return slides
+
+    def new_deck(self):
+        """An empty deck from the template that slides can be added to one at a time"""
+        presentation = self.open_template()
+        return SlideDeck(self, presentation, self._content_layout(presentation))
+
+    def build(self, slide_data, output_path):
+        """Validate slide_data and write the deck to output_path
+
+        Returns:
+            dict: Rendering statistics, see SlideDeck.save
+        """
+        deck = self.new_deck()
+        for slide in self.load(slide_data):
+            deck.add(slide)
+        return deck.save(output_path)
+
+    def _pages(self, items):
+        items = [item for item in items if item.strip()]
+        if not items:
+            return [[]]
+        return [items[start:start + self.max_bullets] for start in range(0, len(items), self.max_bullets)]
+
+    def _content_layout(self, presentation):
+        for layout in presentation.slide_layouts:
+            if layout.name == self.layout_name:
+                return layout
+        # python-pptx's default template and most themes put "Title and Content" second
+        return presentation.slide_layouts[1]
+
+    @staticmethod
+    def _add_slide(presentation, layout, title, items):
+        slide = presentation.slides.add_slide(layout)
+        if slide.shapes.title is not None:
+            slide.shapes.title.text = title
+
+        body = next((shape for shape in slide.placeholders if shape.placeholder_format.idx == 1), None)
+        if body is None or not items:
+            return slide
+
+        text_frame = body.text_frame
+        text_frame.word_wrap = True
+        for index, item in enumerate(items):
+            paragraph = text_frame.paragraphs[0] if index == 0 else text_frame.add_paragraph()
+            indent = len(item) - len(item.lstrip(" \t"))
+            paragraph.text = BULLET_MARKER_PATTERN.sub("", item.strip())
+            paragraph.level = min(indent // 2, 4)
+        return slide
+
+    @staticmethod
+    def _remove_slides(presentation):
+        slide_ids = presentation.slides._sldIdLst
+        for slide_id in list(slide_ids):
+            presentation.part.drop_rel(slide_id.rId)
+            slide_ids.remove(slide_id)
+
+
+class SlideDeck:
+    """A presentation being filled slide by slide, with per-slide timing"""
+
+    def __init__(self, builder, presentation, layout):
+        self.builder = builder
+        self.presentation = presentation
+        self.layout = layout
+        self.slide_count = 0
+        self.truncated = False
+        self._started = time.perf_counter()
+        self._render_seconds = 0.0
+        self._slowest = 0.0
+
+    def add(self, slide):
+        """Render one Slide (continuing on extra slides when it has many items)"""
+        for page, items in enumerate(self.builder._pages(slide.content)):
+            if self.slide_count >= self.builder.max_slides:
+                if not self.truncated:
+                    self.builder.logger.warning(f"Presentation truncated to {self.builder.max_slides} slides")
+                self.truncated = True
+                return
+            slide_started = time.perf_counter()
+            title = slide.title if page == 0 else f"{slide.title} (cont.)"
+            self.builder._add_slide(self.presentation, self.layout, title, items)
+            elapsed = time.perf_counter() - slide_started
+            self._render_seconds += elapsed
+            self._slowest = max(self._slowest, elapsed)
+            self.slide_count += 1
+
+    def save(self, output_path):
+        """Write the deck and log how long rendering took
+
+        Returns:
+            dict: slide_count, render_seconds, seconds_per_slide, slowest_slide_seconds,
+            save_seconds and total_seconds (which includes time spent waiting between slides)
+        """
+        if not self.slide_count:
+            raise ValueError("Slide data contains no slides")
+        save_started = time.perf_counter()
+        self.presentation.save(output_path)
+        stats = {
+            "slide_count": self.slide_count,
+            "render_seconds": round(self._render_seconds, 3),
+            "seconds_per_slide": round(self._render_seconds / self.slide_count, 4),
+            "slowest_slide_seconds": round(self._slowest, 4),
+            "save_seconds": round(time.perf_counter() - save_started, 3),
+            "total_seconds": round(time.perf_counter() - self._started, 3)
+        }
+        self.builder.logger.info(
+            f"Rendered {self.slide_count} slides in {stats['render_seconds']}s "
+            f"({stats['seconds_per_slide'] * 1000:.1f} ms/slide, slowest {stats['slowest_slide_seconds'] * 1000:.1f} ms), "
+            f"saved in {stats['save_seconds']}s"
+        )
+        return stats
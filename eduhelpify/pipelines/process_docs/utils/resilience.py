@@ -0,0 +1,277 @@
+import os
+import time
+import random
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from .logger import Logger
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+# HTTP statuses worth retrying: rate limited, server errors and gateway timeouts
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the model while the circuit breaker is open"""
+
+    def __init__(self, retry_in):
+        super().__init__(f"Model provider circuit is open, retry in {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+
+def error_status(error):
+    """HTTP status of a provider error, if it carries one"""
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_retryable(error):
+    """True for rate limits, server errors, timeouts and dropped connections"""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    status = error_status(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    # requests and google.api_core name their transient errors like this
+    return type(error).__name__ in {"ConnectionError", "Timeout", "ReadTimeout", "ServiceUnavailable", "DeadlineExceeded"}
+
+
+def retry_after_seconds(error):
+    """Delay requested by the provider through Retry-After or a RetryInfo detail, if any"""
+    value = getattr(error, "retry_after", None)
+    if value is None:
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        value = headers.get("Retry-After")
+    if value is None:
+        # gRPC errors from Gemini carry google.rpc.RetryInfo in their details
+        for detail in getattr(error, "details", None) or []:
+            delay = getattr(detail, "retry_delay", None)
+            if delay is not None:
+                return delay.seconds + delay.nanos / 1e9
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """Stops calls to a provider that keeps failing.
+
+    After failure_threshold consecutive retryable failures the circuit opens and
+    every call is refused for reset_timeout seconds. Then one trial call is let
+    through (half-open): success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, logger, name="gemini", failure_threshold=None, reset_timeout=None):
+        self.logger = logger
+        self.name = name
+        self.failure_threshold = failure_threshold or int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5))
+        self.reset_timeout = reset_timeout or float(os.environ.get("CIRCUIT_RESET_TIMEOUT", 60))
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        """True while calls are refused (the half-open trial window counts as closed)"""
+        return self.retry_in > 0
+
+    @property
+    def retry_in(self):
+        """Seconds until the circuit lets a trial call through"""
+        with self._lock:
+            if self._opened_at is None:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self):
+        """Whether a call may go ahead now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                self.logger.info(f"Circuit '{self.name}' closed again")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    self.logger.error(
+                        f"Circuit '{self.name}' opened after {self._failures} consecutive failures; "
+                        f"pausing calls for {self.reset_timeout:.0f}s"
+                    )
+                self._opened_at = time.monotonic()
+
+
+class RateLimiter:
+    """Token bucket of requests per minute, shared through SQLite by every worker on the host.
+
+    All threads and processes that use the same db_path draw from one bucket,
+    so the combined request rate stays under the provider's quota.
+    """
+
+    def __init__(self, logger, requests_per_minute=None, db_path=None, name="gemini"):
+        self.logger = logger
+        self.name = name
+        self.requests_per_minute = requests_per_minute or int(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", 1000))
+        store_location = os.environ.get("STORE_LOCATION", ".")
+        self.db_path = db_path or os.environ.get("RATE_LIMIT_DB", os.path.join(store_location, "rate_limit.db"))
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute(
+                "create table if not exists buckets (name text primary key, tokens real not null, updated_at real not null)"
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _take(self):
+        """Take a token if one is available; otherwise return how long to wait for one"""
+        rate = self.requests_per_minute / 60.0
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("begin immediate")
+            row = conn.execute("select tokens, updated_at from buckets where name = ?", (self.name,)).fetchone()
+            tokens = self.requests_per_minute if row is None else min(
+                self.requests_per_minute, row[0] + (now - row[1]) * rate
+            )
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            conn.execute(
+                "insert into buckets (name, tokens, updated_at) values (?, ?, ?) "
+                "on conflict(name) do update set tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (self.name, tokens, now),
+            )
+            conn.execute("commit")
+        return wait
+
+    def saturated(self):
+        """True when no request slot is free right now; unlike try_acquire this takes nothing"""
+        with self._connect() as conn:
+            row = conn.execute("select tokens, updated_at from buckets where name = ?", (self.name,)).fetchone()
+        if row is None:
+            return False
+        rate = self.requests_per_minute / 60.0
+        return min(self.requests_per_minute, row[0] + (time.time() - row[1]) * rate) < 1
+
+    def try_acquire(self):
+        """Take a request slot without waiting; False if the bucket is empty"""
+        return self._take() == 0
+
+    def acquire(self, timeout=None):
+        """Block until a request slot is available
+
+        Returns:
+            float: Seconds spent waiting
+
+        Raises:
+            TimeoutError: If no slot frees up within timeout seconds
+        """
+        started = time.monotonic()
+        while True:
+            wait = self._take()
+            if wait == 0:
+                waited = time.monotonic() - started
+                if waited > 1:
+                    self.logger.info(f"Rate limiter '{self.name}' delayed a call by {waited:.1f}s")
+                return waited
+            if timeout is not None and time.monotonic() - started + wait > timeout:
+                raise TimeoutError(f"Rate limit of {self.requests_per_minute}/min not available within {timeout}s")
+            time.sleep(wait)
+
+
+class ResilientCaller:
+    """Runs model calls with rate limiting, retries and a circuit breaker.
+
+    Retryable failures (429, 5xx, timeouts, dropped connections) are retried up
+    to max_attempts times with full-jitter exponential backoff, or after the
+    provider's Retry-After when it sends one. Other errors are raised at once.
+    """
+
+    def __init__(self, logger, breaker=None, limiter=None, max_attempts=None, base_delay=None, max_delay=None):
+        self.logger = logger
+        self.breaker = breaker
+        self.limiter = limiter
+        self.max_attempts = max_attempts or int(os.environ.get("GEMINI_MAX_ATTEMPTS", 4))
+        self.base_delay = base_delay or float(os.environ.get("GEMINI_RETRY_BASE_DELAY", 2))
+        self.max_delay = max_delay or float(os.environ.get("GEMINI_RETRY_MAX_DELAY", 60))
+
+    def backoff(self, attempt, retry_after=None):
+        """Delay before retry number ``attempt`` (1-based)"""
+        if retry_after is not None:
+            return min(retry_after, self.max_delay * 5)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def call(self, description, operation):
+        """Run operation() and return its result
+
+        Raises:
+            CircuitOpenError: If the breaker refuses the call
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            if self.breaker and not self.breaker.allow():
+                raise CircuitOpenError(self.breaker.retry_in)
+            if self.limiter:
+                self.limiter.acquire()
+
+            try:
+                result = operation()
+            except Exception as e:
+                if not is_retryable(e):
+                    # The provider answered; a bad request says nothing about its health
+                    if self.breaker:
+                        self.breaker.record_success()
+                    raise
+                if self.breaker:
+                    self.breaker.record_failure()
+                if attempt == self.max_attempts:
+                    self.logger.error(f"{description} failed after {attempt} attempts: {str(e)}")
+                    raise
+                delay = self.backoff(attempt, retry_after_seconds(e))
+                self.logger.warning(
+                    f"{description} failed (attempt {attempt}/{self.max_attempts}, status {error_status(e)}): "
+                    f"{str(e)}. Retrying in {delay:.1f}s"
+                )
+                time.sleep(delay)
+                continue
+
+            if self.breaker:
+                self.breaker.record_success()
+            return result
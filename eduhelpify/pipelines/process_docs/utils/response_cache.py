@@ -0,0 +1,98 @@
+import os
+import json
+import hashlib
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from .logger import Logger
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+
+class ResponseCache:
+    """SQLite cache of model responses for identical generation requests.
+
+    Entries expire after ``ttl_seconds`` and the least recently used ones are
+    evicted once the cache holds more than ``max_entries`` responses.
+    """
+
+    def __init__(self, logger, db_path=None, ttl_seconds=None, max_entries=None):
+        self.logger = logger
+        store_location = os.environ.get("STORE_LOCATION", ".")
+        self.db_path = db_path or os.environ.get("RESPONSE_CACHE_DB", os.path.join(store_location, "response_cache.db"))
+        self.ttl_seconds = ttl_seconds or int(os.environ.get("RESPONSE_CACHE_TTL", 7 * 24 * 3600))
+        self.max_entries = max_entries or int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 1000))
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                create table if not exists responses (
+                    cache_key text primary key,
+                    model_name text,
+                    response text not null,
+                    created_at real not null,
+                    last_used real not null
+                )
+                """
+            )
+            conn.execute("create index if not exists responses_last_used_idx on responses (last_used)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(input_hashes, system_prompt, user_prompt, model_name, generation_config, output_type):
+        """Build a cache key from everything that influences the generated output"""
+        payload = json.dumps({
+            "inputs": list(input_hashes),
+            "system_prompt": system_prompt,
+            "user_prompt": user_prompt,
+            "model_name": model_name,
+            "generation_config": generation_config,
+            "output_type": output_type
+        }, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, cache_key):
+        """Return the cached response text, or None on a miss or expired entry"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("select response, created_at from responses where cache_key = ?", (cache_key,)).fetchone()
+            if not row:
+                return None
+            if row["created_at"] + self.ttl_seconds < now:
+                conn.execute("delete from responses where cache_key = ?", (cache_key,))
+                return None
+            conn.execute("update responses set last_used = ? where cache_key = ?", (now, cache_key))
+        return row["response"]
+
+    def put(self, cache_key, response, model_name=None):
+        """Store a response and evict old entries beyond the size limit"""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "insert into responses (cache_key, model_name, response, created_at, last_used) values (?, ?, ?, ?, ?) "
+                "on conflict(cache_key) do update set response = excluded.response, "
+                "created_at = excluded.created_at, last_used = excluded.last_used",
+                (cache_key, model_name, response, now, now),
+            )
+            conn.execute("delete from responses where created_at < ?", (now - self.ttl_seconds,))
+            conn.execute(
+                "delete from responses where cache_key in ("
+                "select cache_key from responses order by last_used desc limit -1 offset ?)",
+                (self.max_entries,),
+            )
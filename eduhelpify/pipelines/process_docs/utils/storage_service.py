@@ -0,0 +1,181 @@
+import os
+import time
+import base64
+import mimetypes
+import requests
+from requests.adapters import HTTPAdapter
+from .logger import Logger
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+BUCKET_NAME = "eduhelpify"
+
+
+class StorageService:
+    def __init__(self, logger):
+        """Initialize Supabase Storage access with the service role key and a pooled session"""
+        self.logger = logger
+        self.supabase_url = os.environ.get("NEXT_PUBLIC_SUPABASE_URL")
+        self.service_role_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+        # Files above this size use the resumable (TUS) endpoint instead of a single POST
+        self.resumable_threshold = int(os.environ.get("RESUMABLE_UPLOAD_THRESHOLD", 6 * 1024 * 1024))
+        # Supabase requires 6 MB chunks for resumable uploads
+        self.resumable_chunk_size = int(os.environ.get("RESUMABLE_UPLOAD_CHUNK_SIZE", 6 * 1024 * 1024))
+        self.max_retries = int(os.environ.get("STORAGE_UPLOAD_RETRIES", 3))
+        self.backoff_seconds = float(os.environ.get("STORAGE_UPLOAD_BACKOFF", 1))
+        self.timeout = float(os.environ.get("STORAGE_UPLOAD_TIMEOUT", 300))
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=10)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @property
+    def configured(self):
+        return bool(self.supabase_url and self.service_role_key)
+
+    def _auth_headers(self):
+        return {
+            "Authorization": f"Bearer {self.service_role_key}",
+            "apikey": self.service_role_key
+        }
+
+    def public_url(self, object_path):
+        return f"{self.supabase_url}/storage/v1/object/public/{BUCKET_NAME}/{object_path}"
+
+    def _with_retries(self, description, operation):
+        """Run operation(), retrying with exponential backoff"""
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                return operation()
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff_seconds * (2 ** (attempt - 1))
+                self.logger.warning(f"{description} failed (attempt {attempt}/{self.max_retries}): {str(e)}. Retrying in {delay}s")
+                time.sleep(delay)
+
+    def upload_file(self, local_path, object_path, content_type=None):
+        """Upload a local file to the bucket, streaming it from disk
+
+        Args:
+            local_path: File to upload
+            object_path: Destination path inside the bucket (e.g. task/output_<id>.pdf)
+            content_type: Mime type; guessed from the file name when omitted
+
+        Returns:
+            dict: public_url, size_bytes, seconds, throughput_bytes_per_second and method
+        """
+        content_type = content_type or mimetypes.guess_type(local_path)[0] or "application/octet-stream"
+        size = os.path.getsize(local_path)
+        started = time.monotonic()
+
+        if size > self.resumable_threshold:
+            method = "resumable"
+            self._upload_resumable(local_path, object_path, content_type, size)
+        else:
+            method = "single"
+            self._with_retries(f"Upload of {object_path}", lambda: self._upload_single(local_path, object_path, content_type, size))
+
+        seconds = max(time.monotonic() - started, 1e-6)
+        stats = {
+            "public_url": self.public_url(object_path),
+            "size_bytes": size,
+            "seconds": round(seconds, 3),
+            "throughput_bytes_per_second": round(size / seconds),
+            "method": method
+        }
+        self.logger.info(
+            f"Uploaded {object_path} ({size} bytes, {method}) in {stats['seconds']}s "
+            f"at {stats['throughput_bytes_per_second'] / 1024:.0f} KiB/s"
+        )
+        return stats
+
+    def _upload_single(self, local_path, object_path, content_type, size):
+        api_endpoint = f"{self.supabase_url}/storage/v1/object/{BUCKET_NAME}/{object_path}"
+        headers = {
+            **self._auth_headers(),
+            "Content-Type": content_type,
+            "Content-Length": str(size),
+            "x-upsert": "true"
+        }
+        # Passing the file object makes requests stream it instead of reading it into memory
+        with open(local_path, "rb") as file_content:
+            response = self.session.post(api_endpoint, data=file_content, headers=headers, timeout=self.timeout)
+        response.raise_for_status()
+
+    def _upload_resumable(self, local_path, object_path, content_type, size):
+        """Upload with the TUS protocol, resuming from the server's offset after a failed chunk"""
+        endpoint = f"{self.supabase_url}/storage/v1/upload/resumable"
+        tus_headers = {**self._auth_headers(), "Tus-Resumable": "1.0.0"}
+
+        def _encode(value):
+            return base64.b64encode(value.encode("utf-8")).decode("ascii")
+
+        def _create():
+            response = self.session.post(endpoint, headers={
+                **tus_headers,
+                "Upload-Length": str(size),
+                "Upload-Metadata": ",".join([
+                    f"bucketName {_encode(BUCKET_NAME)}",
+                    f"objectName {_encode(object_path)}",
+                    f"contentType {_encode(content_type)}",
+                    f"cacheControl {_encode('3600')}"
+                ]),
+                "x-upsert": "true"
+            }, timeout=self.timeout)
+            response.raise_for_status()
+            return response.headers["Location"]
+
+        upload_url = self._with_retries(f"Creating resumable upload for {object_path}", _create)
+
+        offset = 0
+        failures = 0
+        with open(local_path, "rb") as file_content:
+            while offset < size:
+                file_content.seek(offset)
+                chunk = file_content.read(self.resumable_chunk_size)
+                try:
+                    response = self.session.patch(upload_url, data=chunk, headers={
+                        **tus_headers,
+                        "Upload-Offset": str(offset),
+                        "Content-Type": "application/offset+octet-stream"
+                    }, timeout=self.timeout)
+                    response.raise_for_status()
+                    offset = int(response.headers.get("Upload-Offset", offset + len(chunk)))
+                    failures = 0
+                except Exception as e:
+                    failures += 1
+                    if failures >= self.max_retries:
+                        raise
+                    delay = self.backoff_seconds * (2 ** (failures - 1))
+                    self.logger.warning(f"Chunk at offset {offset} of {object_path} failed: {str(e)}. Resuming in {delay}s")
+                    time.sleep(delay)
+                    # Ask the server how much it actually received before resending
+                    head = self.session.head(upload_url, headers=tus_headers, timeout=self.timeout)
+                    head.raise_for_status()
+                    offset = int(head.headers.get("Upload-Offset", offset))
+
+    def create_signed_url(self, object_path, expires_in=None):
+        """Create a time-limited download link for an object in the bucket
+
+        Args:
+            object_path: Path inside the bucket
+            expires_in: Lifetime of the link in seconds (SIGNED_URL_EXPIRY, default 7 days)
+
+        Returns:
+            str: The absolute signed URL
+        """
+        expires_in = expires_in or int(os.environ.get("SIGNED_URL_EXPIRY", 7 * 24 * 3600))
+        api_endpoint = f"{self.supabase_url}/storage/v1/object/sign/{BUCKET_NAME}/{object_path}"
+        response = self._with_retries(
+            f"Signing {object_path}",
+            lambda: self._post_json(api_endpoint, {"expiresIn": expires_in})
+        )
+        return f"{self.supabase_url}/storage/v1{response['signedURL']}"
+
+    def _post_json(self, url, payload):
+        response = self.session.post(url, json=payload, headers=self._auth_headers(), timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
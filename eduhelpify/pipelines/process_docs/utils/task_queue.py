@@ -0,0 +1,383 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from datetime import datetime
+from .logger import Logger
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+# Upper bound on tasks run in parallel by one /process_queue drain
+PROCESS_QUEUE_MAX_WORKERS = int(os.environ.get("PROCESS_QUEUE_MAX_WORKERS", 4))
+
+
+class TaskQueue:
+    """Persistent FIFO of task ids backed by a local SQLite file.
+
+    Jobs survive process restarts: anything still marked ``running`` when the
+    queue is opened again was interrupted and is put back to ``pending``.
+    """
+
+    def __init__(self, logger, db_path=None, max_attempts=None):
+        self.logger = logger
+        store_location = os.environ.get("STORE_LOCATION", ".")
+        self.db_path = db_path or os.environ.get("TASK_QUEUE_DB", os.path.join(store_location, "task_queue.db"))
+        self.max_attempts = max_attempts or int(os.environ.get("TASK_QUEUE_MAX_ATTEMPTS", 3))
+        self._lock = threading.Lock()
+
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                create table if not exists jobs (
+                    id integer primary key autoincrement,
+                    task_id text not null,
+                    status text not null default 'pending',
+                    attempts integer not null default 0,
+                    worker_id text,
+                    error text,
+                    created_at text not null,
+                    updated_at text not null
+                )
+                """
+            )
+            conn.execute("create index if not exists jobs_status_idx on jobs (status, id)")
+
+        recovered = self.requeue_running()
+        self.logger.info(f"TaskQueue initialized at {self.db_path} ({recovered} interrupted jobs requeued)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("pragma journal_mode=wal")
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _now():
+        return datetime.utcnow().isoformat()
+
+    def enqueue(self, task_id):
+        """Add a task to the queue unless it is already pending or running.
+
+        Returns:
+            dict: The queued job row
+        """
+        with self._lock, self._connect() as conn:
+            conn.execute("begin immediate")
+            existing = conn.execute(
+                "select * from jobs where task_id = ? and status in ('pending', 'running') order by id limit 1",
+                (task_id,),
+            ).fetchone()
+            if existing:
+                conn.execute("commit")
+                self.logger.info(f"Task {task_id} already queued as job {existing['id']}")
+                return dict(existing)
+
+            now = self._now()
+            cursor = conn.execute(
+                "insert into jobs (task_id, status, created_at, updated_at) values (?, 'pending', ?, ?)",
+                (task_id, now, now),
+            )
+            job = conn.execute("select * from jobs where id = ?", (cursor.lastrowid,)).fetchone()
+            conn.execute("commit")
+            self.logger.info(f"Enqueued task {task_id} as job {job['id']}")
+            return dict(job)
+
+    def dequeue(self, worker_id):
+        """Atomically take the oldest pending job and mark it running"""
+        with self._lock, self._connect() as conn:
+            conn.execute("begin immediate")
+            job = conn.execute("select * from jobs where status = 'pending' order by id limit 1").fetchone()
+            if not job:
+                conn.execute("commit")
+                return None
+            conn.execute(
+                "update jobs set status = 'running', attempts = attempts + 1, worker_id = ?, updated_at = ? where id = ?",
+                (worker_id, self._now(), job["id"]),
+            )
+            job = conn.execute("select * from jobs where id = ?", (job["id"],)).fetchone()
+            conn.execute("commit")
+            return dict(job)
+
+    def complete(self, job_id):
+        """Mark a job as done"""
+        self._set_status(job_id, "done")
+
+    def fail(self, job_id, error):
+        """Mark a job as failed and record the error"""
+        self._set_status(job_id, "failed", error)
+
+    def skip(self, job_id, reason):
+        """Mark a job as skipped because its task could not be claimed"""
+        self._set_status(job_id, "skipped", reason)
+
+    def release(self, job_id, error=None):
+        """Put a running job back in the queue without counting the attempt"""
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "update jobs set status = 'pending', attempts = max(attempts - 1, 0), worker_id = null, "
+                "error = ?, updated_at = ? where id = ?",
+                (error, self._now(), job_id),
+            )
+
+    def _set_status(self, job_id, status, error=None):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "update jobs set status = ?, error = ?, updated_at = ? where id = ?",
+                (status, error, self._now(), job_id),
+            )
+
+    def requeue_running(self):
+        """Put jobs interrupted by a restart back in the queue, giving up after max_attempts"""
+        with self._lock, self._connect() as conn:
+            conn.execute("begin immediate")
+            now = self._now()
+            conn.execute(
+                "update jobs set status = 'failed', error = 'Exceeded max attempts', updated_at = ? "
+                "where status = 'running' and attempts >= ?",
+                (now, self.max_attempts),
+            )
+            cursor = conn.execute(
+                "update jobs set status = 'pending', worker_id = null, updated_at = ? where status = 'running'",
+                (now,),
+            )
+            conn.execute("commit")
+            return cursor.rowcount
+
+    def get_job(self, task_id):
+        """Get the most recent job for a task"""
+        with self._connect() as conn:
+            job = conn.execute("select * from jobs where task_id = ? order by id desc limit 1", (task_id,)).fetchone()
+        return dict(job) if job else None
+
+    def stats(self):
+        """Count jobs per status"""
+        with self._connect() as conn:
+            rows = conn.execute("select status, count(*) as total from jobs group by status").fetchall()
+        return {row["status"]: row["total"] for row in rows}
+
+
+class TaskWorkerPool:
+    """Background threads that drain a TaskQueue with a bounded concurrency.
+
+    While paused() returns True (e.g. the model circuit breaker is open) workers
+    take no new jobs, and jobs that end with HTTP 503 are put back in the queue.
+    Jobs that end with HTTP 409 (the task was claimed elsewhere) are skipped.
+    """
+
+    def __init__(self, logger, queue, handler, concurrency=None, poll_interval=None, paused=None):
+        self.logger = logger
+        self.queue = queue
+        self.handler = handler
+        self.paused = paused
+        self.concurrency = concurrency or int(os.environ.get("TASK_WORKERS", 2))
+        self.poll_interval = poll_interval or float(os.environ.get("TASK_QUEUE_POLL_INTERVAL", 2))
+        self.worker_prefix = f"{socket.gethostname()}-{os.getpid()}"
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+        self._start_lock = threading.Lock()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def start(self):
+        """Start the worker threads; calling it again is a no-op"""
+        with self._start_lock:
+            if self.running:
+                return
+            self._stop.clear()
+            self._threads = []
+            for index in range(self.concurrency):
+                thread = threading.Thread(
+                    target=self._run,
+                    args=(f"{self.worker_prefix}-{index}",),
+                    name=f"task-worker-{index}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+            self.logger.info(f"Started {self.concurrency} task workers")
+
+    def stop(self, timeout=None):
+        """Signal workers to exit after their current job"""
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def notify(self):
+        """Wake idle workers because new work was enqueued"""
+        self._wakeup.set()
+
+    def _run(self, worker_id):
+        while not self._stop.is_set():
+            if self.paused and self.paused():
+                self._stop.wait(self.poll_interval)
+                continue
+            job = self.queue.dequeue(worker_id)
+            if not job:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+
+            task_id = job["task_id"]
+            started = time.monotonic()
+            self.logger.info(f"Worker {worker_id} picked up task {task_id} (job {job['id']}, attempt {job['attempts']})")
+            try:
+                result, status_code = self.handler(task_id)
+                if status_code < 400:
+                    self.queue.complete(job["id"])
+                elif status_code == 409:
+                    self.queue.skip(job["id"], result.get("message"))
+                elif status_code == 503:
+                    self.queue.release(job["id"], result.get("message"))
+                else:
+                    self.queue.fail(job["id"], result.get("message"))
+                self.logger.info(
+                    f"Worker {worker_id} finished task {task_id} with status {status_code} "
+                    f"in {time.monotonic() - started:.1f}s"
+                )
+            except Exception as e:
+                self.logger.error(f"Worker {worker_id} crashed on task {task_id}: {str(e)}")
+                self.queue.fail(job["id"], str(e))
+
+
+class TaskLeaseKeeper:
+    """Periodically renews the database lease on tasks this process is working on.
+
+    Tasks whose lease lapses (because the process died) can be claimed again by
+    another replica, so the keeper renews well before expiry.
+    """
+
+    def __init__(self, logger, db_service, worker_id, lease_seconds=None):
+        self.logger = logger
+        self.db_service = db_service
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds or int(os.environ.get("TASK_LEASE_SECONDS", 300))
+        self.renew_interval = max(1, self.lease_seconds / 3)
+        self._task_ids = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, task_id):
+        with self._lock:
+            self._task_ids.add(task_id)
+            if not self._thread or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="task-lease-keeper", daemon=True)
+                self._thread.start()
+
+    def remove(self, task_id):
+        with self._lock:
+            self._task_ids.discard(task_id)
+
+    def _run(self):
+        while True:
+            time.sleep(self.renew_interval)
+            with self._lock:
+                task_ids = list(self._task_ids)
+                if not task_ids:
+                    # Cleared under the lock, so add() starts a new keeper instead of relying on this one
+                    self._thread = None
+                    return
+            try:
+                owned = {str(task_id) for task_id in self.db_service.renew_task_leases(self.worker_id, task_ids, self.lease_seconds)}
+                lost = [task_id for task_id in task_ids if str(task_id) not in owned]
+                if lost:
+                    self.logger.warning(f"Worker {self.worker_id} no longer holds the lease on tasks: {lost}")
+            except Exception as e:
+                self.logger.error(f"Error renewing task leases: {str(e)}")
+
+
+def _summary_status(status_code):
+    """Summary status of a finished task; 503 means it was put back in the queue, not that it failed"""
+    if status_code < 400:
+        return "success"
+    if status_code == 503:
+        return "requeued"
+    return "error"
+
+
+def drain_tasks(logger, handler, task_ids, max_workers=None, task_timeout=None, on_timeout=None):
+    """Run handler(task_id) for many tasks with a bounded number in flight.
+
+    Each task gets its own timeout measured from the moment a worker starts it.
+    Python threads cannot be killed, so a timed-out task keeps running in the
+    background; it is reported as ``timeout`` and on_timeout(task_id) is called
+    so the caller can give up its claim on the task.
+
+    A handler result of HTTP 503 means the task was released back to the queue
+    (e.g. the model provider is unavailable) and is reported as ``requeued``.
+
+    Returns:
+        list: One summary dict per task, in the order of task_ids
+    """
+    max_workers = max_workers or PROCESS_QUEUE_MAX_WORKERS
+    task_timeout = task_timeout or float(os.environ.get("PROCESS_QUEUE_TASK_TIMEOUT", 1800))
+    started = {}
+    results = {}
+
+    def _run(task_id):
+        started[task_id] = time.monotonic()
+        return handler(task_id)
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="queue-drain")
+    futures = {executor.submit(_run, task_id): task_id for task_id in task_ids}
+    pending = set(futures)
+    logger.info(f"Draining {len(task_ids)} tasks with {max_workers} workers (timeout {task_timeout}s per task)")
+
+    while pending:
+        done, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+        now = time.monotonic()
+
+        for future in done:
+            task_id = futures[future]
+            duration = round(now - started.get(task_id, now), 2)
+            try:
+                payload, status_code = future.result()
+                results[task_id] = {
+                    "task_id": task_id,
+                    "status": _summary_status(status_code),
+                    "http_status": status_code,
+                    "message": payload.get("message"),
+                    "duration_seconds": duration
+                }
+            except Exception as e:
+                logger.error(f"Task {task_id} raised during queue drain: {str(e)}")
+                results[task_id] = {
+                    "task_id": task_id,
+                    "status": "error",
+                    "http_status": 500,
+                    "message": str(e),
+                    "duration_seconds": duration
+                }
+
+        for future in list(pending):
+            task_id = futures[future]
+            if task_id in started and now - started[task_id] > task_timeout:
+                logger.warning(f"Task {task_id} exceeded {task_timeout}s, leaving it to finish in the background")
+                pending.discard(future)
+                if on_timeout:
+                    on_timeout(task_id)
+                results[task_id] = {
+                    "task_id": task_id,
+                    "status": "timeout",
+                    "http_status": 504,
+                    "message": f"Task did not finish within {task_timeout} seconds",
+                    "duration_seconds": round(now - started[task_id], 2)
+                }
+
+    executor.shutdown(wait=False)
+    return [results[task_id] for task_id in task_ids]
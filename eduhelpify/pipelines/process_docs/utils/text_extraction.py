@@ -0,0 +1,345 @@
+import os
+import atexit
+import signal
+import multiprocessing
+import threading
+from .file_cache import file_sha256
+from .logger import Logger
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+EXTRACTABLE_EXTENSIONS = {".pdf", ".docx", ".pptx"}
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".bmp", ".tif", ".tiff", ".webp"}
+
+# Gemini bills every PDF page and image as this many tokens, on top of any text it extracts
+TOKENS_PER_PAGE_IMAGE = 258
+CHARS_PER_TOKEN = 4
+
+# What each extracted unit is called in the text sent to the model
+UNIT_NAMES = {".pdf": "Page", ".pptx": "Slide", ".docx": "Section"}
+
+
+def _extract_pdf(path):
+    from pypdf import PdfReader
+    return [page.extract_text() or "" for page in PdfReader(path).pages]
+
+
+def _extract_docx(path):
+    """One unit per heading-delimited section, tables included"""
+    from docx import Document
+
+    document = Document(path)
+    sections = [[]]
+    for paragraph in document.paragraphs:
+        style_name = paragraph.style.name if paragraph.style is not None else ""
+        if style_name.startswith("Heading") and sections[-1]:
+            sections.append([])
+        if paragraph.text.strip():
+            sections[-1].append(paragraph.text)
+    for table in document.tables:
+        rows = [" | ".join(cell.text.strip() for cell in row.cells) for row in table.rows]
+        sections[-1].append("\n".join(rows))
+    return ["\n".join(section) for section in sections if section]
+
+
+def _extract_pptx(path):
+    from pptx import Presentation
+
+    slides = []
+    for slide in Presentation(path).slides:
+        parts = []
+        for shape in slide.shapes:
+            if shape.has_text_frame and shape.text_frame.text.strip():
+                parts.append(shape.text_frame.text)
+            elif getattr(shape, "has_table", False) and shape.has_table:
+                parts.extend(" | ".join(cell.text for cell in row.cells) for row in shape.table.rows)
+        if slide.has_notes_slide and slide.notes_slide.notes_text_frame.text.strip():
+            parts.append(f"Notes: {slide.notes_slide.notes_text_frame.text}")
+        slides.append("\n".join(parts))
+    return slides
+
+
+def _ocr(path):
+    """OCR a scanned PDF or image; None when pytesseract (or pdf2image for PDFs) is not installed"""
+    try:
+        import pytesseract
+    except ImportError:
+        return None
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".pdf":
+        try:
+            from pdf2image import convert_from_path
+        except ImportError:
+            return None
+        language = os.environ.get("OCR_LANGUAGE", "eng")
+        dpi = int(os.environ.get("OCR_DPI", 200))
+        pages = []
+        from pypdf import PdfReader
+        # One page at a time keeps memory flat for long scans
+        page_count = len(PdfReader(path).pages)
+        for page_number in range(1, page_count + 1):
+            image = convert_from_path(path, dpi=dpi, first_page=page_number, last_page=page_number)[0]
+            pages.append(pytesseract.image_to_string(image, lang=language))
+        return pages
+
+    from PIL import Image
+    with Image.open(path) as image:
+        return [pytesseract.image_to_string(image, lang=os.environ.get("OCR_LANGUAGE", "eng"))]
+
+
+def extract_file(path, need_ocr=False):
+    """Extract the text of one file, page by page (runs in a worker process)
+
+    Returns:
+        dict: path, method ("text", "ocr" or None when nothing could be extracted) and pages
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if need_ocr and (extension == ".pdf" or extension in IMAGE_EXTENSIONS):
+        pages = _ocr(path)
+        return {"path": path, "method": "ocr" if pages is not None else None, "pages": pages or []}
+
+    extractors = {".pdf": _extract_pdf, ".docx": _extract_docx, ".pptx": _extract_pptx}
+    if extension not in extractors:
+        return {"path": path, "method": None, "pages": []}
+    return {"path": path, "method": "text", "pages": extractors[extension](path)}
+
+
+def _extract_with_deadline(path, need_ocr, timeout):
+    """extract_file in a pool worker, interrupted after timeout seconds so a stuck file frees its worker"""
+    if not hasattr(signal, "SIGALRM"):
+        return extract_file(path, need_ocr)
+
+    def _expired(signum, frame):
+        raise TimeoutError(f"Extraction took longer than {timeout}s")
+
+    previous = signal.signal(signal.SIGALRM, _expired)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return extract_file(path, need_ocr)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+
+def format_pages(pages, unit="Page"):
+    """Join extracted pages with markers so the model can still cite page numbers
+
+    Args:
+        pages: Page texts, or (number, text) pairs when only some pages are sent
+    """
+    numbered = [page if isinstance(page, tuple) else (number, page) for number, page in enumerate(pages, start=1)]
+    return "\n\n".join(f"[{unit} {number}]\n{text.strip()}" for number, text in numbered)
+
+
+class TextExtractor:
+    """Pre-processing stage that replaces input files with their text when that is cheaper.
+
+    Text-based PDFs, DOCX and PPTX files are extracted in a pool of worker
+    processes; scanned PDFs and images are OCRed only when their filestore row
+    has need_ocr set. A file is replaced by its text when the estimated token
+    cost of the text is lower than sending the original (Gemini bills each PDF
+    page as an image on top of its text, and cannot read DOCX/PPTX at all).
+    PDFs with almost no text per page are treated as scans and sent as-is.
+
+    With a TextStore, extractions are kept per content hash: repeat tasks on
+    the same document skip extraction, and a focus_area narrows what is sent
+    to the matching pages. With a FocusRetriever, large inputs are narrowed
+    further to the chunks that best match the focus.
+
+    The worker processes are forked by start(), which must run before the
+    application starts any thread: a process forked while other threads hold
+    import or logging locks can hang forever. Every extraction is interrupted
+    inside its worker after timeout seconds, so a stuck file cannot keep a
+    worker busy.
+    """
+
+    def __init__(self, logger, max_workers=None, min_chars_per_page=None, timeout=None, text_store=None, retriever=None):
+        self.logger = logger
+        self.text_store = text_store
+        self.retriever = retriever
+        self.enabled = os.environ.get("TEXT_EXTRACTION", "true").lower() == "true"
+        self.max_workers = max_workers or int(os.environ.get("TEXT_EXTRACTION_WORKERS", min(4, os.cpu_count() or 1)))
+        self.min_chars_per_page = min_chars_per_page or int(os.environ.get("TEXT_MIN_CHARS_PER_PAGE", 200))
+        self.timeout = timeout or float(os.environ.get("TEXT_EXTRACTION_TIMEOUT", 300))
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def start(self):
+        """Fork the worker processes now; call this before any thread is started"""
+        with self._pool_lock:
+            if self._pool is None:
+                # fork where available: spawn would re-run process.py's module-level setup in
+                # every worker. multiprocessing.Pool forks all workers here, in the calling
+                # thread, unlike ProcessPoolExecutor which forks them lazily on submit.
+                start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn"
+                if start_method == "fork" and threading.active_count() > 1:
+                    self.logger.warning(f"Forking text extraction workers with {threading.active_count()} threads running")
+                self._pool = multiprocessing.get_context(start_method).Pool(processes=self.max_workers)
+                atexit.register(self.close)
+                self.logger.info(f"Started {self.max_workers} text extraction workers ({start_method})")
+            return self._pool
+
+    def _executor(self):
+        if self._pool is None:
+            self.logger.warning("Text extraction pool started lazily; call TextExtractor.start() before starting threads")
+        return self.start()
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+
+    def extract_all(self, jobs):
+        """Extract many files in parallel
+
+        Args:
+            jobs: List of (path, need_ocr) tuples
+
+        Returns:
+            list: extract_file results in job order; failed files get method None
+        """
+        if not jobs:
+            return []
+        pool = self._executor()
+        pending = [pool.apply_async(_extract_with_deadline, (path, need_ocr, self.timeout)) for path, need_ocr in jobs]
+        results = []
+        for (path, _), result in zip(jobs, pending):
+            try:
+                # The worker gives up after self.timeout; the margin covers queueing behind other jobs
+                results.append(result.get(timeout=self.timeout * len(jobs) + 5))
+            except Exception as e:
+                self.logger.warning(f"Text extraction failed for {path}: {str(e)}")
+                results.append({"path": path, "method": None, "pages": []})
+        return results
+
+    def should_use_text(self, path, result):
+        """Whether the extracted text is a good and cheaper substitute for the file"""
+        pages = result["pages"]
+        if not result["method"] or not pages:
+            return False
+        text_chars = sum(len(page.strip()) for page in pages)
+        extension = os.path.splitext(path)[1].lower()
+
+        if result["method"] == "text" and extension == ".pdf":
+            # A scan with a thin or missing text layer: the model has to see the images
+            if text_chars / len(pages) < self.min_chars_per_page:
+                return False
+            raw_tokens = len(pages) * TOKENS_PER_PAGE_IMAGE + text_chars // CHARS_PER_TOKEN
+        elif extension in IMAGE_EXTENSIONS:
+            if text_chars < self.min_chars_per_page:
+                return False
+            raw_tokens = TOKENS_PER_PAGE_IMAGE
+        else:
+            # OCRed PDFs are always cheaper as text; DOCX/PPTX cannot be sent raw
+            return text_chars > 0
+        return text_chars // CHARS_PER_TOKEN < raw_tokens
+
+    def _stored_result(self, path, sha256, need_ocr):
+        """A previous extraction of the same content, unless this task needs OCR it did not have"""
+        stored = self.text_store.get(sha256) if self.text_store else None
+        if not stored or (need_ocr and stored["method"] != "ocr"):
+            return None
+        with self.text_store.open(sha256) as paged:
+            pages = [text for _, text in paged.pages()]
+        return {"path": path, "method": stored["method"], "pages": pages}
+
+    def prepare(self, input_files, file_paths, work_dir, focus_area=None, user_prompt=None):
+        """Swap input files for extracted text where it pays off
+
+        Args:
+            input_files: filestore rows (for need_ocr), aligned with file_paths
+            file_paths: Local paths; None entries (failed downloads) are kept as None
+            work_dir: Where the .txt files are written
+            focus_area: Optional focus of the task; only matching pages (or, for
+                large inputs with a retriever, matching chunks) are sent
+            user_prompt: Extra query text for the retriever
+
+        Returns:
+            list: Paths to send to the model, in the same order; None for failed
+            downloads and for documents with nothing matching the focus
+        """
+        if not self.enabled:
+            return list(file_paths)
+
+        jobs = []
+        for file_data, path in zip(input_files, file_paths):
+            if not path:
+                continue
+            extension = os.path.splitext(path)[1].lower()
+            need_ocr = bool(file_data.get("need_ocr"))
+            if extension in EXTRACTABLE_EXTENSIONS or (need_ocr and extension in IMAGE_EXTENSIONS):
+                jobs.append((path, need_ocr))
+        if not jobs:
+            return list(file_paths)
+
+        hashes = {path: file_sha256(path) for path, _ in jobs} if self.text_store else {}
+        results = {}
+        pending = []
+        for path, need_ocr in jobs:
+            result = self._stored_result(path, hashes[path], need_ocr) if self.text_store else None
+            if result:
+                self.logger.info(f"Reusing stored {result['method']} extraction of {os.path.basename(path)}")
+                results[path] = result
+            else:
+                pending.append((path, need_ocr))
+
+        for result in self.extract_all(pending):
+            results[result["path"]] = result
+            if self.text_store and result["method"] and result["pages"]:
+                extension = os.path.splitext(result["path"])[1].lower()
+                self.text_store.put(
+                    hashes[result["path"]], result["method"], UNIT_NAMES.get(extension, "Page"), result["pages"]
+                )
+        ocr_paths = {path for path, need_ocr in jobs if need_ocr}
+        os.makedirs(work_dir, exist_ok=True)
+
+        # Numbered pages to send for every file that is replaced by its text
+        texts = {}
+        for path in dict.fromkeys(path for path in file_paths if path):
+            result = results.get(path)
+            if result and result["method"] is None and path in ocr_paths:
+                self.logger.warning(f"OCR unavailable for {os.path.basename(path)} (needs pytesseract, and pdf2image for PDFs); sending the original")
+            if result and self.should_use_text(path, result):
+                texts[path] = list(enumerate(result["pages"], start=1))
+
+        retrieved = None
+        if self.retriever and texts:
+            retrieved = self.retriever.select(
+                [(hashes.get(path, path), pages) for path, pages in texts.items()], focus_area, user_prompt
+            )
+        for path, pages in texts.items():
+            if retrieved is not None:
+                texts[path] = retrieved[hashes.get(path, path)]
+                continue
+            selected = self.text_store.select_pages(hashes[path], focus_area) if self.text_store else None
+            if selected:
+                self.logger.info(f"Focus area selects {len(selected)} of {len(pages)} units of {os.path.basename(path)}")
+                texts[path] = [pages[number - 1] for number in selected]
+
+        prepared = []
+        raw_bytes = 0
+        sent_bytes = 0
+        for path in file_paths:
+            if path not in texts:
+                prepared.append(path)
+                continue
+            if not texts[path]:
+                # Nothing in this document matched the focus
+                self.logger.info(f"Skipping {os.path.basename(path)}: no content matches the focus area")
+                prepared.append(None)
+                continue
+            base_name, extension = os.path.splitext(os.path.basename(path))
+            text_path = os.path.join(work_dir, f"{base_name}{extension.replace('.', '_')}.txt")
+            with open(text_path, "w", encoding="utf-8") as f:
+                f.write(format_pages(texts[path], UNIT_NAMES.get(extension.lower(), "Page")))
+            raw_bytes += os.path.getsize(path)
+            sent_bytes += os.path.getsize(text_path)
+            self.logger.info(f"Using {results[path]['method']} extraction of {os.path.basename(path)} ({len(texts[path])} units)")
+            prepared.append(text_path)
+
+        if raw_bytes:
+            self.logger.info(f"Text extraction replaced {raw_bytes} bytes of input with {sent_bytes} bytes of text")
+        return prepared
@@ -0,0 +1,257 @@
+import os
+import re
+import mmap
+import time
+import struct
+import sqlite3
+import threading
+from contextlib import contextmanager
+from .logger import Logger
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+# <sha256>.pages layout: magic, page count, page_count + 1 byte offsets into the UTF-8 text, text
+PAGES_MAGIC = b"EDTX1\0"
+HEADER_FORMAT = "<6sI"
+OFFSET_FORMAT = "<Q"
+OFFSET_SIZE = struct.calcsize(OFFSET_FORMAT)
+
+# Explicit ranges in a focus area, in the unit the document was stored in: "pages 12-18" for a PDF,
+# "slide 4" for a deck, "sections 2 to 3" for a Word document
+RANGE_PATTERNS = {
+    unit: re.compile(rf"\b(?:{words})\s*(\d+)(?:\s*(?:-|–|to)\s*(\d+))?", re.IGNORECASE)
+    for unit, words in {"Page": r"pages?|pp?\.", "Slide": r"slides?", "Section": r"sections?"}.items()
+}
+WORD_PATTERN = re.compile(r"\w+")
+FOCUS_STOPWORDS = {
+    "the", "and", "for", "with", "from", "that", "this", "about", "into", "only", "on", "of", "in",
+    "to", "a", "an", "focus", "chapter", "section", "part", "topic", "topics", "please", "mainly",
+}
+
+
+def focus_terms(focus_area):
+    """Lowercase search terms of a focus area, without stopwords and very short words"""
+    return sorted({
+        word for word in WORD_PATTERN.findall(focus_area.lower())
+        if len(word) > 2 and word not in FOCUS_STOPWORDS and not word.isdigit()
+    })
+
+
+def write_pages(path, pages):
+    """Write pages to path in the .pages format (atomically, via a temp file)"""
+    encoded = [page.encode("utf-8") for page in pages]
+    offsets = [0]
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(struct.pack(HEADER_FORMAT, PAGES_MAGIC, len(pages)))
+        f.write(struct.pack(f"<{len(offsets)}Q", *offsets))
+        for data in encoded:
+            f.write(data)
+    os.replace(tmp_path, path)
+    return offsets[-1]
+
+
+class PagedText:
+    """Read-only, memory-mapped view of a .pages file.
+
+    Only the pages that are read are paged in, so pulling a chapter out of a
+    long book costs the size of the chapter, not of the book.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else None
+        if self._map is None or self._map[:len(PAGES_MAGIC)] != PAGES_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not an extracted text file")
+        _, self.page_count = struct.unpack_from(HEADER_FORMAT, self._map, 0)
+        self._offsets_at = struct.calcsize(HEADER_FORMAT)
+        self._text_at = self._offsets_at + (self.page_count + 1) * OFFSET_SIZE
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.page_count
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _offset(self, index):
+        return struct.unpack_from(OFFSET_FORMAT, self._map, self._offsets_at + index * OFFSET_SIZE)[0]
+
+    def page(self, number):
+        """Text of a page, numbered from 1"""
+        if not 1 <= number <= self.page_count:
+            raise IndexError(f"Page {number} out of range 1-{self.page_count}")
+        start = self._text_at + self._offset(number - 1)
+        end = self._text_at + self._offset(number)
+        return self._map[start:end].decode("utf-8")
+
+    def pages(self, numbers=None):
+        """(number, text) pairs for the given page numbers, or for every page"""
+        numbers = range(1, self.page_count + 1) if numbers is None else numbers
+        return [(number, self.page(number)) for number in numbers]
+
+
+class TextStore:
+    """Extracted text of input documents, kept per content hash.
+
+    Each document's pages (or slides, or sections) are stored once as
+    ``<sha256>.pages``, a header with byte offsets followed by the UTF-8 text,
+    and read back through mmap. A later task on the same document skips
+    extraction and OCR entirely, and a task with a narrow focus_area can pull
+    only the pages that match it. Least recently used documents are evicted
+    once the store grows past max_bytes.
+    """
+
+    def __init__(self, logger, store_dir=None, max_bytes=None, neighbour_pages=None, max_focus_fraction=None):
+        self.logger = logger
+        store_location = os.environ.get("STORE_LOCATION", ".")
+        self.store_dir = store_dir or os.environ.get("TEXT_STORE_DIR", os.path.join(store_location, "cache", "text"))
+        self.max_bytes = max_bytes or int(os.environ.get("TEXT_STORE_MAX_BYTES", 1024 ** 3))
+        # Pages around a match are kept so a section cut at a page break stays readable
+        self.neighbour_pages = neighbour_pages if neighbour_pages is not None else int(os.environ.get("TEXT_FOCUS_NEIGHBOUR_PAGES", 1))
+        # A selection that keeps most of the document is not worth losing context for
+        self.max_focus_fraction = max_focus_fraction or float(os.environ.get("TEXT_FOCUS_MAX_FRACTION", 0.8))
+        self.db_path = os.path.join(self.store_dir, "index.db")
+        self._lock = threading.Lock()
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute(
+                """
+                create table if not exists documents (
+                    sha256 text primary key,
+                    method text not null,
+                    unit text not null,
+                    page_count integer not null,
+                    size integer not null,
+                    created_at real not null,
+                    last_used real not null
+                )
+                """
+            )
+            conn.execute("create index if not exists documents_last_used_idx on documents (last_used)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _pages_path(self, sha256):
+        return os.path.join(self.store_dir, f"{sha256}.pages")
+
+    def get(self, sha256):
+        """Stored extraction metadata for a document
+
+        Returns:
+            dict: {'sha256', 'method', 'unit', 'page_count'} or None
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "select sha256, method, unit, page_count from documents where sha256 = ?", (sha256,)
+            ).fetchone()
+            if row:
+                conn.execute("update documents set last_used = ? where sha256 = ?", (time.time(), sha256))
+        if not row or not os.path.exists(self._pages_path(sha256)):
+            return None
+        return dict(row)
+
+    def put(self, sha256, method, unit, pages):
+        """Store a document's extracted pages, replacing any earlier extraction"""
+        with self._lock:
+            size = write_pages(self._pages_path(sha256), pages)
+            now = time.time()
+            with self._connect() as conn:
+                conn.execute(
+                    "insert into documents (sha256, method, unit, page_count, size, created_at, last_used) "
+                    "values (?, ?, ?, ?, ?, ?, ?) on conflict(sha256) do update set method = excluded.method, "
+                    "unit = excluded.unit, page_count = excluded.page_count, size = excluded.size, "
+                    "created_at = excluded.created_at, last_used = excluded.last_used",
+                    (sha256, method, unit, len(pages), size, now, now),
+                )
+        self.evict()
+
+    def open(self, sha256):
+        """Memory-mapped pages of a stored document (use as a context manager)"""
+        return PagedText(self._pages_path(sha256))
+
+    def select_pages(self, sha256, focus_area):
+        """Page numbers of a document that a focus area is about
+
+        Explicit ranges in the document's own unit ("pages 12-18" for a PDF,
+        "slide 4" for a deck, "section 2" for a Word document) are used as
+        given. Otherwise pages containing the focus terms are kept, with
+        neighbour_pages on each side, so "Section 3: Photosynthesis" on a PDF
+        searches for photosynthesis instead of sending page 3. Returns None (meaning the whole document) when nothing matches or
+        the selection would keep most of the document anyway.
+        """
+        if not focus_area or not focus_area.strip():
+            return None
+
+        with self._connect() as conn:
+            row = conn.execute("select unit from documents where sha256 = ?", (sha256,)).fetchone()
+        range_pattern = RANGE_PATTERNS.get(row["unit"] if row else "Page")
+
+        with self.open(sha256) as paged:
+            page_count = len(paged)
+            selected = set()
+            for match in range_pattern.finditer(focus_area) if range_pattern else ():
+                first = int(match.group(1))
+                last = int(match.group(2) or first)
+                selected.update(range(max(1, first), min(page_count, last) + 1))
+
+            if not selected:
+                terms = focus_terms(focus_area)
+                if not terms:
+                    return None
+                # A page must mention most of the terms, so common words alone do not select it
+                needed = max(1, (len(terms) + 1) // 2)
+                for number in range(1, page_count + 1):
+                    text = paged.page(number).lower()
+                    if sum(1 for term in terms if term in text) >= needed:
+                        first = max(1, number - self.neighbour_pages)
+                        last = min(page_count, number + self.neighbour_pages)
+                        selected.update(range(first, last + 1))
+
+        if not selected or len(selected) > page_count * self.max_focus_fraction:
+            return None
+        return sorted(selected)
+
+    def evict(self):
+        """Delete least recently used documents until the store fits in max_bytes"""
+        with self._lock, self._connect() as conn:
+            total = conn.execute("select coalesce(sum(size), 0) from documents").fetchone()[0]
+            if total <= self.max_bytes:
+                return 0
+
+            evicted = 0
+            for row in conn.execute("select sha256, size from documents order by last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                pages_path = self._pages_path(row["sha256"])
+                if os.path.exists(pages_path):
+                    os.remove(pages_path)
+                conn.execute("delete from documents where sha256 = ?", (row["sha256"],))
+                total -= row["size"]
+                evicted += 1
+
+        if evicted:
+            self.logger.info(f"Evicted {evicted} documents from text store")
+        return evicted
@@ -0,0 +1,177 @@
+import os
+import json
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+from .text_extraction import TOKENS_PER_PAGE_IMAGE, CHARS_PER_TOKEN, IMAGE_EXTENSIONS
+from .logger import Logger
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+# USD per million prompt / output tokens; MODEL_PRICES (JSON) adds or overrides entries
+DEFAULT_MODEL_PRICES = {
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+    "gemini-1.5-flash": (0.075, 0.30),
+    "gemini-1.5-pro": (1.25, 5.00),
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-pro": (1.25, 10.00),
+}
+
+
+@lru_cache(maxsize=1)
+def model_prices():
+    prices = dict(DEFAULT_MODEL_PRICES)
+    prices.update({name: tuple(price) for name, price in json.loads(os.environ.get("MODEL_PRICES", "{}")).items()})
+    return prices
+
+
+def estimate_cost(model_name, prompt_tokens, output_tokens):
+    """Cost in USD of a call, or 0 for models without a known price"""
+    prompt_price, output_price = model_prices().get(model_name or "", (0, 0))
+    return round((prompt_tokens * prompt_price + output_tokens * output_price) / 1_000_000, 6)
+
+
+def estimate_file_tokens(path):
+    """Prompt tokens Gemini will bill for one input file, estimated without uploading it"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".pdf":
+        from pypdf import PdfReader
+        try:
+            return len(PdfReader(path).pages) * TOKENS_PER_PAGE_IMAGE
+        except Exception:
+            # Encrypted or damaged PDFs are left for Gemini to judge; estimate them by size
+            pass
+    if extension in IMAGE_EXTENSIONS:
+        return TOKENS_PER_PAGE_IMAGE
+    return os.path.getsize(path) // CHARS_PER_TOKEN
+
+
+def estimate_request_tokens(file_paths, *prompts):
+    """Prompt tokens of a whole request: every input file plus the prompt texts"""
+    return sum(estimate_file_tokens(path) for path in file_paths) + sum(len(prompt or "") for prompt in prompts) // CHARS_PER_TOKEN
+
+
+@dataclass
+class BudgetDecision:
+    """Outcome of the pre-flight budget check"""
+    action: str  # ALLOW, DOWNGRADE or REJECT
+    estimated_tokens: int
+    reason: Optional[str] = None
+    model_name: Optional[str] = None  # the model to use instead, when downgraded
+
+
+class TokenBudget:
+    """Applies the per-user-type token budgets before a task is sent to the model.
+
+    A task whose estimated prompt is over the user type's max_task_input_tokens
+    is rejected, or downgraded to the user type's downgrade_model when its
+    oversize_action is DOWNGRADE. A task that would take the user over their
+    daily_token_budget is rejected. Budgets left NULL are unlimited.
+    """
+
+    def __init__(self, logger, db_service):
+        self.logger = logger
+        self.db_service = db_service
+        self.enabled = os.environ.get("TOKEN_BUDGETS", "true").lower() == "true"
+
+    def check(self, user, estimated_tokens):
+        """Decide what to do with a task
+
+        Args:
+            user: The task's user row (id, user_type_id), or None
+            estimated_tokens: Pre-flight estimate of the prompt tokens
+
+        Returns:
+            BudgetDecision
+        """
+        if not self.enabled or not user or not user.get("user_type_id"):
+            return BudgetDecision("ALLOW", estimated_tokens)
+        try:
+            user_type = self.db_service.get_user_type(user["user_type_id"]) or {}
+            daily_budget = user_type.get("daily_token_budget")
+            if daily_budget:
+                used_today = self.db_service.get_user_tokens_today(user["id"])
+                if used_today + estimated_tokens > daily_budget:
+                    return BudgetDecision(
+                        "REJECT", estimated_tokens,
+                        f"Daily token budget exceeded ({used_today} used, ~{estimated_tokens} needed, {daily_budget} allowed)"
+                    )
+        except Exception as e:
+            # Accounting must never take the pipeline down with it
+            self.logger.warning(f"Token budget check skipped: {str(e)}")
+            return BudgetDecision("ALLOW", estimated_tokens)
+
+        max_tokens = user_type.get("max_task_input_tokens")
+        if not max_tokens or estimated_tokens <= max_tokens:
+            return BudgetDecision("ALLOW", estimated_tokens)
+
+        reason = f"Task input of ~{estimated_tokens} tokens is over the {max_tokens} token limit for '{user_type.get('name')}' users"
+        if user_type.get("oversize_action") == "DOWNGRADE" and user_type.get("downgrade_model"):
+            return BudgetDecision("DOWNGRADE", estimated_tokens, reason, user_type["downgrade_model"])
+        return BudgetDecision("REJECT", estimated_tokens, reason)
+
+
+class TokenLedger:
+    """Token usage and latency of the model calls made for one task.
+
+    AiServices records every call's usage metadata here (calls may come from
+    several map threads at once); the pipeline then writes the rows to the
+    token_usage table through the write-behind buffer.
+    """
+
+    def __init__(self, task_id):
+        self.task_id = task_id
+        self._rows = []
+        self._lock = threading.Lock()
+
+    def preflight(self, decision, model_name):
+        """Record the pre-flight estimate and budget decision"""
+        self._add({
+            "call_type": "PREFLIGHT",
+            "model_name": model_name,
+            "prompt_tokens": decision.estimated_tokens,
+            "decision": decision.action
+        })
+
+    def record(self, call_type, model_name, usage_metadata=None, latency_seconds=None):
+        """Record one model call from its response's usage_metadata"""
+        prompt_tokens = getattr(usage_metadata, "prompt_token_count", 0) or 0
+        output_tokens = getattr(usage_metadata, "candidates_token_count", 0) or 0
+        self._add({
+            "call_type": call_type,
+            "model_name": model_name,
+            "prompt_tokens": prompt_tokens,
+            "output_tokens": output_tokens,
+            "cached_tokens": getattr(usage_metadata, "cached_content_token_count", 0) or 0,
+            "total_tokens": getattr(usage_metadata, "total_token_count", 0) or prompt_tokens + output_tokens,
+            "latency_ms": round(latency_seconds * 1000) if latency_seconds is not None else None,
+            "cost_usd": estimate_cost(model_name, prompt_tokens, output_tokens)
+        })
+
+    def _add(self, row):
+        # Bulk inserts through PostgREST need every row to have the same columns
+        row = {
+            "task_id": self.task_id, "prompt_tokens": 0, "output_tokens": 0, "cached_tokens": 0,
+            "total_tokens": 0, "latency_ms": None, "cost_usd": 0, "decision": None, **row
+        }
+        with self._lock:
+            self._rows.append(row)
+
+    def rows(self, user_id=None):
+        """The recorded rows, ready for the token_usage table"""
+        with self._lock:
+            return [{**row, "user_id": user_id} for row in self._rows]
+
+    def totals(self):
+        """Summed prompt, output and total tokens and cost of the model calls so far"""
+        with self._lock:
+            calls = [row for row in self._rows if row["call_type"] != "PREFLIGHT"]
+        return {
+            "prompt_tokens": sum(row["prompt_tokens"] for row in calls),
+            "output_tokens": sum(row["output_tokens"] for row in calls),
+            "total_tokens": sum(row["total_tokens"] for row in calls),
+            "cost_usd": round(sum(row["cost_usd"] for row in calls), 6)
+        }
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import threading
+from postgrest.exceptions import APIError
+from .logger import Logger
+import dotenv
+
+dotenv.load_dotenv(override=True)
+
+TERMINAL_STATUSES = {"COMPLETED", "FAILED", "CANCELLED"}
+
+
+class WriteBehindBuffer:
+    """Coalesces task status and progress updates, filestore and token_usage inserts into bulk writes.
+
+    Status and progress updates are coalesced per task (only the latest value is written),
+    filestore and token_usage rows are inserted in one request per table, and
+    everything is flushed when the buffer reaches max_items, every
+    flush_interval seconds, or immediately when a task reaches a terminal
+    status.
+
+    Each table is written on its own, in the order filestore, statuses,
+    token_usage, so a failing table only holds back its own rows: a task's
+    status waits for its own filestore row (it never becomes COMPLETED without
+    its output), but accounting can never keep statuses from landing. When
+    the database rejects a bulk write, the batch is split in halves until the
+    rejected rows are isolated, so one bad row does not hold back the rest.
+    Rows that still fail after max_attempts flushes are dropped and appended
+    to the dead-letter file. Flushes never overlap.
+    """
+
+    def __init__(self, logger, db_service, max_items=None, flush_interval=None, max_attempts=None, dead_letter_path=None):
+        self.logger = logger
+        self.db_service = db_service
+        self.max_items = max_items or int(os.environ.get("WRITE_BUFFER_MAX_ITEMS", 50))
+        self.flush_interval = flush_interval or float(os.environ.get("WRITE_BUFFER_FLUSH_INTERVAL", 2))
+        self.max_attempts = max_attempts or int(os.environ.get("WRITE_BUFFER_MAX_ATTEMPTS", 20))
+        store_location = os.environ.get("STORE_LOCATION", ".")
+        self.dead_letter_path = dead_letter_path or os.environ.get(
+            "WRITE_BUFFER_DEAD_LETTER", os.path.join(store_location, "write_buffer_dead_letter.jsonl")
+        )
+        # task_id -> (status, failed attempts); filestore and token_usage entries are [row, failed attempts]
+        self._statuses = {}
+        # task_id -> latest (bytes_generated, chunks, tokens); best effort, never retried
+        self._progress = {}
+        self._files = []
+        self._usage = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def _pending(self):
+        return len(self._statuses) + len(self._files) + len(self._usage)
+
+    def update_task_status(self, task_id, status):
+        """Buffer a status change; terminal statuses are flushed right away"""
+        status = status.upper()
+        with self._lock:
+            # Re-inserting moves the task to the end so coalesced updates keep arrival order
+            self._statuses.pop(task_id, None)
+            self._statuses[task_id] = (status, 0)
+            pending = self._pending()
+
+        if status in TERMINAL_STATUSES or pending >= self.max_items:
+            self.flush()
+        return True
+
+    def update_task_progress(self, task_id, bytes_generated, chunks, tokens=None):
+        """Buffer a streaming progress tick; only the latest one per task is written on the next flush"""
+        with self._lock:
+            self._progress[task_id] = (bytes_generated, chunks, tokens)
+        return True
+
+    def insert_file(self, file_data):
+        """Buffer a filestore row"""
+        with self._lock:
+            self._files.append([file_data, 0])
+            pending = self._pending()
+
+        if pending >= self.max_items:
+            self.flush()
+        return True
+
+    def insert_usage(self, rows):
+        """Buffer token_usage rows"""
+        if not rows:
+            return True
+        with self._lock:
+            self._usage.extend([row, 0] for row in rows)
+            pending = self._pending()
+
+        if pending >= self.max_items:
+            self.flush()
+        return True
+
+    def flush(self):
+        """Write everything buffered so far
+
+        Returns:
+            bool: True if all buffered writes succeeded
+        """
+        with self._flush_lock:
+            with self._lock:
+                statuses, self._statuses = self._statuses, {}
+                progress, self._progress = self._progress, {}
+                files, self._files = self._files, []
+                usage, self._usage = self._usage, []
+
+            for task_id, (bytes_generated, chunks, tokens) in progress.items():
+                # Progress is informational: update_task_progress logs failures and they are not retried
+                self.db_service.update_task_progress(task_id, bytes_generated, chunks, tokens)
+
+            if not statuses and not files and not usage:
+                return True
+
+            failed_files = self._write("filestore", files, self.db_service.insert_files)
+
+            # A status waits for its task's filestore row, so COMPLETED never lands before the output
+            blocked = {row.get("task_id") for row, _ in failed_files}
+            held = {task_id: entry for task_id, entry in statuses.items() if task_id in blocked}
+            entries = [
+                [{"id": task_id, "status": status}, attempts]
+                for task_id, (status, attempts) in statuses.items() if task_id not in blocked
+            ]
+            failed_statuses = self._write("task status", entries, self.db_service.apply_task_status_updates)
+            failed_usage = self._write("token_usage", usage, self.db_service.insert_token_usage)
+
+            retry_statuses = dict(held)
+            retry_statuses.update((row["id"], (row["status"], attempts)) for row, attempts in failed_statuses)
+            if failed_files or retry_statuses or failed_usage:
+                with self._lock:
+                    # Put writes back in front, without overriding statuses that arrived meanwhile
+                    self._files = failed_files + self._files
+                    self._usage = failed_usage + self._usage
+                    newer = self._statuses
+                    self._statuses = retry_statuses
+                    for task_id, entry in newer.items():
+                        self._statuses.pop(task_id, None)
+                        self._statuses[task_id] = entry
+                return False
+
+            self.logger.info(f"Flushed {len(statuses)} status updates, {len(files)} filestore rows and {len(usage)} token_usage rows")
+            return True
+
+    def _write(self, table, entries, write):
+        """Write one table's rows in one request
+
+        A batch the database rejects (APIError) is bisected so only the offending rows are
+        retried; other errors (network, timeouts) retry the whole batch without extra requests.
+
+        Returns:
+            list: The [row, attempts] entries to retry; rows out of attempts are dead-lettered instead
+        """
+        if not entries:
+            return []
+        try:
+            write([row for row, _ in entries])
+            return []
+        except Exception as e:
+            if isinstance(e, APIError) and len(entries) > 1:
+                middle = len(entries) // 2
+                return self._write(table, entries[:middle], write) + self._write(table, entries[middle:], write)
+            retry = [[row, attempts + 1] for row, attempts in entries if attempts + 1 < self.max_attempts]
+            dropped = [row for row, attempts in entries if attempts + 1 >= self.max_attempts]
+            self.logger.error(f"Write-behind flush of {len(entries)} {table} rows failed, will retry {len(retry)}: {str(e)}")
+            if dropped:
+                self._dead_letter(table, dropped, e)
+            return retry
+
+    def _dead_letter(self, table, rows, error):
+        """Append rows that could not be written to the dead-letter file"""
+        self.logger.error(f"Dropping {len(rows)} {table} rows after {self.max_attempts} failed flushes")
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.dead_letter_path)), exist_ok=True)
+            with open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps({"table": table, "row": row, "error": str(error), "at": time.time()}, default=str) + "\n")
+        except Exception as e:
+            self.logger.error(f"Could not write dead-letter rows: {str(e)}")
+
+    def close(self):
+        """Stop the background flusher and write what is left"""
+        self._stop.set()
+        self._thread.join(self.flush_interval + 1)
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
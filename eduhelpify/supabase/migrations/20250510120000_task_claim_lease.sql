@@ -0,0 +1,44 @@
+-- Lease columns so several pipeline replicas can drain the queue without double-processing
+ALTER TABLE "task" ADD COLUMN IF NOT EXISTS claimed_by text;
+ALTER TABLE "task" ADD COLUMN IF NOT EXISTS lease_expires_at timestamp with time zone;
+
+CREATE INDEX IF NOT EXISTS task_status_lease_idx ON "task" (status, lease_expires_at);
+
+-- Atomically claim up to p_batch_size tasks for one worker.
+-- Picks QUEUED tasks plus INPROGRESS tasks whose lease has expired (crashed workers).
+-- SKIP LOCKED lets concurrent callers claim disjoint batches instead of blocking.
+CREATE OR REPLACE FUNCTION claim_tasks(p_worker_id text, p_batch_size integer, p_lease_seconds integer)
+RETURNS SETOF "task" AS $$
+  BEGIN
+    RETURN QUERY
+    UPDATE "task" t
+    SET status = 'INPROGRESS',
+        claimed_by = p_worker_id,
+        lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+        updated_at = now()
+    WHERE t.id IN (
+      SELECT id FROM "task"
+      WHERE status = 'QUEUED'
+         OR (status = 'INPROGRESS' AND lease_expires_at < now())
+      ORDER BY created_at
+      LIMIT p_batch_size
+      FOR UPDATE SKIP LOCKED
+    )
+    RETURNING t.*;
+  END;
+$$ LANGUAGE plpgsql;
+
+-- Extend the lease on tasks a worker is still processing.
+-- Returns the ids that are still owned by the worker.
+CREATE OR REPLACE FUNCTION renew_task_leases(p_worker_id text, p_task_ids uuid[], p_lease_seconds integer)
+RETURNS SETOF uuid AS $$
+  BEGIN
+    RETURN QUERY
+    UPDATE "task"
+    SET lease_expires_at = now() + make_interval(secs => p_lease_seconds)
+    WHERE id = ANY(p_task_ids)
+      AND claimed_by = p_worker_id
+      AND status = 'INPROGRESS'
+    RETURNING id;
+  END;
+$$ LANGUAGE plpgsql;
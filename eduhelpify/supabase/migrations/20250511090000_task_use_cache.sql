@@ -0,0 +1,2 @@
+-- Per-task opt-out of the pipeline's response cache (set to false to force a fresh generation)
+ALTER TABLE "task" ADD COLUMN IF NOT EXISTS use_cache boolean NOT NULL DEFAULT true;
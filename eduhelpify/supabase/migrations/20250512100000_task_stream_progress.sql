@@ -0,0 +1,5 @@
+-- Progress of streaming generations, updated by the processing pipeline while output arrives
+ALTER TABLE "task" ADD COLUMN IF NOT EXISTS progress_bytes bigint NOT NULL DEFAULT 0;
+ALTER TABLE "task" ADD COLUMN IF NOT EXISTS progress_chunks integer NOT NULL DEFAULT 0;
+ALTER TABLE "task" ADD COLUMN IF NOT EXISTS progress_tokens integer;
+ALTER TABLE "task" ADD COLUMN IF NOT EXISTS progress_updated_at timestamp with time zone;
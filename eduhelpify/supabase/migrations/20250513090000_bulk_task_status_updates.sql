@@ -0,0 +1,22 @@
+-- Apply many task status changes in one call (used by the pipeline's write-behind buffer).
+-- p_updates is a JSON array of {"id": <task uuid>, "status": <task_status_enum>}.
+-- Terminal statuses also release the worker lease.
+CREATE OR REPLACE FUNCTION apply_task_status_updates(p_updates jsonb)
+RETURNS integer AS $$
+  DECLARE
+    updated_count integer;
+  BEGIN
+    UPDATE "task" t
+    SET status = (u->>'status')::task_status_enum,
+        lease_expires_at = CASE
+          WHEN u->>'status' IN ('COMPLETED', 'FAILED', 'CANCELLED') THEN NULL
+          ELSE t.lease_expires_at
+        END,
+        updated_at = now()
+    FROM jsonb_array_elements(p_updates) u
+    WHERE t.id = (u->>'id')::uuid;
+
+    GET DIAGNOSTICS updated_count = ROW_COUNT;
+    RETURN updated_count;
+  END;
+$$ LANGUAGE plpgsql;
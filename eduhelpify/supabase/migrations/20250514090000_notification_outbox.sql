@@ -0,0 +1,40 @@
+-- Outbox of task notification emails. The pipeline writes one row per task;
+-- a separate sender drains it in batches through Resend.
+CREATE TABLE IF NOT EXISTS notification_outbox (
+  id uuid primary key default uuid_generate_v4(),
+  task_id uuid not null unique references Task(id), -- one notification per task
+  payload jsonb not null,
+  status varchar not null default 'PENDING', -- PENDING, SENDING, SENT, FAILED
+  attempts integer not null default 0,
+  next_attempt_at timestamp with time zone not null default now(),
+  claimed_by text,
+  last_error text,
+  sent_at timestamp with time zone,
+  created_at timestamp with time zone default now(),
+  updated_at timestamp with time zone default now()
+);
+
+CREATE INDEX IF NOT EXISTS notification_outbox_due_idx ON notification_outbox (status, next_attempt_at);
+
+-- Atomically claim due notifications for one sender.
+-- SENDING rows whose claim has lapsed (crashed sender) are claimed again.
+CREATE OR REPLACE FUNCTION claim_outbox_batch(p_worker_id text, p_batch_size integer, p_lease_seconds integer)
+RETURNS SETOF notification_outbox AS $$
+  BEGIN
+    RETURN QUERY
+    UPDATE notification_outbox o
+    SET status = 'SENDING',
+        claimed_by = p_worker_id,
+        attempts = o.attempts + 1,
+        next_attempt_at = now() + make_interval(secs => p_lease_seconds),
+        updated_at = now()
+    WHERE o.id IN (
+      SELECT id FROM notification_outbox
+      WHERE status IN ('PENDING', 'SENDING') AND next_attempt_at <= now()
+      ORDER BY created_at
+      LIMIT p_batch_size
+      FOR UPDATE SKIP LOCKED
+    )
+    RETURNING o.*;
+  END;
+$$ LANGUAGE plpgsql;
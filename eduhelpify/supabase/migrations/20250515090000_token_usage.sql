@@ -0,0 +1,65 @@
+-- Token usage of every model call made for a task, recorded by the processing pipeline.
+-- PREFLIGHT rows hold the local estimate made before anything was uploaded and the
+-- budget decision taken on it; the other rows hold Gemini's usage metadata.
+CREATE TABLE IF NOT EXISTS token_usage (
+  id uuid primary key default uuid_generate_v4(),
+  task_id uuid not null references Task(id),
+  user_id uuid references "User"(id),
+  call_type varchar not null, -- PREFLIGHT, GENERATE, STREAM, MAP, CACHED
+  model_name varchar,
+  prompt_tokens integer not null default 0,
+  output_tokens integer not null default 0,
+  cached_tokens integer not null default 0,
+  total_tokens integer not null default 0,
+  latency_ms integer,
+  cost_usd numeric(12, 6) not null default 0,
+  decision varchar, -- PREFLIGHT only: ALLOW, DOWNGRADE or REJECT
+  created_at timestamp with time zone default now()
+);
+
+CREATE INDEX IF NOT EXISTS token_usage_task_idx ON token_usage (task_id);
+CREATE INDEX IF NOT EXISTS token_usage_user_created_idx ON token_usage (user_id, created_at);
+
+-- Budgets per user type; NULL means unlimited
+ALTER TABLE "usertype" ADD COLUMN IF NOT EXISTS max_task_input_tokens integer;
+ALTER TABLE "usertype" ADD COLUMN IF NOT EXISTS daily_token_budget bigint;
+-- What to do with a task over max_task_input_tokens: REJECT it, or DOWNGRADE it to downgrade_model
+ALTER TABLE "usertype" ADD COLUMN IF NOT EXISTS oversize_action varchar not null default 'REJECT';
+ALTER TABLE "usertype" ADD COLUMN IF NOT EXISTS downgrade_model varchar;
+
+UPDATE "usertype" SET max_task_input_tokens = 1000000, daily_token_budget = 20000000,
+  oversize_action = 'DOWNGRADE', downgrade_model = 'gemini-2.0-flash-lite'
+WHERE name = 'teacher';
+UPDATE "usertype" SET max_task_input_tokens = 300000, daily_token_budget = 3000000, oversize_action = 'REJECT'
+WHERE name IN ('student', 'default');
+
+-- Usage per task: estimate against what was actually billed
+CREATE OR REPLACE VIEW task_token_usage AS
+SELECT
+  task_id,
+  user_id,
+  max(prompt_tokens) FILTER (WHERE call_type = 'PREFLIGHT') AS estimated_prompt_tokens,
+  max(decision) FILTER (WHERE call_type = 'PREFLIGHT') AS budget_decision,
+  coalesce(sum(prompt_tokens) FILTER (WHERE call_type <> 'PREFLIGHT'), 0) AS prompt_tokens,
+  coalesce(sum(output_tokens) FILTER (WHERE call_type <> 'PREFLIGHT'), 0) AS output_tokens,
+  coalesce(sum(total_tokens) FILTER (WHERE call_type <> 'PREFLIGHT'), 0) AS total_tokens,
+  count(*) FILTER (WHERE call_type NOT IN ('PREFLIGHT', 'CACHED')) AS model_calls,
+  sum(latency_ms) FILTER (WHERE call_type <> 'PREFLIGHT') AS latency_ms,
+  sum(cost_usd) AS cost_usd,
+  string_agg(DISTINCT model_name, ', ') FILTER (WHERE call_type <> 'PREFLIGHT') AS models,
+  min(created_at) AS started_at
+FROM token_usage
+GROUP BY task_id, user_id;
+
+-- Usage per user and day, as checked against usertype.daily_token_budget
+CREATE OR REPLACE VIEW user_token_usage_daily AS
+SELECT
+  user_id,
+  (created_at AT TIME ZONE 'UTC')::date AS usage_date,
+  count(DISTINCT task_id) AS tasks,
+  coalesce(sum(prompt_tokens) FILTER (WHERE call_type <> 'PREFLIGHT'), 0) AS prompt_tokens,
+  coalesce(sum(output_tokens) FILTER (WHERE call_type <> 'PREFLIGHT'), 0) AS output_tokens,
+  coalesce(sum(total_tokens) FILTER (WHERE call_type <> 'PREFLIGHT'), 0) AS total_tokens,
+  sum(cost_usd) AS cost_usd
+FROM token_usage
+GROUP BY user_id, (created_at AT TIME ZONE 'UTC')::date;
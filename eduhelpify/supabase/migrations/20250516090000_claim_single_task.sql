@@ -0,0 +1,39 @@
+-- Atomically claim one task for a worker (used by /process/<task_id> before a worker runs it).
+-- Claims QUEUED tasks, FAILED tasks (an explicit request may retry them) and INPROGRESS tasks
+-- whose lease has expired. Returns no row when the task is missing or owned by a live worker,
+-- so a task is never run by /process/<task_id> and /process_queue at the same time.
+CREATE OR REPLACE FUNCTION claim_task(p_task_id uuid, p_worker_id text, p_lease_seconds integer)
+RETURNS SETOF "task" AS $$
+  BEGIN
+    RETURN QUERY
+    UPDATE "task" t
+    SET status = 'INPROGRESS',
+        claimed_by = p_worker_id,
+        lease_expires_at = now() + make_interval(secs => p_lease_seconds),
+        updated_at = now()
+    WHERE t.id = p_task_id
+      AND (
+        t.status IN ('QUEUED', 'FAILED')
+        OR (t.status = 'INPROGRESS' AND t.lease_expires_at < now())
+      )
+    RETURNING t.*;
+  END;
+$$ LANGUAGE plpgsql;
+
+-- Put a claimed task back in the queue (e.g. while the model provider is unavailable).
+-- Only the worker holding the claim can release it.
+CREATE OR REPLACE FUNCTION release_task(p_task_id uuid, p_worker_id text)
+RETURNS SETOF uuid AS $$
+  BEGIN
+    RETURN QUERY
+    UPDATE "task"
+    SET status = 'QUEUED',
+        claimed_by = NULL,
+        lease_expires_at = NULL,
+        updated_at = now()
+    WHERE id = p_task_id
+      AND claimed_by = p_worker_id
+      AND status = 'INPROGRESS'
+    RETURNING id;
+  END;
+$$ LANGUAGE plpgsql;